@@ -208,23 +208,74 @@ class BaseExp(object):
         self.panel_reset()
         self.save()
         self.init_summary()
-
-        self.log.info('%s: running %s with parameters in %s' % (self.name,
-                                                                self.__class__.__name__,
-                                                                self.snapshot_f,
-                                                                )
-                      )
-        if self.parameters['shape']:
-                self.shaper.run_shape(self.parameters['shape'])
-        while True: #is this while necessary
-            utils.run_state_machine(start_in='idle',
-                                    error_state='idle',
-                                    error_callback=self.log_error_callback,
-                                    idle=self._run_idle,
-                                    sleep=self._run_sleep,
-                                    session=self._run_session,
-                                    free_food_block=self._free_food
-                                    )
+        self.start_sampler()
+        try:
+            self.track_hopper_latency()
+
+            self.log.info('%s: running %s with parameters in %s' % (self.name,
+                                                                    self.__class__.__name__,
+                                                                    self.snapshot_f,
+                                                                    )
+                          )
+            if self.parameters['shape']:
+                    self.shaper.run_shape(self.parameters['shape'])
+            while True: #is this while necessary
+                utils.run_state_machine(start_in='idle',
+                                        error_state='idle',
+                                        error_callback=self.log_error_callback,
+                                        idle=self._run_idle,
+                                        sleep=self._run_sleep,
+                                        session=self._run_session,
+                                        free_food_block=self._free_food
+                                        )
+        finally:
+            self.stop_sampler()
+
+    def start_sampler(self):
+        """starts the panel's background input sampler if parameters has an
+        'input_sampler' entry, e.g. {"rate": 1000.0, "seconds": 600}. The ring
+        buffer is written to <experiment_path>/<subject>_inputs.*"""
+        config = self.parameters.get('input_sampler')
+        if not config or not hasattr(self.panel,'start_sampler'):
+            return None
+        if config is True:
+            config = {}
+        rate = config.get('rate', 1000.0)
+        path = os.path.join(self.parameters['experiment_path'],
+                            '%s_inputs' % self.parameters['subject'])
+        self.panel.start_sampler(path,
+                                 rate=rate,
+                                 length=int(rate * config.get('seconds', 600)))
+        self.log.info('recording inputs at %s Hz to %s.samples.npy' % (rate, path))
+        return self.panel.sampler
+
+    def stop_sampler(self):
+        """stops the panel's input sampler, if start_sampler started one"""
+        if getattr(self.panel,'sampler',None) is not None:
+            self.panel.stop_sampler()
+
+    def track_hopper_latency(self):
+        """keeps the panel hopper's up/down latency histograms if parameters
+        has a 'hopper_latency' entry, e.g. {"auto_max_lag": true}. they are
+        saved to its "path" (default ~/.pyoperant/<panel_name>_hopper_latency.json)
+        so they carry across sessions on the panel. with "auto_max_lag" the
+        hopper sets max_lag from them (see components.Hopper.track_latency)"""
+        config = self.parameters.get('hopper_latency')
+        hopper = getattr(self.panel,'hopper',None)
+        if not config or not hasattr(hopper,'track_latency'):
+            return None
+        if config is True:
+            config = {}
+        config = dict(config)
+        path = config.pop('path',None)
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'),'.pyoperant',
+                                '%s_hopper_latency.json' % self.parameters.get('panel_name','panel'))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        hopper.track_latency(path=path,**config)
+        self.log.info('hopper latencies in %s, max_lag %s s' % (path,hopper.max_lag))
+        return path
 
     def _run_idle(self):
         self.log.debug('Starting _run_idle')
@@ -242,8 +293,15 @@ class BaseExp(object):
 
 
     # defining functions for sleep
+    def house_light_transition(self, on):
+        """turns the house light on or off for a sleep transition, fading it
+        if parameters has a 'light_ramp' entry (see
+        utils.house_light_transition)"""
+        return utils.house_light_transition(self.panel, self.parameters, on)
+
     def sleep_pre(self):
         self.log.debug('lights off. going to sleep...')
+        self.house_light_transition(False)
         return 'main'
 
     def sleep_main(self):
@@ -258,7 +316,7 @@ class BaseExp(object):
 
     def sleep_post(self):
         self.log.debug('ending sleep')
-        self.panel.house_light.on()
+        self.house_light_transition(True)
         self.init_summary()
         return None
 
@@ -368,6 +426,23 @@ class BaseExp(object):
         return 'idle'
 
 
+    def run_consequence(self, consequence, value, ports=None, on_peck=None, poll_interval=0.05):
+        """runs consequence(value=value), e.g. self.panel.reward, on a
+        background thread while watching ports (dict of name:PeckPort) for
+        pecks. on_peck(selection) is called with the PortSelector.Selection of
+        every new beam break until the consequence is done; beams already
+        broken when it starts don't count. returns what the consequence
+        returns, re-raising any error it raised"""
+        future = utils.run_async(consequence, value=value)
+        if ports:
+            # one selection for the whole consequence, so no peck falls
+            # between two waits
+            selector = components.PortSelector(ports)
+            for selection in selector.pecks(future.done, timeout=poll_interval):
+                if on_peck is not None:
+                    on_peck(selection)
+        return future.result()
+
     # gentner-lab specific functions
     def init_summary(self):
         """ initializes an empty summary dictionary """
@@ -377,6 +452,7 @@ class BaseExp(object):
                         'hopper_wont_go_down': 0,
                         'hopper_already_up': 0,
                         'responses_during_feed': 0,
+                        'responses_during_punish': 0,
                         'responses': 0,
                         'last_trial_time': [],
                         }
@@ -392,7 +468,15 @@ class BaseExp(object):
             f.write("Hopper won't go down failures today: %i\n" % self.summary['hopper_wont_go_down'])
             f.write("Hopper already up failures today: %i\n" % self.summary['hopper_already_up'])
             f.write("Responses during feed: %i\n" % self.summary['responses_during_feed'])
+            f.write("Responses during punish: %i\n" % self.summary.get('responses_during_punish', 0))
             f.write("Rf'd responses: %i\n" % self.summary['responses'])
+            hopper = getattr(self.panel,'hopper',None)
+            if isinstance(getattr(hopper,'latency',None),dict):
+                for direction in ('up','down'):
+                    stats = hopper.latency[direction].summary()
+                    if stats['n']:
+                        f.write("Hopper %s latency p50/p99: %.3f/%.3f s (n=%i, timeouts=%i)\n"
+                                % (direction,stats['p50'],stats['p99'],stats['n'],stats['failures']))
 
     def log_error_callback(self, err):
         if err.__class__ is InterfaceError or err.__class__ is ComponentError:
@@ -116,6 +116,11 @@ class PlacePrefExp24hr(base.BaseExp):
 
         self.reinforcement_counter = {'L': None, 'R': None, 'C': None}  ## set up separate reinforcement counters for all perches
 
+        ## read all three perch beams with a single I/O per interface
+        self.perch_bank = components.PeckPortBank({'L': self.panel.left,
+                                                   'C': self.panel.center,
+                                                   'R': self.panel.right})
+
         self.arduino = serial.Serial(self.parameters['arduino_address'], self.parameters['arduino_baud_rate'], timeout = 1)
         self.arduino.reset_input_buffer()
 
@@ -150,21 +155,19 @@ class PlacePrefExp24hr(base.BaseExp):
                     return
 
                 ## for each iteration, check for perching behavior.
-                left_perched = self.panel.left.status()
-                center_perched = self.panel.center.status()
-                right_perched = self.panel.right.status()
+                perched = self.perch_bank.status()
 
-                if left_perched:
+                if perched['L']:
                     self.current_perch['IR'] = self.panel.left
                     self.current_perch['IRName'] = 'L'
                     self.current_perch['speaker'] = 0
                     break
-                if center_perched:
+                if perched['C']:
                     self.current_perch['IR'] = self.panel.center
                     self.current_perch['IRName'] = 'C'
                     self.current_perch['speaker'] = 1
                     break
-                if right_perched:
+                if perched['R']:
                     self.current_perch['IR'] = self.panel.right
                     self.current_perch['IRName'] = 'R'
                     self.current_perch['speaker'] = 2
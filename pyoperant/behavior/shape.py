@@ -208,14 +208,16 @@ class Shaper(object):
         return temp
 
     def _flashing_main(self, component, duration, period=1):
+        # the panel's blink scheduler does the flashing; this only watches
+        # for a peck
+        blink = []
         def temp():
+            if not blink:
+                blink.append(component.blink(period=period, duration=duration))
             elapsed_time = (dt.datetime.now() - self.polling_start).total_seconds()
             if elapsed_time <= duration:
-                if ((elapsed_time % period) - (period / 2.0)) < 0:
-                    component.on()
-                else:
-                    component.off()
                 if component.status():
+                    blink[0].cancel()
                     component.off()
                     self.responded_poll = True
                     self.last_response = component.name
@@ -223,6 +225,7 @@ class Shaper(object):
                 utils.wait(.015)
                 return 'main'
             else:
+                blink[0].cancel()
                 component.off()
                 return None
         return temp
@@ -263,6 +266,7 @@ class Shaper(object):
     #TODO: there should really be a separate sleeper or some better solution
     def sleep_pre(self):
         self.log.debug('lights off. going to sleep...')
+        utils.house_light_transition(self.panel, self.parameters, False)
         return 'main'
 
     def sleep_main(self):
@@ -277,7 +281,7 @@ class Shaper(object):
 
     def sleep_post(self):
         self.log.debug('ending sleep')
-        self.panel.house_light.on()
+        utils.house_light_transition(self.panel, self.parameters, True)
 #        self.init_summary()
         return None
 
@@ -146,6 +146,12 @@ class TwoAltChoiceExp(base.BaseExp):
                 self.response_ports.update({port_name:port})
             except KeyError:
                 pass
+        self.response_selector = components.PortSelector(self.response_ports,
+                                                         window=self.parameters.get('coincidence_window', 0.0))
+        # ports watched for pecks while a reward or punishment runs
+        self.consequence_ports = dict(self.response_ports)
+        if hasattr(self.panel, 'center'):
+            self.consequence_ports.setdefault('center', self.panel.center)
 
 
 
@@ -399,6 +405,7 @@ class TwoAltChoiceExp(base.BaseExp):
         self.this_trial.events.append(utils.Event(name='center',
                                                   label='peck',
                                                   time=0.0,
+                                                  timestamp=trial_time,
                                                   )
                                             )
 
@@ -412,13 +419,10 @@ class TwoAltChoiceExp(base.BaseExp):
         if 'cue' in self.this_trial.annotations:
             cue = self.this_trial.annotations["cue"]
             self.log.debug("cue light turning on")
-            cue_start = dt.datetime.now()
-            if cue=="red":
-                self.panel.cue.red()
-            elif cue=="green":
-                self.panel.cue.green()
-            elif cue=="blue":
-                self.panel.cue.blue()
+            if cue in ("red","green","blue"):
+                cue_start = self.panel.apply_state({'cue': cue})
+            else:
+                cue_start = dt.datetime.now()
             utils.wait(self.parameters["cue_duration"])
             self.panel.cue.off()
             cue_dur = (dt.datetime.now() - cue_start).total_seconds()
@@ -448,28 +452,30 @@ class TwoAltChoiceExp(base.BaseExp):
 
     def response_main(self):
         response_start = dt.datetime.now()
-        while True:
-            elapsed_time = (dt.datetime.now() - self.this_trial.time).total_seconds()
-            response_time = elapsed_time - self.this_trial.stimulus_event.time
-            if response_time > self.this_trial.annotations['max_wait']:
-                self.panel.speaker.stop()
-                self.this_trial.response = 'none'
-                self.log.info('no response')
-                return
-            for port_name, port in self.response_ports.items():
-                if port.status():
-                    self.this_trial.rt = (dt.datetime.now() - response_start).total_seconds()
-                    self.panel.speaker.stop()
-                    self.this_trial.response = port_name
-                    self.summary['responses'] += 1
-                    response_event = utils.Event(name=port_name,
-                                                 label='peck',
-                                                 time=elapsed_time,
-                                                 )
-                    self.this_trial.events.append(response_event)
-                    self.log.info('response: %s' % (self.this_trial.response))
-                    return
-            utils.wait(.015)
+        deadline = self.this_trial.time + dt.timedelta(seconds=self.this_trial.stimulus_event.time
+                                                       + self.this_trial.annotations['max_wait'])
+        timeout = max((deadline - response_start).total_seconds(), 0.0)
+        selection = self.response_selector.select(timeout=timeout)
+        if selection is None:
+            self.panel.speaker.stop()
+            self.this_trial.response = 'none'
+            self.log.info('no response')
+            return
+
+        peck_time = max(selection.time, response_start)
+        self.this_trial.rt = (peck_time - response_start).total_seconds()
+        self.panel.speaker.stop()
+        self.this_trial.response = selection.name
+        self.summary['responses'] += 1
+        response_event = utils.Event(name=selection.name,
+                                     label='peck',
+                                     time=(peck_time - self.this_trial.time).total_seconds(),
+                                     timestamp=peck_time,
+                                     )
+        self.this_trial.events.append(response_event)
+        if selection.coincident:
+            self.log.info('coincident responses on %s' % ', '.join(sorted(selection.coincident)))
+        self.log.info('response: %s' % (self.this_trial.response))
 
     def response_post(self):
         for port_name, port in self.response_ports.items():
@@ -518,6 +524,19 @@ class TwoAltChoiceExp(base.BaseExp):
                 self.trial_q.update(False, True)
 
 
+    def _peck_during(self, consequence, summary_key):
+        """ on_peck callback for run_consequence: logs each peck as a trial
+        event and counts it in the summary """
+        def record(selection):
+            self.summary[summary_key] += 1
+            self.this_trial.events.append(utils.Event(name=selection.name,
+                                                      label='peck_during_%s' % consequence,
+                                                      time=(selection.time - self.this_trial.time).total_seconds(),
+                                                      timestamp=selection.time,
+                                                      ))
+            self.log.debug('peck on %s during %s' % (selection.name, consequence))
+        return record
+
     def secondary_reinforcement(self,value=1.0):
         return self.panel.center.flash(dur=value)
 
@@ -529,7 +548,9 @@ class TwoAltChoiceExp(base.BaseExp):
         self.summary['feeds'] += 1
         try:
             value = self.parameters['classes'][self.this_trial.class_]['reward_value']
-            reward_event = self.panel.reward(value=value)
+            reward_event = self.run_consequence(self.panel.reward, value,
+                                                ports=self.consequence_ports,
+                                                on_peck=self._peck_during('reward', 'responses_during_feed'))
             self.this_trial.reward = True
 
         # but catch the reward errors
@@ -578,7 +599,9 @@ class TwoAltChoiceExp(base.BaseExp):
 
     def punish_main(self):
         value = self.parameters['classes'][self.this_trial.class_]['punish_value']
-        punish_event = self.panel.punish(value=value)
+        punish_event = self.run_consequence(self.panel.punish, value,
+                                            ports=self.consequence_ports,
+                                            on_peck=self._peck_during('punish', 'responses_during_punish'))
         self.this_trial.punish = True
 
     def punish_post(self):
@@ -164,6 +164,8 @@ class TwoAltChoiceExp(base.BaseExp):
                 self.response_ports.update({port_name:port})
             except KeyError:
                 pass
+        self.response_selector = components.PortSelector(self.response_ports,
+                                                         window=self.parameters.get('coincidence_window', 0.0))
 
 
 
@@ -417,6 +419,7 @@ class TwoAltChoiceExp(base.BaseExp):
         self.this_trial.events.append(utils.Event(name='center',
                                                   label='peck',
                                                   time=0.0,
+                                                  timestamp=trial_time,
                                                   )
                                             )
 
@@ -430,13 +433,10 @@ class TwoAltChoiceExp(base.BaseExp):
         if 'cue' in self.this_trial.annotations:
             cue = self.this_trial.annotations["cue"]
             self.log.debug("cue light turning on")
-            cue_start = dt.datetime.now()
-            if cue=="red":
-                self.panel.cue.red()
-            elif cue=="green":
-                self.panel.cue.green()
-            elif cue=="blue":
-                self.panel.cue.blue()
+            if cue in ("red","green","blue"):
+                cue_start = self.panel.apply_state({'cue': cue})
+            else:
+                cue_start = dt.datetime.now()
             utils.wait(self.parameters["cue_duration"])
             self.panel.cue.off()
             cue_dur = (dt.datetime.now() - cue_start).total_seconds()
@@ -466,67 +466,81 @@ class TwoAltChoiceExp(base.BaseExp):
 
     def response_main(self):
         response_start = dt.datetime.now()
-        early_response_detected = {port_name: False for port_name in self.response_ports}
         last_response_time = {port_name: None for port_name in self.response_ports}
         lockout_period = 0.5 # in seconds, during which early responses will not be accepted
 
+        stim = self.this_trial.stimulus_event
+        lights_on_at = self.this_trial.time + dt.timedelta(seconds=stim.duration)          # cue lights come on
+        valid_at = self.this_trial.time + dt.timedelta(seconds=stim.time + stim.duration)  # responses stop being early
+        deadline = self.this_trial.time + dt.timedelta(seconds=stim.time + self.this_trial.annotations['max_wait'])
+        lights_on = False
+
         while True:
-            elapsed_time = (dt.datetime.now() - self.this_trial.time).total_seconds()
-            response_time = elapsed_time - self.this_trial.stimulus_event.time
+            now = dt.datetime.now()
 
-            if elapsed_time > self.this_trial.stimulus_event.duration:  # if stimulus has finished playing
-                for port_name, port in self.response_ports.items():     # turn on the cue lights
+            if not lights_on and now > lights_on_at:                 # if stimulus has finished playing
+                for port_name, port in self.response_ports.items():  # turn on the cue lights
                     port.on()
+                lights_on = True
 
-            if response_time > self.this_trial.annotations['max_wait']: # if timeout has been reached
+            if now > deadline:                                       # if timeout has been reached
                 self.panel.speaker.stop()
                 self.this_trial.response = 'none'
                 self.log.info('no response')
                 return
 
-            for port_name, port in self.response_ports.items():     # check L&R ports
-                if port.status():                                   # if a beam is broken
-
-                    if response_time > self.this_trial.stimulus_event.duration: # if response  not early
-                        self.this_trial.rt = (dt.datetime.now() - response_start).total_seconds()
-                        self.panel.speaker.stop()                       # stop playing sound
-                        self.this_trial.response = port_name            # add to trial responses
-                        self.summary['responses'] += 1                  # TODO: should early responses be omitted from summaries?
-                        response_event = utils.Event(name=port_name,    # create a response event object
-                                                     label='peck',
-                                                     time=elapsed_time)
-
-                        self.this_trial.events.append(response_event)
-                        self.log.info('response: %s' % (self.this_trial.response))
-                        return
-
-                    elif response_time < self.this_trial.stimulus_event.duration:   # if response is early
-                        if not early_response_detected[port_name]:                  # and beam is not already broken
-                            if (last_response_time[port_name] is None or            # and lockout interval has passed
-                                (elapsed_time - last_response_time[port_name]) > lockout_period):
-
-                                self.this_trial.early_responses.append(str(port_name))
-                                self.this_trial.early_rt.append(elapsed_time)
-
-                                # record whether early response was correct
-                                if str(port_name)==self.parameters['classes'][self.this_trial.class_]['component']:
-                                    self.this_trial.early_correct.append(True)
-                                else:
-                                    self.this_trial.early_correct.append(False)
-
-                                response_event = utils.Event(name=port_name,
-                                                       label='early_peck',
-                                                        time=elapsed_time)
-
-                                self.this_trial.events.append(response_event)
-                                self.log.info('early response: %s' % (port_name))
-                                early_response_detected[port_name] = True
-                                last_response_time[port_name] = elapsed_time
+            # block until a beam is broken or the next phase of the trial starts.
+            # while responses are early, only count new beam breaks so a held
+            # beam is logged once.
+            early = now < valid_at
+            wake_at = [deadline]
+            if early:
+                wake_at.append(valid_at)
+            if not lights_on:
+                wake_at.append(lights_on_at)
+            timeout = max((min(wake_at) - now).total_seconds(), 0.0)
+            selection = self.response_selector.select(timeout=timeout, ignore_held=early)
+            if selection is None:
+                continue
+
+            if not early:                                            # if response not early
+                peck_time = max(selection.time, response_start)
+                self.this_trial.rt = (peck_time - response_start).total_seconds()
+                self.panel.speaker.stop()                            # stop playing sound
+                self.this_trial.response = selection.name            # add to trial responses
+                self.summary['responses'] += 1                       # TODO: should early responses be omitted from summaries?
+                response_event = utils.Event(name=selection.name,    # create a response event object
+                                             label='peck',
+                                             time=(peck_time - self.this_trial.time).total_seconds(),
+                                             timestamp=peck_time)
+
+                self.this_trial.events.append(response_event)
+                self.log.info('response: %s' % (self.this_trial.response))
+                return
 
-                else:
-                    # Reset when no beams are broken
-                    early_response_detected[port_name] = False
-            utils.wait(.015)
+            fired = [(selection.name, selection.time)] + sorted(selection.coincident.items())
+            for port_name, peck_time in fired:                       # response is early
+                elapsed_time = (peck_time - self.this_trial.time).total_seconds()
+                if (last_response_time[port_name] is None or         # and lockout interval has passed
+                    (elapsed_time - last_response_time[port_name]) > lockout_period):
+
+                    self.this_trial.early_responses.append(str(port_name))
+                    self.this_trial.early_rt.append(elapsed_time)
+
+                    # record whether early response was correct
+                    if str(port_name)==self.parameters['classes'][self.this_trial.class_]['component']:
+                        self.this_trial.early_correct.append(True)
+                    else:
+                        self.this_trial.early_correct.append(False)
+
+                    response_event = utils.Event(name=port_name,
+                                                 label='early_peck',
+                                                 time=elapsed_time,
+                                                 timestamp=peck_time)
+
+                    self.this_trial.events.append(response_event)
+                    self.log.info('early response: %s' % (port_name))
+                    last_response_time[port_name] = elapsed_time
 
     def response_post(self):
         for port_name, port in self.response_ports.items():
@@ -1,16 +1,26 @@
 # -*- coding: utf-8 -*-
+import os
+import json
 import time
 import datetime
+import collections
 from pyoperant import hwio, utils, ComponentError
 import logging
 
 logger = logging.getLogger()
 
 class BaseComponent(object):
-    """Base class for physcal component"""
-    def __init__(self, name=None, *args, **kwargs):
+    """Base class for physcal component
+
+    registry is the panel's hwio.OutputRegistry, if any. Components register
+    the outputs they drive with it (see `_register`)."""
+    def __init__(self, name=None, registry=None, *args, **kwargs):
         self.name = name
-        pass
+        self.registry = registry
+
+    def _register(self, *outputs):
+        if self.registry is not None:
+            self.registry.register(*outputs)
 
 
 ## Hopper ##
@@ -35,6 +45,85 @@ class HopperWontDropError(HopperActiveError):
     """raised when the hopper won't drop"""
     pass
 
+class LatencyHistogram(object):
+    """Counts of latencies in fixed-width bins, small enough to save after
+    every feed.
+
+    Parameters
+    ----------
+    bin_width : float, optional
+        Width of each bin in seconds (default=0.005).
+    max_latency : float, optional
+        Latencies at or above this land in the last bin (default=2.0).
+
+    Examples
+    --------
+    ::
+
+        hist = LatencyHistogram()
+        hist.add(0.231)
+        hist.percentile(99.0)
+    """
+    def __init__(self, bin_width=0.005, max_latency=2.0):
+        self.bin_width = bin_width
+        self.max_latency = max_latency
+        self.counts = [0] * (int(round(max_latency / bin_width)) + 1)
+        self.total = 0.0
+        self.failures = 0
+
+    def add(self, latency):
+        """Count one latency in seconds"""
+        ii = min(int(max(latency, 0.0) / self.bin_width), len(self.counts) - 1)
+        self.counts[ii] += 1
+        self.total += latency
+
+    def count(self):
+        return sum(self.counts)
+
+    def mean(self):
+        n = self.count()
+        return self.total / n if n else None
+
+    def percentile(self, p):
+        """Upper edge of the bin holding the p-th percentile, or None if
+        nothing has been counted"""
+        n = self.count()
+        if not n:
+            return None
+        target = n * p / 100.0
+        seen = 0
+        for ii, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return (ii + 1) * self.bin_width
+        return len(self.counts) * self.bin_width
+
+    def summary(self):
+        """dict of count, failures, mean, p50 and p99"""
+        return {'n': self.count(),
+                'failures': self.failures,
+                'mean': self.mean(),
+                'p50': self.percentile(50.0),
+                'p99': self.percentile(99.0)}
+
+    def to_dict(self):
+        # only the non-empty bins, to keep the file small
+        return {'bin_width': self.bin_width,
+                'max_latency': self.max_latency,
+                'bins': dict((str(ii), c) for ii, c in enumerate(self.counts) if c),
+                'total': self.total,
+                'failures': self.failures}
+
+    @classmethod
+    def from_dict(cls, d):
+        hist = cls(bin_width=d['bin_width'], max_latency=d['max_latency'])
+        for ii, count in d.get('bins', {}).items():
+            hist.counts[int(ii)] = count
+        hist.total = d.get('total', 0.0)
+        hist.failures = d.get('failures', 0)
+        return hist
+
+
 class Hopper(BaseComponent):
     """Controls a food hopper driven by either a solenoid or a servo motor.
 
@@ -60,9 +149,20 @@ class Hopper(BaseComponent):
         Required when using `servo`. Must be tuned per-panel in local_pi.py.
     max_lag : float, optional
         Seconds to wait for the IR beam to confirm position (default=0.3).
+        up() and down() return as soon as the beam confirms; this is only the
+        timeout.
     inverted : bool, optional
         Set True if the IR beam logic is active-low (default=False).
 
+    Attributes
+    ----------
+    up_latency, down_latency : float
+        Seconds from the last up/down command to the IR beam confirming it.
+    latency : dict
+        'up' and 'down' LatencyHistograms of every confirmed move, with the
+        number of moves that timed out. See `track_latency` to keep them
+        across sessions and to tune max_lag from them.
+
     Examples
     --------
     Solenoid hopper (older Magpi boards)::
@@ -112,6 +212,72 @@ class Hopper(BaseComponent):
             self._actuator = 'servo'
             # move to down position on init so the hopper starts in a known state
             self.servo.write(self.down_angle)
+        self.up_latency = None
+        self.down_latency = None
+        self.latency = {'up': LatencyHistogram(), 'down': LatencyHistogram()}
+        self.latency_path = None
+        self.auto_max_lag = None
+        self._default_max_lag = self.max_lag
+
+    def track_latency(self, path=None, auto_max_lag=False, percentile=99.0,
+                      margin=1.5, min_samples=20, min_max_lag=0.1):
+        """Keep the latency histograms in a file, and optionally set max_lag
+        from them.
+
+        Parameters
+        ----------
+        path : str, optional
+            JSON file the histograms are loaded from now and saved to after
+            every move, e.g. one per panel so they carry across sessions.
+        auto_max_lag : bool, optional
+            Once both directions have min_samples moves, set max_lag to
+            margin times the slower direction's percentile, between
+            min_max_lag and the max_lag the hopper was built with.
+        """
+        self.latency_path = path
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    saved = json.load(f)
+                self.latency = dict((direction, LatencyHistogram.from_dict(saved[direction]))
+                                    for direction in ('up', 'down'))
+            except (ValueError, KeyError) as err:
+                logger.warning('ignoring unreadable hopper latency file %s: %s' % (path, err))
+        if auto_max_lag:
+            self.auto_max_lag = {'percentile': percentile,
+                                 'margin': margin,
+                                 'min_samples': min_samples,
+                                 'min_max_lag': min_max_lag}
+        else:
+            self.auto_max_lag = None
+            self.max_lag = self._default_max_lag
+        self._tune_max_lag()
+
+    def _record(self, direction, latency=None):
+        """Count a confirmed move (or a timeout, with latency None)"""
+        if latency is None:
+            self.latency[direction].failures += 1
+        else:
+            self.latency[direction].add(latency)
+        self._tune_max_lag()
+        if self.latency_path is not None:
+            tmp = self.latency_path + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(dict((d, h.to_dict()) for d, h in self.latency.items()), f)
+                os.replace(tmp, self.latency_path)
+            except (IOError, OSError) as err:
+                logger.warning('could not save hopper latencies to %s: %s' % (self.latency_path, err))
+
+    def _tune_max_lag(self):
+        config = self.auto_max_lag
+        if config is None:
+            return
+        if min(h.count() for h in self.latency.values()) < config['min_samples']:
+            return
+        slowest = max(h.percentile(config['percentile']) for h in self.latency.values())
+        self.max_lag = min(max(slowest * config['margin'], config['min_max_lag']),
+                           self._default_max_lag)
 
     def _actuate_up(self):
         """Send the raise command to whichever actuator is fitted."""
@@ -127,6 +293,28 @@ class Hopper(BaseComponent):
         else:
             self.solenoid.write(False)
 
+    def _edge_time(self, level, since):
+        """Time the IR changed to level, if captured after since, else now."""
+        edge_time = self.IR.last_edge(level=level)
+        if edge_time is None or edge_time < since:
+            return datetime.datetime.now()
+        return edge_time
+
+    def _wait_position(self, up, timeout):
+        """Wait for the IR beam to show the hopper up (or down). Returns the
+        time it got there, or None after timeout seconds."""
+        level = up != self.inverted
+        if hasattr(self.IR.interface, '_wait_any'):
+            return self.IR.wait_for(level, timeout=timeout)
+        # no edge capture on this interface: read the beam, but often
+        start = time.time()
+        while True:
+            if self.check() == up:
+                return datetime.datetime.now()
+            if time.time() - start >= timeout:
+                return None
+            time.sleep(0.005)
+
     def check(self):
         """Read the IR beam and return whether the hopper is currently up.
 
@@ -140,60 +328,135 @@ class Hopper(BaseComponent):
             IR_status = not IR_status
         return IR_status
 
-    def up(self):
+    def up(self, return_latency=False):
         """Raise the hopper.
 
+        Parameters
+        ----------
+        return_latency : bool, optional
+            Also return the seconds from the command to the IR beam tripping.
+
         Returns
         -------
         datetime
             Timestamp of when the IR beam was tripped (hopper confirmed up).
+            Taken from the captured IR edge where the interface supports it.
+            With return_latency, a (datetime, float) tuple.
 
         Raises
         ------
         HopperWontComeUpError
             The hopper did not raise within max_lag seconds.
         """
+        actuated = datetime.datetime.now()
         self._actuate_up()
-        start = time.time()
-        while time.time() - start < self.max_lag:
-            if self.check():
-                return datetime.datetime.now()
-            time.sleep(0.05)
-        self._actuate_down()  # safety: return to down position
-        raise HopperWontComeUpError
-
-    def down(self):
+        if self._wait_position(True, self.max_lag) is None:
+            self._actuate_down()  # safety: return to down position
+            self._record('up')
+            raise HopperWontComeUpError
+        time_up = self._edge_time(not self.inverted, actuated)
+        self.up_latency = max((time_up - actuated).total_seconds(), 0.0)
+        self._record('up', self.up_latency)
+        if return_latency:
+            return (time_up, self.up_latency)
+        return time_up
+
+    def down(self, return_latency=False):
         """Lower the hopper.
 
+        Returns as soon as the IR beam clears.
+
+        Parameters
+        ----------
+        return_latency : bool, optional
+            Also return the seconds from the command to the IR beam clearing.
+
         Returns
         -------
         datetime
-            Timestamp of when the down command was confirmed.
+            Timestamp of when the IR beam cleared (hopper confirmed down).
+            With return_latency, a (datetime, float) tuple.
 
         Raises
         ------
         HopperWontDropError
             The hopper did not lower within max_lag seconds.
         """
+        # only moves count towards the latencies, not down() on a hopper that
+        # is already down (e.g. every panel.reset())
+        was_up = self.check()
+        actuated = datetime.datetime.now()
         self._actuate_down()
-        utils.wait(self.max_lag)
-        time_down = datetime.datetime.now()
-        if self.check():  # IR beam still tripped after waiting
+        if self._wait_position(False, self.max_lag) is None:
+            self._record('down')
             raise HopperWontDropError
+        time_down = self._edge_time(self.inverted, actuated)
+        self.down_latency = max((time_down - actuated).total_seconds(), 0.0)
+        if was_up:
+            self._record('down', self.down_latency)
+        if return_latency:
+            return (time_down, self.down_latency)
         return time_down
 
-    def feed(self, dur=2.0, error_check=True):
+    def reset(self):
+        """Make sure the hopper is down, without touching it if it already is.
+
+        Cheap enough for every idle poll: if the last command was down and the
+        IR beam agrees, nothing is written and nothing waited for. Otherwise
+        the hopper is lowered with `down`.
+
+        Returns
+        -------
+        bool
+            True if the hopper had to be lowered.
+
+        Raises
+        ------
+        HopperWontDropError
+            The hopper did not lower within max_lag seconds.
+        """
+        if self._in_position(False):
+            return False
+        self.down()
+        return True
+
+    def _in_position(self, up):
+        """Whether the last command was up (or down) and the IR beam agrees."""
+        if self._actuator == 'servo':
+            commanded = self.servo.last_value == (self.up_angle if up else self.down_angle)
+        else:
+            commanded = self.solenoid.last_value is up
+        return commanded and self.check() == up
+
+    def _apply_state(self, target):
+        """Move to target ('up'/True or 'down'/False) for panel.apply_state,
+        unless the hopper is already there. Returns the time it got there, or
+        None if it didn't have to move."""
+        if target in ('up', True):
+            up = True
+        elif target in ('down', False, None):
+            up = False
+        else:
+            raise ValueError('hopper state must be up or down, not %r' % (target,))
+        if self._in_position(up):
+            return None
+        return self.up() if up else self.down()
+
+    def feed(self, dur=2.0, error_check=True, return_latency=False):
         """Perform a feed cycle: raise the hopper, wait dur seconds, lower it.
 
         Parameters
         ----------
         dur : float, optional
             Duration of feed in seconds (default=2.0).
+        return_latency : bool, optional
+            Also return the up and down latencies in seconds.
 
         Returns
         -------
         (datetime, datetime.timedelta)
-            Timestamp of the feed and its duration.
+            Timestamp of the feed and its duration. With return_latency,
+            (datetime, datetime.timedelta, float, float).
 
         Raises
         ------
@@ -214,12 +477,29 @@ class Hopper(BaseComponent):
         utils.wait(dur)
         feed_over = self.down()
         feed_duration = feed_over - feed_time
+        if return_latency:
+            return (feed_time, feed_duration, self.up_latency, self.down_latency)
         return (feed_time, feed_duration)
 
     def reward(self, value=2.0):
         """Wrapper for `feed`, passes *value* as *dur*."""
         return self.feed(dur=value)
 
+    def feed_async(self, dur=2.0, return_latency=False):
+        """Runs `feed` on a background thread, so the caller can watch the
+        ports meanwhile.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            result() returns what `feed` returns, or raises its Hopper errors.
+        """
+        return utils.run_async(self.feed, dur=dur, return_latency=return_latency)
+
+    def reward_async(self, value=2.0):
+        """Wrapper for `feed_async`, passes *value* as *dur*."""
+        return self.feed_async(dur=value)
+
 ## Peck Port ##
 
 class PeckPort(BaseComponent):
@@ -231,6 +511,9 @@ class PeckPort(BaseComponent):
         output channel to activate the LED in the peck port
     IR : hwio.BooleanInput
         input channel for the IR beam to check for a peck
+    scheduler : hwio.BlinkScheduler, optional
+        runs flash() and blink() in the background, normally the panel's
+        (default is the process-wide hwio.get_blink_scheduler())
 
     Attributes
     ----------
@@ -240,7 +523,7 @@ class PeckPort(BaseComponent):
         input channel for the IR beam to check for a peck
 
     """
-    def __init__(self,IR,LED, inverted=False,*args,**kwargs):
+    def __init__(self,IR,LED, inverted=False,scheduler=None,*args,**kwargs):
         super(PeckPort, self).__init__(*args,**kwargs)
         if isinstance(IR,hwio.BooleanInput):
             self.IR = IR
@@ -258,6 +541,15 @@ class PeckPort(BaseComponent):
             self.inverted=True
         else:
             self.inverted=False
+        self._group = hwio.OutputGroup([self.LED])
+        self._scheduler = scheduler
+        self._register(self.LED)
+
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            self._scheduler = hwio.get_blink_scheduler()
+        return self._scheduler
 
     def status(self):
         """reads the status of the IR beam
@@ -299,31 +591,95 @@ class PeckPort(BaseComponent):
             self.LED.write(val);
         return True
 
-    def flash(self,dur=1.0,isi=0.1):
+    def _state_writes(self, target):
+        """(output, value) pairs for panel.apply_state. target is True/False,
+        or a PWM level"""
+        if self.LEDtype == "boolean":
+            return [(self.LED, bool(target))]
+        if target is True:
+            target = 100.0
+        return [(self.LED, float(target or 0.0))]
+
+    def flash(self,dur=1.0,isi=0.1,block=True):
         """Flashes the LED on and off with *isi* seconds high and low for *dur* seconds, then revert LED to prior state.
 
+        The flashing runs on the scheduler's thread. With *block* False this
+        returns right away, so the caller can watch for pecks meanwhile.
+
         Parameters
         ----------
         dur : float, optional
             Duration of the light flash in seconds.
         isi : float,optional
             Time interval between toggles. (0.5 * period)
+        block : bool, optional
+            Wait for the flashing to finish.
 
         Returns
         -------
         (datetime, float)
             Timestamp of the flash and the flash duration
         """
-        LED_state = self.LED.read()
+        # the last value written, not a read of the LED
+        LED_state = self._group.snapshot()
+        if LED_state[self.LED] is None:
+            LED_state[self.LED] = False if self.LEDtype == "boolean" else 0.0
         flash_time = datetime.datetime.now()
+        blink = self.blink(period=2*isi,duration=dur,
+                           end=lambda: self._group.restore(LED_state))
+        if not block:
+            return (flash_time,datetime.timedelta(seconds=dur))
+        blink.wait()
         flash_duration = datetime.datetime.now() - flash_time
-        while flash_duration < datetime.timedelta(seconds=dur):
-            self.LED.toggle()
-            utils.wait(isi)
-            flash_duration = datetime.datetime.now() - flash_time
-        self.LED.write(LED_state)
         return (flash_time,flash_duration)
 
+    def blink(self,period=1.0,duty=0.5,duration=None,repeat=None,end=None):
+        """Blinks the LED in the background until *duration* seconds or
+        *repeat* periods have passed, or the returned Blink is cancelled.
+
+        Parameters
+        ----------
+        period : float, optional
+            Seconds from one turn on to the next.
+        duty : float, optional
+            Fraction of the period the LED is on.
+        duration : float, optional
+            Seconds to blink for. (default is until cancelled)
+        repeat : int, optional
+            Number of periods to blink for.
+        end : callable, optional
+            Called when the pattern ends. (default turns the LED off)
+
+        Returns
+        -------
+        hwio.Blink
+        """
+        return self.scheduler.blink(self,period=period,duty=duty,
+                                    duration=duration,repeat=repeat,end=end)
+
+    def peck_time(self, since=None):
+        """ Time the IR beam was broken, for a port whose status() is True
+
+        Uses the captured IR edge where the interface supports it, so the
+        time does not include the latency of whatever loop noticed the peck.
+
+        Parameters
+        ----------
+        since : datetime, optional
+            If the beam was already broken before this time, return this time.
+
+        Returns
+        -------
+        datetime
+            Timestamp of the IR beam being broken.
+        """
+        edge_time = self.IR.last_edge(level=not self.inverted)
+        if edge_time is None:
+            edge_time = datetime.datetime.now()
+        if since is not None and edge_time < since:
+            edge_time = since
+        return edge_time
+
     def poll(self,timeout=None):
         """ Polls the peck port until there is a peck
 
@@ -334,6 +690,202 @@ class PeckPort(BaseComponent):
         """
         return self.IR.poll(timeout)
 
+class PeckPortBank(BaseComponent):
+    """ Reads the IR status of several peck ports at once
+
+    The IR inputs of the ports are read through a hwio.BooleanInputBank, so
+    ports that share an interface cost a single I/O call. Anything that is not
+    a PeckPort is read through its own status().
+
+    Parameters
+    ----------
+    ports : dict
+        name:PeckPort pairs, e.g. {'L': panel.left, 'R': panel.right}
+
+    """
+    def __init__(self, ports, *args, **kwargs):
+        super(PeckPortBank, self).__init__(*args, **kwargs)
+        self.ports = dict(ports)
+        self._banked = dict((name, port) for name, port in self.ports.items()
+                            if isinstance(port, PeckPort))
+        self._bank = hwio.BooleanInputBank(dict((name, port.IR) for name, port
+                                                in self._banked.items()))
+
+    def status(self):
+        """reads the status of every IR beam
+
+        Returns
+        -------
+        dict
+            name:bool pairs, True if that beam is broken
+        """
+        status = {}
+        if self._banked:
+            for name, value in self._bank.read().items():
+                status[name] = (not value) if self._banked[name].inverted else value
+        for name, port in self.ports.items():
+            if name not in status:
+                status[name] = port.status()
+        return status
+
+class PortSelector(BaseComponent):
+    """ Waits on several peck ports at once and reports the first response
+
+    If every port is a PeckPort on one interface with a '_wait_any' method
+    (e.g. RaspberryPiInterface), select() blocks on that interface's edge
+    events and wakes up as soon as a beam is broken. Otherwise it falls back
+    to reading all of the ports through a PeckPortBank every
+    `poll_interval` seconds.
+
+    Parameters
+    ----------
+    ports : dict
+        name:PeckPort pairs, e.g. {'L': panel.left, 'R': panel.right}
+    window : float, optional
+        Coincidence window in seconds. Other ports that fire within this long
+        of the first are reported with it (default=0.0).
+    poll_interval : float, optional
+        Seconds between reads when falling back to polling (default=0.015).
+
+    Examples
+    --------
+    ::
+
+        selector = PortSelector({'L': panel.left, 'R': panel.right}, window=0.05)
+        selection = selector.select(timeout=5.0)
+        if selection is not None:
+            print(selection.name, selection.time, selection.coincident)
+    """
+    Selection = collections.namedtuple('Selection', ['name', 'port', 'time', 'coincident'])
+
+    def __init__(self, ports, window=0.0, poll_interval=0.015, *args, **kwargs):
+        super(PortSelector, self).__init__(*args, **kwargs)
+        self.ports = dict(ports)
+        self.names = list(self.ports.keys())
+        self.window = window
+        self.poll_interval = poll_interval
+        self.bank = PeckPortBank(self.ports)
+
+        self.interface = None
+        interfaces = set(id(port.IR.interface) for port in self.ports.values()
+                         if isinstance(port, PeckPort))
+        if self.ports and len(interfaces) == 1 and \
+                all(isinstance(port, PeckPort) for port in self.ports.values()):
+            interface = self.ports[self.names[0]].IR.interface
+            if hasattr(interface, '_wait_any'):
+                self.interface = interface
+
+    def select(self, timeout=None, ignore_held=False):
+        """ Block until a beam is broken on any of the ports
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Seconds to wait before giving up (default=forever).
+        ignore_held : bool, optional
+            Only report new beam breaks, not beams that are already broken
+            when select() is called (default=False).
+
+        Returns
+        -------
+        Selection or None
+            (name, port, time, coincident) of the first port to fire, where
+            coincident is a dict of name:time for the other ports that fired
+            within the window. None if timeout elapsed first.
+        """
+        if self.interface is not None:
+            hits = self._select_events(timeout, ignore_held)
+        else:
+            hits = self._select_polled(timeout, ignore_held)
+        if not hits:
+            return None
+        name, first_time = hits[0]
+        return self.Selection(name, self.ports[name], first_time, dict(hits[1:]))
+
+    def pecks(self, until, timeout=0.05):
+        """ Yields a Selection for every new beam break until until() is True
+
+        Unlike calling select() in a loop, which beams count as held is
+        decided once, when this starts: after that a beam only has to clear
+        to count again, and a break that spans several waits is reported
+        once. Where the interface captures edges, a break that started and
+        ended between two reads is reported too.
+
+        Parameters
+        ----------
+        until : callable
+            Checked after every wait of at most timeout seconds.
+        timeout : float, optional
+            Longest wait between checks of until (default=0.05).
+        """
+        status = self.bank.status()
+        armed = dict((name, not status[name]) for name in self.names)
+        # newest break already accounted for, per port
+        seen = dict((name, self._last_break(name)) for name in self.names)
+        while not until():
+            if self.interface is not None:
+                self._select_events(timeout, True)  # wakes on the next edge
+            else:
+                utils.wait(min(self.poll_interval, timeout))
+            status = self.bank.status()
+            hits = []
+            for name in self.names:
+                edge = self._last_break(name)
+                new_edge = edge is not None and (seen[name] is None or edge > seen[name])
+                if new_edge or (status[name] and armed[name]):
+                    hit_time = edge if new_edge else self.ports[name].peck_time()
+                    hits.append((hit_time, name))
+                    # an edge captured late for this same break is older than now
+                    seen[name] = datetime.datetime.now()
+                armed[name] = not status[name]
+            if hits:
+                hits.sort()
+                first_time, name = hits[0]
+                yield self.Selection(name, self.ports[name], first_time,
+                                     dict((other, t) for t, other in hits[1:]))
+
+    def _last_break(self, name):
+        port = self.ports[name]
+        if not isinstance(port, PeckPort):
+            return None
+        return port.IR.last_edge(level=not port.inverted)
+
+    def _select_events(self, timeout, ignore_held):
+        targets = [(self.ports[name].IR.params, not self.ports[name].inverted)
+                   for name in self.names]
+        hits = self.interface._wait_any(targets, timeout=timeout,
+                                        window=self.window,
+                                        ignore_held=ignore_held)
+        return [(self.names[ii], hit_time) for ii, hit_time in hits]
+
+    def _select_polled(self, timeout, ignore_held):
+        start = datetime.datetime.now()
+        armed = dict((name, not ignore_held) for name in self.names)
+        while True:
+            status = self.bank.status()
+            fired = []
+            for name in self.names:
+                if not status[name]:
+                    armed[name] = True
+                elif armed[name]:
+                    fired.append(name)
+            if fired:
+                first_time = self.ports[fired[0]].peck_time(since=start)
+                hits = [(fired[0], first_time)]
+                if self.window:
+                    utils.wait(self.window)
+                    status = self.bank.status()
+                    for name in self.names:
+                        if name not in fired and status[name]:
+                            fired.append(name)
+                for name in fired[1:]:
+                    hits.append((name, self.ports[name].peck_time(since=start)))
+                return hits
+            if timeout is not None and \
+                    (datetime.datetime.now() - start).total_seconds() >= timeout:
+                return []
+            utils.wait(self.poll_interval)
+
 ## House Light ##
 class HouseLight(BaseComponent):
     """ Class which holds information about the house light
@@ -346,8 +898,11 @@ class HouseLight(BaseComponent):
     Methods:
     on() -- 
     off() -- 
-    timeout(dur) -- turns off the house light for 'dur' seconds (default=10.0)
+    timeout(dur) -- turns off the house light for 'dur' seconds (default=10.0),
+        then puts back what it was showing
     punish() -- calls timeout() for 'value' as 'dur'
+    timeout_async(dur), punish_async(value) -- the same, on a background
+        thread. Return a concurrent.futures.Future
 
     """
     def __init__(self,light,*args,**kwargs):
@@ -356,6 +911,8 @@ class HouseLight(BaseComponent):
             self.light = light
         else:
             raise ValueError('%s is not an output channel' % light)
+        self._group = hwio.OutputGroup([self.light])
+        self._register(self.light)
 
     def off(self):
         """Turns the house light off.
@@ -380,6 +937,10 @@ class HouseLight(BaseComponent):
         self.light.write(True)
         return True
 
+    def _state_writes(self,target):
+        """(output, value) pairs for panel.apply_state. target is True/False"""
+        return [(self.light,bool(target))]
+
     def timeout(self,dur=10.0):
         """Turn off the light for *dur* seconds 
 
@@ -394,17 +955,29 @@ class HouseLight(BaseComponent):
             Timestamp of the timeout and the timeout duration
 
         """
+        prior = self._group.snapshot()
+        if prior[self.light] is None:
+            prior[self.light] = True
         timeout_time = datetime.datetime.now()
         self.light.write(False)
         utils.wait(dur)
         timeout_duration = datetime.datetime.now() - timeout_time
-        self.light.write(True)
+        self._group.restore(prior)
         return (timeout_time,timeout_duration)
 
     def punish(self,value=10.0):
         """Calls `timeout(dur)` with *value* as *dur* """
         return self.timeout(dur=value)
 
+    def timeout_async(self,dur=10.0):
+        """Runs `timeout` on a background thread. Returns a
+        concurrent.futures.Future for its result"""
+        return utils.run_async(self.timeout,dur=dur)
+
+    def punish_async(self,value=10.0):
+        """Calls `timeout_async(dur)` with *value* as *dur* """
+        return self.timeout_async(dur=value)
+
 
 ## Cue Light ##
 
@@ -419,9 +992,12 @@ class RGBLight(BaseComponent):
         output channel for the green LED
     blue : hwio.BooleanOutput
         output channel for the blue LED
+    scheduler : hwio.BlinkScheduler, optional
+        runs blink() in the background, normally the panel's (default is the
+        process-wide hwio.get_blink_scheduler())
 
     """
-    def __init__(self,red,green,blue,*args,**kwargs):
+    def __init__(self,red,green,blue,scheduler=None,*args,**kwargs):
         super(RGBLight, self).__init__(*args,**kwargs)
         if isinstance(red, (hwio.BooleanOutput, hwio.PWMOutput)):
             self._red = red
@@ -435,6 +1011,16 @@ class RGBLight(BaseComponent):
             self._blue = blue
         else:
             raise ValueError('%s is not an output channel' % blue)
+        # color changes are written together so no mixed color shows in between
+        self._group = hwio.OutputGroup([self._red, self._green, self._blue])
+        self._scheduler = scheduler
+        self._register(*self._group.outputs)
+
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            self._scheduler = hwio.get_blink_scheduler()
+        return self._scheduler
 
     def red(self):
         """Turns the cue light to red
@@ -444,9 +1030,8 @@ class RGBLight(BaseComponent):
         bool
             `True` if successful.
         """
-        self._green.write(False)
-        self._blue.write(False)
-        return self._red.write(True)
+        self._group.write([True, False, False])
+        return self._red.last_value
     def green(self):
         """Turns the cue light to green
 
@@ -455,9 +1040,8 @@ class RGBLight(BaseComponent):
         bool
             `True` if successful.
         """
-        self._red.write(False)
-        self._blue.write(False)
-        return self._green.write(True)
+        self._group.write([False, True, False])
+        return self._green.last_value
     def blue(self):
         """Turns the cue light to blue
 
@@ -466,9 +1050,8 @@ class RGBLight(BaseComponent):
         bool
             `True` if successful.
         """
-        self._red.write(False)
-        self._green.write(False)
-        return self._blue.write(True)
+        self._group.write([False, False, True])
+        return self._blue.last_value
     def off(self):
         """Turns the cue light off
 
@@ -477,10 +1060,35 @@ class RGBLight(BaseComponent):
         bool
             `True` if successful.
         """
-        self._red.write(False)
-        self._green.write(False)
-        self._blue.write(False)
+        self._group.write(False)
         return True
+    def _state_writes(self,target):
+        """(output, value) pairs for panel.apply_state. target is 'red',
+        'green', 'blue', 'off'/False, or a list of [red, green, blue] values"""
+        colors = {'red': [True,False,False],
+                  'green': [False,True,False],
+                  'blue': [False,False,True]}
+        if target in (None,False,'off'):
+            values = [False,False,False]
+        elif isinstance(target,(list,tuple)):
+            values = list(target)
+        elif target in colors:
+            values = colors[target]
+        else:
+            raise ValueError('%r is not a cue light color' % (target,))
+        return list(zip(self._group.outputs,values))
+    def blink(self,color='red',period=1.0,duty=0.5,duration=None,repeat=None):
+        """Blinks the cue light in *color* in the background
+
+        See `PeckPort.blink` for the timing arguments.
+
+        Returns
+        -------
+        hwio.Blink
+        """
+        return self.scheduler.start(hwio.Blink(getattr(self,color),self.off,period,
+                                               duty=duty,duration=duration,repeat=repeat),
+                                    key=self)
 
 ## House Light ##
 class LEDStripHouseLight(BaseComponent):
@@ -492,16 +1100,26 @@ class LEDStripHouseLight(BaseComponent):
         [R, G, B, W]
         output channels to turn the light on and off
 
+    fader : hwio.Fader, optional
+        runs ramp() in the background (default is the process-wide
+        hwio.get_fader())
+
     Methods:
     on() -- 
     off() -- 
     set_color() -- set the color
     change_color -- sets color and turns on light
-    timeout(dur) -- turns off the house light for 'dur' seconds (default=10.0)
+    ramp(color,duration) -- fades to color over duration seconds without
+        blocking
+    ramping() -- the running ramp (an hwio.Fade), or None
+    timeout(dur) -- turns off the house light for 'dur' seconds (default=10.0),
+        then puts back what it was showing, or picks a running ramp back up
     punish() -- calls timeout() for 'value' as 'dur'
+    timeout_async(dur), punish_async(value) -- the same, on a background
+        thread. Return a concurrent.futures.Future
 
     """
-    def __init__(self,lights,color=[100.0,100.0,100.0,100.0],*args,**kwargs):
+    def __init__(self,lights,color=[100.0,100.0,100.0,100.0],fader=None,*args,**kwargs):
         super(LEDStripHouseLight, self).__init__(*args,**kwargs)
         self.lights = []
         for light in lights:
@@ -510,6 +1128,24 @@ class LEDStripHouseLight(BaseComponent):
             else:
                  raise ValueError('%s is not an output channel' % light)
         self.color = color
+        self._group = hwio.OutputGroup(self.lights)
+        self._fader = fader
+        self._register(*self.lights)
+
+    @property
+    def fader(self):
+        if self._fader is None:
+            self._fader = hwio.get_fader()
+        return self._fader
+
+    def _settle(self, target):
+        # on()/off() stop a running ramp, unless it's already heading there
+        fade = self.ramping()
+        if fade is not None:
+            if fade.target == [float(v) for v in target]:
+                return True
+            self.fader.cancel(self._group)
+        return False
 
     def off(self):
         """Turns the house light off.
@@ -520,8 +1156,8 @@ class LEDStripHouseLight(BaseComponent):
             True if successful.
 
         """
-        for light in self.lights:
-            light.write(0.0)
+        if not self._settle([0.0] * len(self.lights)):
+            self._group.write(0.0,changed_only=True)
         return True
 
     def on(self):
@@ -532,10 +1168,69 @@ class LEDStripHouseLight(BaseComponent):
         bool
             True if successful.
         """
-        for ind in range(4):
-            self.lights[ind].write(self.color[ind])
+        if not self._settle(self.color[:4]):
+            self._group.write(list(self.color[:4]),changed_only=True)
         return True
 
+    def _state_values(self,target):
+        if target is True:
+            return list(self.color[:4])
+        if target in (None,False):
+            return [0.0] * len(self.lights)
+        return list(target[:4])
+
+    def _state_writes(self,target):
+        """(output, value) pairs for panel.apply_state. target is True (the
+        current color), False, or an [R, G, B, W] color. Changes nothing:
+        see _state_applied"""
+        values = self._state_values(target)
+        fade = self.ramping()
+        if fade is not None and fade.target == [float(v) for v in values]:
+            return []
+        return list(zip(self.lights,values))
+
+    def _state_applied(self,target):
+        """after panel.apply_state has written target: an explicit color
+        becomes the color, and a ramp heading elsewhere is stopped"""
+        values = self._state_values(target)
+        if isinstance(target,(list,tuple)) and any(values):
+            self.color = values
+        if not self._settle(values):
+            # a last ramp step may have landed after apply_state's write
+            self._group.write(values,changed_only=True)
+
+    def ramp(self, color=None, duration=1800.0):
+        """Fades the house light from its current color to *color* over
+        *duration* seconds, e.g. a simulated dawn or dusk. Returns right away;
+        the fade runs on the fader's thread.
+
+        Keywords
+        -------
+        color : list of float, optional
+            [R, G, B, W] duty cycles to end at. A color other than off also
+            becomes the color used by on(). (default is the current color)
+        duration : float, optional
+            The length of the ramp in seconds.
+
+        Returns
+        -------
+        hwio.Fade
+            Call wait() on it to block until the ramp is done.
+
+        """
+        if color is None:
+            color = self.color
+        color = list(color[:4])
+        if any(color):
+            self.color = color
+        return self.fader.fade(self._group, color, duration)
+
+    def ramping(self):
+        """The ramp in progress (an hwio.Fade), or None"""
+        if self._fader is None:
+            return None
+        return self._fader.fading(self._group)
+
     def timeout(self,dur=10.0):
         """Turn off the light for *dur* seconds 
 
@@ -550,17 +1245,38 @@ class LEDStripHouseLight(BaseComponent):
             Timestamp of the timeout and the timeout duration
 
         """
+        # back to what it was showing, which needn't be self.color
+        prior = self._group.snapshot()
+        fade = self.ramping()
         timeout_time = datetime.datetime.now()
         self.off()
         utils.wait(dur)
         timeout_duration = datetime.datetime.now() - timeout_time
-        self.on()
+        if fade is None:
+            self._group.restore(prior)
+        elif self.ramping() is None:
+            # off() stopped a ramp (e.g. a dawn): carry on from where it
+            # would be by now
+            now = time.time()
+            self._group.write(fade.values(now),changed_only=True)
+            remaining = fade.t0 + fade.duration - now
+            if remaining > 0:
+                self.fader.fade(self._group,fade.target,remaining)
         return (timeout_time,timeout_duration)
 
     def punish(self,value=10.0):
         """Calls `timeout(dur)` with *value* as *dur* """
         return self.timeout(dur=value)
 
+    def timeout_async(self,dur=10.0):
+        """Runs `timeout` on a background thread. Returns a
+        concurrent.futures.Future for its result"""
+        return utils.run_async(self.timeout,dur=dur)
+
+    def punish_async(self,value=10.0):
+        """Calls `timeout_async(dur)` with *value* as *dur* """
+        return self.timeout_async(dur=value)
+
     def set_color(self, color):
         self.color = color
 
@@ -1,5 +1,8 @@
+import json
 import time
 import datetime
+import threading
+import numpy as np
 # Classes of operant components
 class BaseIO(object):
     """any type of IO device. maintains info on interface for query IO device"""
@@ -14,16 +17,33 @@ class BooleanInput(BaseIO):
     Keyword arguments:
     interface -- Interface() instance. Must have '_read_bool' method.
     params -- dictionary of keyword:value pairs needed by the interface
+    min_high -- seconds the input must stay True before a change to True is
+        reported (default=None, no filtering)
+    min_low -- seconds the input must stay False before a change to False is
+        reported (default=None, no filtering)
+
+    If the interface has a '_config_debounce' method (e.g. pigpio's glitch
+    filter) the filtering is done there. Whatever the interface can't filter
+    is done in software on each read, timed from the interface's captured
+    edges where it has them.
 
     Methods:
     read() -- reads value of the input. Returns a boolean
     poll() -- polls the input until value is True. Returns the time of the change
+    wait_for(level,timeout) -- waits for the input to read level. Returns the
+        time of the change, or None on timeout
+    last_edge(level) -- time of the most recent change to level, where the
+        interface captures edges. Otherwise returns None
     """
-    def __init__(self,interface=None,params={},*args,**kwargs):
+    def __init__(self,interface=None,params={},min_high=None,min_low=None,*args,**kwargs):
         super(BooleanInput, self).__init__(interface=interface,params=params,*args,**kwargs)
 
         assert hasattr(self.interface,'_read_bool')
+        self.min_high = min_high or 0.0
+        self.min_low = min_low or 0.0
+        self.debouncer = None
         self.config()
+        self.config_debounce()
 
     def _clbk(self, gpio, level, tick):
         self.last_time = datetime.datetime.now()
@@ -41,24 +61,350 @@ class BooleanInput(BaseIO):
         except AttributeError:
             return False
 
+    def config_debounce(self):
+        """ hand the min_high/min_low filter to the interface, and set up a
+        software filter for whatever part of it the interface can't do """
+        if not (self.min_high or self.min_low):
+            self.debouncer = None
+            return
+        done = (0.0, 0.0)
+        if hasattr(self.interface,'_config_debounce'):
+            done = self.interface._config_debounce(min_high=self.min_high,
+                                                   min_low=self.min_low,
+                                                   **self.params)
+        min_high = max(self.min_high - done[0], 0.0)
+        min_low = max(self.min_low - done[1], 0.0)
+        if min_high or min_low:
+            self.debouncer = Debouncer(min_high=min_high, min_low=min_low)
+        else:
+            self.debouncer = None
+
+    def _filter(self,value):
+        if self.debouncer is None:
+            return value
+        since = None
+        if self.debouncer.level is not None and bool(value) != self.debouncer.level:
+            since = self._steady_since(bool(value))
+        return self.debouncer.update(value,since=since)
+
+    def _steady_since(self,level):
+        """ time.time() of the captured edge that took the input to level, or
+        None if the interface doesn't capture edges or its buffer doesn't
+        agree with the level just read """
+        if not hasattr(self.interface,'_last_edge'):
+            return None
+        to_level = self.interface._last_edge(level=level,**self.params)
+        away = self.interface._last_edge(level=not level,**self.params)
+        if to_level is None or (away is not None and away > to_level):
+            return None
+        return time.mktime(to_level.timetuple()) + to_level.microsecond / 1e6
+
     def read(self):
         """read status"""
-        return self.interface._read_bool(**self.params)
+        return self._filter(self.interface._read_bool(**self.params))
 
     def poll(self,timeout=None):
-        """ runs a loop, querying for pecks. returns peck time or "GoodNite" exception """
-        #orig = self.tally
-        #if timeout is not None:
-        #    start = time.time()
-        #while time.time() - start < timeout:
-        #    if self.tally - orig > 0:
-        #        return datetime.datetime.now()
-        #return None
-        return self.interface._poll(timeout=timeout,**self.params)
+        """ waits for the input to go True. returns the time of the change, or
+        None if timeout elapses first. interfaces that capture edges (e.g.
+        RaspberryPiInterface) return as soon as the edge arrives. """
+        if self.debouncer is None:
+            return self.interface._poll(timeout=timeout,**self.params)
+
+        # software filter: a True that doesn't last min_high is a glitch
+        start = time.time()
+        while True:
+            remaining = None
+            if timeout is not None:
+                remaining = timeout - (time.time() - start)
+                if remaining <= 0:
+                    return None
+            edge_time = self.interface._poll(timeout=remaining,**self.params)
+            if edge_time is None:
+                return None
+            time.sleep(self.debouncer.min_high)
+            if self.interface._read_bool(**self.params):
+                self.debouncer.reset(True)
+                return edge_time
+
+    def wait_for(self, level=True, timeout=None, poll_interval=0.005):
+        """ waits for the input to read level, in either direction. returns
+        the time it changed to level (now if it already reads level), or None
+        if timeout elapses first. interfaces with '_wait_any' wake on the
+        captured edge itself; others are read every poll_interval seconds. """
+        level = bool(level)
+        if self.debouncer is None and hasattr(self.interface,'_wait_any'):
+            hits = self.interface._wait_any([(self.params, level)], timeout=timeout)
+            if hits:
+                return hits[0][1]
+            return None
+        start = time.time()
+        while True:
+            if self.read() == level:
+                return datetime.datetime.now()
+            if timeout is not None and time.time() - start >= timeout:
+                return None
+            time.sleep(poll_interval)
+
+    def last_edge(self, level=True):
+        """ time of the most recent captured change of the input to level.
+        returns None if the interface does not capture edges or has not seen
+        one. """
+        if hasattr(self.interface,'_last_edge'):
+            return self.interface._last_edge(level=level,**self.params)
+        return None
 
     def callback(self, func):
         return self.interface._callback(func=func, **self.params)
 
+class Debouncer(object):
+    """Software glitch filter for a boolean input.
+
+    A change of level is only reported once the raw level has held steady for
+    min_high (changes to True) or min_low (changes to False) seconds. The
+    caller passes the time the raw level changed if it knows it (e.g. from an
+    interface's captured edges). Otherwise the change is taken to have
+    happened just after the previous update(), so a reading taken long after
+    the change is reported straight away.
+
+    Keyword arguments:
+    min_high -- seconds a True must last to be reported (default=0.0)
+    min_low -- seconds a False must last to be reported (default=0.0)
+    """
+    def __init__(self,min_high=0.0,min_low=0.0):
+        self.min_high = min_high
+        self.min_low = min_low
+        self.reset()
+
+    def reset(self,level=None):
+        self.level = level
+        self._pending = None
+        self._since = None
+        self._last_update = None
+
+    def update(self,raw,now=None,since=None):
+        """feed a raw reading, returns the filtered level. since is the time
+        the raw level changed, if known"""
+        if now is None:
+            now = time.time()
+        raw = bool(raw)
+        last_update, self._last_update = self._last_update, now
+        if self.level is None or raw == self.level:
+            self.level = raw
+            self._pending = None
+            return self.level
+        if self._pending != raw:
+            self._pending = raw
+            self._since = last_update if last_update is not None else now
+        if since is None:
+            since = self._since
+        if now - since >= (self.min_high if raw else self.min_low):
+            self.level = raw
+            self._pending = None
+        return self.level
+
+class BooleanInputBank(object):
+    """Reads a group of BooleanInputs with as few interface calls as possible.
+
+    Inputs that share an interface with a '_read_bank' method (e.g. one
+    pigpio read_bank_1 call, or one comedi_dio_bitfield2 call per 32
+    channels) are read together in a single call. Inputs on any other
+    interface fall back to their own read().
+
+    Keyword arguments:
+    inputs -- list of BooleanInput instances, or dict of name:BooleanInput
+
+    Methods:
+    read() -- reads every input. Returns a list of booleans in the order of
+        inputs, or a dict of name:boolean if inputs was a dict
+    read_mask(raw) -- reads every input. Returns an int with bit i set if
+        input i is True. With raw=True the inputs' software debounce is
+        skipped and left untouched
+    """
+    def __init__(self,inputs):
+        if isinstance(inputs,dict):
+            self.names = list(inputs.keys())
+            self.inputs = list(inputs.values())
+        else:
+            self.names = None
+            self.inputs = list(inputs)
+        for input_ in self.inputs:
+            assert isinstance(input_,BooleanInput)
+
+        # group input indices by interface, keeping first-seen order
+        self._groups = []
+        for ii, input_ in enumerate(self.inputs):
+            for interface, indices in self._groups:
+                if interface is input_.interface:
+                    indices.append(ii)
+                    break
+            else:
+                self._groups.append((input_.interface,[ii]))
+
+    def _read_values(self,raw=False):
+        values = [False] * len(self.inputs)
+        for interface, indices in self._groups:
+            if hasattr(interface,'_read_bank'):
+                bank = interface._read_bank([self.inputs[ii].params for ii in indices])
+                if not raw:
+                    bank = [self.inputs[ii]._filter(value) for ii, value in zip(indices,bank)]
+            elif raw:
+                bank = [interface._read_bool(**self.inputs[ii].params) for ii in indices]
+            else:
+                bank = [self.inputs[ii].read() for ii in indices]
+            for ii, value in zip(indices,bank):
+                values[ii] = bool(value)
+        return values
+
+    def read(self):
+        """read status of every input"""
+        values = self._read_values()
+        if self.names is None:
+            return values
+        return dict(zip(self.names,values))
+
+    def read_mask(self,raw=False):
+        """read status of every input as a bitmask"""
+        mask = 0
+        for ii, value in enumerate(self._read_values(raw=raw)):
+            if value:
+                mask |= 1 << ii
+        return mask
+
+class InputSampler(object):
+    """Samples a group of BooleanInputs on a background thread into a ring
+    buffer backed by memory-mapped files, so other processes can read the raw
+    sensor history without copying it.
+
+    Every sample is one raw BooleanInputBank.read_mask(), without the inputs'
+    debounce (one I/O per interface), stored with its time.time() in a numpy structured array. Three files are
+    written next to each other:
+
+    <path>.samples.npy -- the ring buffer, fields 'time' (float64) and
+        'state' (uint32, bit i set if input i was True)
+    <path>.head.npy -- total number of samples written so far (uint64)
+    <path>.json -- input names, rate and buffer length
+
+    Keyword arguments:
+    inputs -- list of BooleanInput instances, or dict of name:BooleanInput
+        (at most 32)
+    path -- path prefix for the files, e.g. in the experiment_path
+    rate -- samples per second (default=1000.0)
+    length -- number of samples kept (default=10 minutes at rate)
+
+    Methods:
+    start() -- starts the sampling thread
+    stop() -- stops the sampling thread and flushes the files
+    reader() -- returns an InputSampleReader on the files
+    """
+    dtype = np.dtype([('time','<f8'),('state','<u4')])
+
+    def __init__(self,inputs,path,rate=1000.0,length=None):
+        self.bank = BooleanInputBank(inputs)
+        assert len(self.bank.inputs) <= 32
+        if self.bank.names is not None:
+            self.names = [str(name) for name in self.bank.names]
+        else:
+            self.names = [str(ii) for ii in range(len(self.bank.inputs))]
+        self.path = path
+        self.rate = float(rate)
+        self.length = int(length) if length is not None else int(self.rate * 600)
+        self.overruns = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.samples = np.lib.format.open_memmap(path + '.samples.npy', mode='w+',
+                                                 dtype=self.dtype, shape=(self.length,))
+        self.head = np.lib.format.open_memmap(path + '.head.npy', mode='w+',
+                                              dtype='<u8', shape=(1,))
+        with open(path + '.json','w') as f:
+            json.dump({'names': self.names,
+                       'rate': self.rate,
+                       'length': self.length,
+                       }, f, indent=4)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='InputSampler')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.samples.flush()
+        self.head.flush()
+
+    def _run(self):
+        period = 1.0 / self.rate
+        next_time = time.time()
+        count = int(self.head[0])
+        while not self._stop.is_set():
+            ii = count % self.length
+            self.samples['state'][ii] = self.bank.read_mask(raw=True)
+            self.samples['time'][ii] = time.time()
+            count += 1
+            self.head[0] = count  # publish after the sample is written
+            next_time += period
+            delay = next_time - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # fell behind (slow I/O): skip ahead instead of bursting
+                self.overruns += 1
+                next_time = time.time()
+
+    def reader(self):
+        return InputSampleReader(self.path)
+
+class InputSampleReader(object):
+    """Read-only view on the files written by an InputSampler, from this or
+    any other process.
+
+    Keyword arguments:
+    path -- path prefix the InputSampler was given
+
+    Methods:
+    latest(n) -- the n most recent samples, oldest first
+    between(start, end) -- samples with start <= time < end (seconds since the
+        epoch or datetimes), e.g. the beam-break trace around a trial
+    level(name, samples) -- boolean array of one input's level in samples
+    """
+    def __init__(self,path):
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        self.names = meta['names']
+        self.rate = meta['rate']
+        self.length = meta['length']
+        self.samples = np.load(path + '.samples.npy', mmap_mode='r')
+        self.head = np.load(path + '.head.npy', mmap_mode='r')
+
+    def count(self):
+        """total number of samples written"""
+        return int(self.head[0])
+
+    def latest(self,n=1):
+        count = self.count()
+        n = min(n, count, self.length)
+        start = (count - n) % self.length
+        if start + n <= self.length:
+            return self.samples[start:start + n]  # no copy
+        return np.concatenate((self.samples[start:], self.samples[:start + n - self.length]))
+
+    def between(self,start,end):
+        if isinstance(start,datetime.datetime):
+            start = time.mktime(start.timetuple()) + start.microsecond / 1e6
+        if isinstance(end,datetime.datetime):
+            end = time.mktime(end.timetuple()) + end.microsecond / 1e6
+        samples = self.latest(self.length)
+        first, last = np.searchsorted(samples['time'], [start, end])
+        return samples[first:last]
+
+    def level(self,name,samples):
+        bit = self.names.index(str(name))
+        return (samples['state'] >> bit) & 1 == 1
+
 class BooleanOutput(BaseIO):
     """Class which holds information about outputs and abstracts the methods of
     writing to them
@@ -72,7 +418,7 @@ class BooleanOutput(BaseIO):
     read() -- if the interface supports '_read_bool' for this output, returns
         the current value of the output from the interface. Otherwise this
         returns the last passed by write(value)
-    toggle() -- flips the value from the current value
+    toggle() -- flips the value from the last value written
     """
     def __init__(self,interface=None,params={},*args,**kwargs):
         super(BooleanOutput, self).__init__(interface=interface,params=params,*args,**kwargs)
@@ -96,11 +442,17 @@ class BooleanOutput(BaseIO):
 
     def write(self,value=False):
         """write status"""
-        self.last_value = self.interface._write_bool(value=value,**self.params)
-        return self.last_value
+        result = self.interface._write_bool(value=value,**self.params)
+        # interfaces return True (comedi) or None (pigpio); keep what was asked for
+        self.last_value = bool(value)
+        return result
 
     def toggle(self):
-        value = not self.read()
+        # flip what was last written, rather than read the hardware back
+        if self.last_value is None:
+            value = not self.read()
+        else:
+            value = not self.last_value
         return self.write(value=value)
 
 class AudioOutput(BaseIO):
@@ -174,4 +526,500 @@ class PWMOutput(BaseIO):
         self.write(new_val)
         return new_val
 
+class OutputGroup(object):
+    """Writes a group of outputs together, with as few interface calls as
+    possible, so a change of several outputs appears at once.
+
+    BooleanOutputs that share an interface with a '_write_bool_bank' method
+    (e.g. one comedi_dio_bitfield2 call per 32 channels, or pigpio's
+    set_bank_1/clear_bank_1) are written in a single call, as are
+    PWMOutputs that share an interface with a '_write_pwm_bank' method (e.g.
+    one PCA9685 block write for a run of channels). Outputs on any other
+    interface fall back to their own write().
+
+    Keyword arguments:
+    outputs -- list of BooleanOutput/PWMOutput instances, or dict of
+        name:output
+
+    Methods:
+    write(values,changed_only) -- writes every output. values is a list in
+        the order of outputs, a dict of name:value (outputs not named are left
+        alone), or a single value for all of them. With changed_only, outputs
+        whose last written value already matches are skipped. Returns the
+        values written
+    read() -- the last value written to each output, as a list or dict
+    read_list() -- the last value written to each output, as a list
+    snapshot() -- the last value written to each output, as a dict of
+        output:value
+    restore(snapshot) -- writes the outputs in a snapshot (from any group)
+        back to their values in one batched write
+    """
+    def __init__(self,outputs):
+        if isinstance(outputs,dict):
+            self.names = list(outputs.keys())
+            self.outputs = list(outputs.values())
+        else:
+            self.names = None
+            self.outputs = list(outputs)
+        for output in self.outputs:
+            assert isinstance(output,(BooleanOutput,PWMOutput))
+
+    def _changes(self,values):
+        if isinstance(values,dict):
+            return [(self.names.index(name),value) for name, value in values.items()]
+        if isinstance(values,(list,tuple)):
+            assert len(values) == len(self.outputs)
+            return list(enumerate(values))
+        return [(ii,values) for ii in range(len(self.outputs))]
+
+    def _unchanged(self,output,value):
+        if output.last_value is None:
+            return False
+        if isinstance(output,BooleanOutput):
+            return bool(output.last_value) == bool(value)
+        return float(output.last_value) == float(value)
+
+    def write(self,values=False,changed_only=False):
+        """write every output at once"""
+        changes = self._changes(values)
+        if changed_only:
+            changes = [(ii,value) for ii, value in changes
+                       if not self._unchanged(self.outputs[ii],value)]
+        groups = []
+        for ii, value in changes:
+            output = self.outputs[ii]
+            if isinstance(output,BooleanOutput):
+                method, value = '_write_bool_bank', bool(value)
+            else:
+                method = '_write_pwm_bank'
+            if not hasattr(output.interface,method):
+                output.write(value)
+                continue
+            for interface, name, items in groups:
+                if interface is output.interface and name == method:
+                    items.append((ii,value))
+                    break
+            else:
+                groups.append((output.interface,method,[(ii,value)]))
+        for interface, method, items in groups:
+            getattr(interface,method)([self.outputs[ii].params for ii, value in items],
+                                      [value for ii, value in items])
+            for ii, value in items:
+                self.outputs[ii].last_value = value
+        return values
+
+    def read_list(self):
+        """last value written to each output, in order"""
+        return [output.last_value for output in self.outputs]
+
+    def read(self):
+        """last value written to each output"""
+        values = self.read_list()
+        if self.names is None:
+            return values
+        return dict(zip(self.names,values))
+
+    def snapshot(self):
+        """last value written to each output, as a dict of output:value"""
+        return dict((output,output.last_value) for output in self.outputs)
+
+    def restore(self,snapshot):
+        """writes each output in snapshot back to its value, skipping those
+        already there and those never written. returns snapshot"""
+        items = [(output,value) for output, value in snapshot.items() if value is not None]
+        if items:
+            OutputGroup([output for output, value in items]).write(
+                [value for output, value in items],changed_only=True)
+        return snapshot
+
+
+class OutputRegistry(OutputGroup):
+    """The outputs of a panel, with the last value written to each (their
+    shadow), so the panel's output state can be saved and put back without
+    reading any hardware.
+
+    Components register their outputs when they are built (see the
+    registry argument of components.BaseComponent), and panels register any
+    others with BasePanel.register().
+
+    Keyword arguments:
+    outputs -- list of BooleanOutput/PWMOutput instances
+
+    Methods:
+    register(*outputs) -- adds outputs, each once, in the order given
+    snapshot() -- the last value written to every output, as a dict of
+        output:value. Cheap: no hardware is read
+    restore(snapshot) -- writes back the outputs that have changed since, in
+        one batched write (see OutputGroup)
+    """
+    def __init__(self,outputs=()):
+        super(OutputRegistry, self).__init__([])
+        self.register(*outputs)
+
+    def register(self,*outputs):
+        for output in outputs:
+            assert isinstance(output,(BooleanOutput,PWMOutput))
+            if output not in self:
+                self.outputs.append(output)
+        return outputs
+
+    def __contains__(self,output):
+        return any(output is known for known in self.outputs)
+
+
+class Fade(object):
+    """A fade of an OutputGroup from its current values to target, run by a
+    Fader. Values are interpolated linearly over duration seconds.
+
+    Methods:
+    values(now) -- the interpolated values at time now
+    done() -- True once the target has been written or the fade cancelled
+    wait(timeout) -- blocks until done. Returns done()
+    cancel() -- stops the fade where it is
+    """
+    def __init__(self,group,target,duration):
+        self.group = group
+        self.start = [0.0 if value is None else float(value) for value in group.read_list()]
+        if isinstance(target,dict):
+            target = [target.get(name,start) for name, start in zip(group.names,self.start)]
+        elif not isinstance(target,(list,tuple)):
+            target = [target] * len(self.start)
+        assert len(target) == len(self.start)
+        self.target = [float(value) for value in target]
+        self.duration = max(float(duration),0.0)
+        self.t0 = time.time()
+        self.last = None
+        self.cancelled = False
+        self._done = threading.Event()
+
+    def values(self,now):
+        if self.duration == 0.0:
+            return list(self.target)
+        x = min(max((now - self.t0) / self.duration,0.0),1.0)
+        return [a + (b - a) * x for a, b in zip(self.start,self.target)]
+
+    def finished(self,now):
+        return now - self.t0 >= self.duration
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self,timeout=None):
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        self.cancelled = True
+        self._done.set()
+
+
+class Fader(object):
+    """Runs fades of OutputGroups (e.g. a house light ramping up to full
+    color over 30 minutes) on one background thread, so callers don't block.
+
+    Every tick, each running fade is stepped to its interpolated values and
+    written with a single OutputGroup.write(), i.e. one batched write per
+    group per tick. A write is skipped if no output moved by at least
+    resolution since the last write. The thread sleeps while no fade is
+    running.
+
+    Keyword arguments:
+    tick -- seconds between updates (default=0.1)
+    resolution -- smallest change worth writing (default=100/4096, one
+        PCA9685 step in percent)
+
+    Methods:
+    fade(group,target,duration) -- starts fading group to target (a list,
+        dict of name:value or single value) over duration seconds, replacing
+        any fade already running on group. Returns the Fade
+    fading(group) -- the Fade running on group, or None
+    cancel(group) -- stops any fade running on group where it is
+    stop() -- stops the thread
+    """
+    def __init__(self,tick=0.1,resolution=100.0/4096):
+        self.tick = tick
+        self.resolution = resolution
+        self._fades = []
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def fade(self,group,target,duration):
+        fade = Fade(group,target,duration)
+        with self._cond:
+            self._remove(group)
+            self._fades.append(fade)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop = False
+                self._thread = threading.Thread(target=self._run, name='Fader')
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify_all()
+        return fade
+
+    def fading(self,group):
+        with self._cond:
+            for fade in self._fades:
+                if fade.group is group:
+                    return fade
+        return None
+
+    def cancel(self,group):
+        with self._cond:
+            self._remove(group)
+
+    def _remove(self,group):
+        for fade in [f for f in self._fades if f.group is group]:
+            fade.cancel()
+            self._fades.remove(fade)
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            for fade in self._fades:
+                fade.cancel()
+            self._fades = []
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _step(self,fade,now):
+        finished = fade.finished(now)
+        values = fade.values(now)
+        if (finished or fade.last is None or
+                max(abs(a - b) for a, b in zip(values,fade.last)) >= self.resolution):
+            fade.group.write(values)
+            fade.last = values
+        return finished
+
+    def _run(self):
+        next_time = time.time()
+        while True:
+            with self._cond:
+                while not self._fades and not self._stop:
+                    self._cond.wait()
+                    next_time = time.time()
+                if self._stop:
+                    return
+                now = time.time()
+                for fade in list(self._fades):
+                    if fade.cancelled:
+                        continue
+                    if self._step(fade,now):
+                        self._fades.remove(fade)
+                        fade._done.set()
+            next_time += self.tick
+            delay = next_time - time.time()
+            if delay > 0:
+                with self._cond:
+                    if not self._stop:
+                        self._cond.wait(delay)
+            else:
+                next_time = time.time()
+
+
+_fader = None
+_fader_lock = threading.Lock()
+
+def get_fader():
+    """ the Fader shared by every component in this process """
+    global _fader
+    with _fader_lock:
+        if _fader is None:
+            _fader = Fader()
+        return _fader
+
+
+class Blink(object):
+    """A blink pattern run by a BlinkScheduler: on for period*duty seconds,
+    off for the rest of the period, until duration seconds or repeat cycles
+    have passed (whichever comes first), or it is cancelled. Then end() is
+    called, which turns the target off unless told otherwise.
+
+    Methods:
+    done() -- True once the pattern has ended
+    wait(timeout) -- blocks until done. Returns done()
+    cancel() -- ends the pattern now
+    """
+    def __init__(self,on,off,period,duty=0.5,duration=None,repeat=None,end=None):
+        assert 0.0 < duty <= 1.0
+        self.on = on
+        self.off = off
+        self.end = end if end is not None else off
+        self.period = float(period)
+        self.duty = duty
+        self.duration = duration
+        self.repeat = repeat
+        self.cycles = 0
+        self.lit = False
+        self.start_time = None
+        self.scheduler = None
+        self.key = None
+        self.due = None
+        self.end_tick = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self,timeout=None):
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        if self.scheduler is not None:
+            self.scheduler.cancel(self)
+
+
+class BlinkScheduler(object):
+    """Runs any number of Blinks on one background thread, e.g. every key
+    light and cue on a panel, so the behavior thread can watch inputs while
+    they flash.
+
+    Pending on/off transitions sit in a hashed timer wheel of slots buckets,
+    one per tick, so each tick only looks at the transitions due in its own
+    bucket no matter how many patterns are running. The thread sleeps while
+    no pattern is running.
+
+    Keyword arguments:
+    tick -- resolution of the on/off times in seconds (default=0.01)
+    slots -- number of buckets in the wheel (default=512)
+
+    Methods:
+    blink(target,period,duty,duration,repeat,end) -- starts blinking target,
+        replacing any pattern already running on it. target is a component
+        with on()/off() methods, a BooleanOutput or a PWMOutput. Returns the
+        Blink
+    start(blink) -- runs a Blink built with explicit on/off callables
+    blinking(target) -- the Blink running on target, or None
+    cancel(blink) -- ends blink now, calling its end()
+    stop() -- ends every pattern and stops the thread
+    """
+    def __init__(self,tick=0.01,slots=512):
+        self.tick = tick
+        self.slots = slots
+        self._wheel = [[] for _ in range(slots)]
+        self._active = {}
+        self._cond = threading.Condition(threading.RLock())
+        self._now = 0
+        self._t0 = None
+        self._stop = False
+        self._thread = None
+
+    def blink(self,target,period=1.0,duty=0.5,duration=None,repeat=None,end=None):
+        if isinstance(target,BooleanOutput):
+            on, off = lambda: target.write(True), lambda: target.write(False)
+        elif isinstance(target,PWMOutput):
+            on, off = lambda: target.write(100.0), lambda: target.write(0.0)
+        else:
+            on, off = target.on, target.off
+        return self.start(Blink(on,off,period,duty=duty,duration=duration,
+                                repeat=repeat,end=end),key=target)
+
+    def start(self,blink,key=None):
+        with self._cond:
+            if key is not None and key in self._active:
+                self._finish(self._active[key])
+            blink.scheduler = self
+            blink.key = key if key is not None else blink
+            self._active[blink.key] = blink
+            if self._thread is None or not self._thread.is_alive():
+                self._stop = False
+                self._t0 = time.time()
+                self._now = 0
+                self._thread = threading.Thread(target=self._run, name='BlinkScheduler')
+                self._thread.daemon = True
+                self._thread.start()
+            blink.start_time = time.time()
+            if blink.duration is not None:
+                blink.end_tick = self._now + max(int(round(blink.duration / self.tick)),1)
+            else:
+                blink.end_tick = None
+            self._fire(blink)
+            self._cond.notify_all()
+        return blink
+
+    def blinking(self,target):
+        with self._cond:
+            return self._active.get(target)
+
+    def cancel(self,blink):
+        with self._cond:
+            if not blink.done():
+                self._finish(blink)
+
+    def stop(self):
+        with self._cond:
+            for blink in list(self._active.values()):
+                self._finish(blink)
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _schedule(self,blink,ticks):
+        due = self._now + max(ticks,1)
+        if blink.end_tick is not None:
+            due = min(due,blink.end_tick)
+        blink.due = due
+        self._wheel[due % self.slots].append(blink)
+
+    def _finish(self,blink):
+        self._active.pop(blink.key,None)
+        blink.end()
+        blink._done.set()
+
+    def _fire(self,blink):
+        if blink.end_tick is not None and self._now >= blink.end_tick:
+            return self._finish(blink)
+        if blink.lit and blink.duty < 1.0:
+            blink.off()
+            blink.lit = False
+            blink.cycles += 1
+            if blink.repeat is not None and blink.cycles >= blink.repeat:
+                return self._finish(blink)
+            self._schedule(blink,int(round(blink.period * (1.0 - blink.duty) / self.tick)))
+        else:
+            if not blink.lit:
+                blink.on()
+                blink.lit = True
+            elif blink.repeat is not None:
+                # always on: count a cycle per period
+                blink.cycles += 1
+                if blink.cycles >= blink.repeat:
+                    return self._finish(blink)
+            self._schedule(blink,int(round(blink.period * blink.duty / self.tick)))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._active and not self._stop:
+                    self._cond.wait()
+                    # restart the clock so an idle gap isn't replayed
+                    self._t0 = time.time() - self._now * self.tick
+                if self._stop:
+                    return
+                target = int((time.time() - self._t0) / self.tick)
+                while self._now < target:
+                    self._now += 1
+                    bucket = self._wheel[self._now % self.slots]
+                    due = [b for b in bucket if b.due <= self._now]
+                    bucket[:] = [b for b in bucket if b.due > self._now]
+                    for blink in due:
+                        if not blink.done():
+                            self._fire(blink)
+                delay = self._t0 + (self._now + 1) * self.tick - time.time()
+                if delay > 0 and not self._stop:
+                    self._cond.wait(delay)
+
+
+_blink_scheduler = None
+
+def get_blink_scheduler():
+    """ the BlinkScheduler shared by components with no scheduler of their
+    own """
+    global _blink_scheduler
+    with _fader_lock:
+        if _blink_scheduler is None:
+            _blink_scheduler = BlinkScheduler()
+        return _blink_scheduler
+
 
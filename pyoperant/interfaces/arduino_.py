@@ -1,6 +1,13 @@
 import time
 import datetime
+import struct
+import threading
+import collections
 import serial
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import logging
 from pyoperant.interfaces import base_
 from pyoperant import utils, InterfaceError
@@ -8,9 +15,268 @@ from pyoperant import utils, InterfaceError
 logger = logging.getLogger(__name__)
 
 # TODO: Smart find arduinos using something like this: http://stackoverflow.com/questions/19809867/how-to-check-if-serial-port-is-already-open-by-another-process-in-linux-using
-# TODO: Attempt to reconnect device if it can't be reached
 # TODO: Allow device to be connected to through multiple python instances. This kind of works but needs to be tested thoroughly.
 
+# Kinds of reply a request expects from the firmware
+REPLY_NONE = 0   # no reply
+REPLY_BYTE = 1   # action 0: one byte (0x5A, 1, byte while streaming)
+REPLY_BITS = 2   # action 6: length byte and bitfield (0x5A, length, bitfield while streaming)
+REPLY_TIME = 3   # action 8: 0xA6 and 4 bytes of micros()
+REPLY_ACK = 4    # action 7 with channel 0: 0x5A, 0 once streaming has stopped
+
+EVENT_MARKER = 0xA5
+TIME_MARKER = 0xA6
+REPLY_MARKER = 0x5A
+
+
+class _Request(object):
+    """One queued command and, if it expects one, its reply."""
+
+    def __init__(self, data, reply=REPLY_NONE, callback=None, streaming=None):
+        self.data = data
+        self.reply = reply
+        self.callback = callback
+        self.streaming = streaming
+        self.framed = False
+        self.sent = None
+        self.received = None
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def done(self):
+        return self._done.is_set()
+
+    def _finish(self, result=None, error=None):
+        if self._done.is_set():
+            return
+        self.result = result
+        self.error = error
+        self.received = time.time()
+        self._done.set()
+        if self.callback is not None and error is None:
+            try:
+                self.callback(self)
+            except Exception:
+                logger.exception("Error in serial request callback")
+
+
+class _SerialTransport(object):
+    """Owns a serial port to operant_serial firmware.
+
+    A writer thread takes commands from a queue and writes whatever has
+    queued up in a single write, so the caller never blocks on the port and
+    a burst of commands (e.g. configuring every channel) goes out as one
+    pipelined batch. A reader thread matches replies to requests in the
+    order they were written, which is the order the firmware answers them,
+    so several requests can be in flight at once. While the firmware is
+    streaming it also hands input change frames to on_event.
+
+    A request that isn't answered within its timeout raises InterfaceError
+    and resynchronizes the reply stream: everything still in flight fails
+    and unread input is discarded. After the port fails the error is kept
+    and every later request raises it.
+    """
+
+    def __init__(self, device, name, on_event=None, on_idle=None, on_failure=None):
+        self.device = device
+        self.name = name
+        self.on_event = on_event
+        self.on_idle = on_idle
+        self.on_failure = on_failure
+        self.streaming = False
+        self.error = None
+        self._queue = queue.Queue()
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name='ArduinoWriter-%s' % name)
+        self._reader = threading.Thread(target=self._read_loop, name='ArduinoReader-%s' % name)
+        for thread in (self._writer, self._reader):
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._queue.put(None)
+        for thread in (self._writer, self._reader):
+            if thread is not threading.current_thread():
+                thread.join()
+        self._fail_pending(InterfaceError('Serial device %s was closed' % self.name))
+
+    def request(self, data, reply=REPLY_NONE, callback=None, streaming=None):
+        """queue data to be written. returns the _Request without waiting.
+        streaming is True or False if this command starts or stops stream mode,
+        which changes how the replies that follow it are framed"""
+        if self.error is not None:
+            raise InterfaceError('Serial device %s failed: %s' % (self.name, self.error))
+        if self._stop.is_set():
+            raise InterfaceError('Serial device %s was closed' % self.name)
+        req = _Request(data, reply=reply, callback=callback, streaming=streaming)
+        self._queue.put(req)
+        return req
+
+    def wait(self, req, timeout):
+        """wait for req to be written (and answered, if it expects a reply).
+        returns its result"""
+        if not req._done.wait(timeout):
+            self.resync()
+            raise InterfaceError('No reply from serial device %s within %g s' % (self.name, timeout))
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def call(self, data, reply=REPLY_NONE, timeout=1.0):
+        return self.wait(self.request(data, reply=reply), timeout)
+
+    def flush(self, timeout=1.0):
+        """wait until everything queued so far has been written"""
+        return self.call(b'', timeout=timeout)
+
+    def resync(self):
+        """fail everything in flight and discard unread input"""
+        logger.warning("Resynchronizing serial device %s" % self.name)
+        self._fail_pending(InterfaceError('Serial device %s was resynchronized' % self.name))
+        try:
+            self.device.flushInput()
+        except (serial.SerialException, OSError):
+            pass
+
+    def _fail_pending(self, error):
+        with self._lock:
+            pending, self._pending = list(self._pending), collections.deque()
+        for req in pending:
+            req._finish(error=error)
+
+    def _failed(self, err):
+        logger.error("Serial device %s failed: %s" % (self.name, err))
+        self.error = err
+        self._fail_pending(InterfaceError('Serial device %s failed: %s' % (self.name, err)))
+        if self.on_failure is not None:
+            self.on_failure(err)
+
+    def _write_loop(self):
+        while not self._stop.is_set():
+            req = self._queue.get()
+            if req is None:
+                break
+            batch = [req]
+            while True:
+                try:
+                    req = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if req is None:
+                    self._stop.set()
+                    break
+                batch.append(req)
+            if self.error is not None:
+                for req in batch:
+                    req._finish(error=InterfaceError('Serial device %s failed: %s' % (self.name, self.error)))
+                continue
+            with self._lock:
+                now = time.time()
+                for req in batch:
+                    req.framed = self.streaming
+                    req.sent = now
+                    if req.streaming is not None:
+                        self.streaming = req.streaming
+                    if req.reply != REPLY_NONE:
+                        self._pending.append(req)
+            try:
+                self.device.write(b''.join(req.data for req in batch))
+            except (serial.SerialException, OSError) as err:
+                self._failed(err)
+                # _failed only fails the requests waiting on a reply
+                for req in batch:
+                    if req.reply == REPLY_NONE:
+                        req._finish(error=InterfaceError('Serial device %s failed: %s' % (self.name, err)))
+                continue
+            for req in batch:
+                if req.reply == REPLY_NONE:
+                    req._finish()
+
+    def _head(self):
+        with self._lock:
+            return self._pending[0] if self._pending else None
+
+    def _complete(self, req, result):
+        with self._lock:
+            if self._pending and self._pending[0] is req:
+                self._pending.popleft()
+        req._finish(result=result)
+
+    def _read(self, n, stall=0.5):
+        """read exactly n bytes, or None if stopped or nothing arrives for
+        stall seconds (a truncated frame)"""
+        data = bytearray()
+        last = time.time()
+        while len(data) < n:
+            if self._stop.is_set():
+                return None
+            chunk = self.device.read(n - len(data))
+            if chunk:
+                data.extend(bytearray(chunk))
+                last = time.time()
+            elif time.time() - last > stall:
+                logger.warning("Truncated frame from %s" % self.name)
+                return None
+        return data
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            try:
+                first = bytearray(self.device.read(1))
+                if not first:
+                    if self.on_idle is not None:
+                        self.on_idle()
+                    continue
+                # requests are registered before they are written, so the
+                # head is already known when its reply starts to arrive
+                head = self._head()
+                if head is not None and not head.framed and head.reply in (REPLY_BYTE, REPLY_BITS):
+                    self._read_unframed(head, first[0])
+                else:
+                    self._read_frame(first[0])
+            except (serial.SerialException, OSError) as err:
+                self._failed(err)
+                break
+
+    def _read_unframed(self, head, first):
+        if head.reply == REPLY_BYTE:
+            self._complete(head, first)
+        else:
+            bits = self._read(first)
+            if bits is not None:
+                self._complete(head, bits)
+
+    def _read_frame(self, marker):
+        head = self._head()
+        if marker == EVENT_MARKER:
+            frame = self._read(6)
+            if frame is not None and self.on_event is not None:
+                self.on_event(*struct.unpack('<BBI', bytes(frame)))
+        elif marker == TIME_MARKER:
+            frame = self._read(4)
+            if frame is None:
+                return
+            if head is not None and head.reply == REPLY_TIME:
+                self._complete(head, struct.unpack('<I', bytes(frame))[0])
+            else:
+                logger.warning("Unexpected time reply from %s" % self.name)
+        elif marker == REPLY_MARKER:
+            length = self._read(1)
+            payload = self._read(length[0]) if length is not None else None
+            if payload is None:
+                return
+            if head is not None and head.reply in (REPLY_BYTE, REPLY_BITS, REPLY_ACK):
+                self._complete(head, payload[0] if head.reply == REPLY_BYTE else payload)
+            else:
+                logger.warning("Unexpected reply from %s" % self.name)
+        else:
+            logger.warning("Unexpected byte 0x%02x from %s, resynchronizing" % (marker, self.name))
+
+
 class ArduinoInterface(base_.BaseInterface):
     """Creates a pyserial interface to communicate with an Arduino via the serial connection.
     Communication is through two byte messages where the first byte specifies the channel and the second byte specifies the action.
@@ -21,21 +287,72 @@ class ArduinoInterface(base_.BaseInterface):
     3. Sets channel as an output
     4. Sets channel as an input
     5. Sets channel as an input with a pullup resistor (basically inverts the input values)
+    6. Read all inputs. The reply is a length byte followed by that many bytes of bitfield, where bit (channel % 8) of
+       byte (channel / 8) holds the level of each configured input.
+    7. Stream input changes (channel 1) or stop streaming (channel 0). While streaming, the device sends every change
+       on an input as 0xA5, channel, level, micros() (4 bytes, little-endian), starting with the current level of
+       each input, and frames replies to other requests as 0x5A, length, reply. Stopping is acknowledged with 0x5A, 0.
+    8. Reply with the device clock as 0xA6, micros() (4 bytes, little-endian)
+    All serial I/O goes through a _SerialTransport, so commands are pipelined and writes don't block the caller.
+    If the port fails (e.g. the USB cable is pulled), it is reopened in the background with exponential backoff. Once
+    the firmware prints its "Initialized!" banner, the channel configuration, the last value written to each output,
+    and stream mode are replayed. Meanwhile, calls wait up to reconnect_timeout for the device to come back before
+    raising InterfaceError. Reconnects and downtime are counted in the metrics dict.
     :param device_name: The address of the device on the local system (e.g. /dev/tty.usbserial)
     :param baud_rate: The baud (bits/second) rate for serial communication. If this is changed, then it also needs to be changed in the arduino project code.
+    :param snapshot_ttl: If greater than 0, _read_bool answers from the last read_all() snapshot as long as it is
+    younger than this many seconds, so reading several inputs in a row costs a single serial exchange. Defaults to 0.
+    :param stream: Put the device in stream mode (action 7) after configuring it. A reader thread then collects input
+    changes, timestamped by the device clock, and reads and polls are answered locally without any serial traffic.
+    Defaults to False.
+    :param edge_buffer_len: Number of input changes kept per channel. Defaults to 64.
+    :param reply_timeout: Seconds to wait for the device to answer a request before raising InterfaceError.
+    Defaults to 1.0.
+    :param reconnect_timeout: Seconds a call waits for a lost device to reconnect before raising InterfaceError.
+    Defaults to 10.0.
+    :param banner_timeout: Seconds to wait for the firmware's "Initialized!" banner after opening the port (the board
+    resets when the port opens). Defaults to 5.0.
     """
 
+    reconnect_backoff = (0.1, 5.0)  # first and longest delay between attempts to reopen the port
+
     _default_state = dict(invert=False,
                           held=False,
                           )
 
-    def __init__(self, device_name, baud_rate=19200, inputs=None, outputs=None, *args, **kwargs):
+    def __init__(self, device_name, baud_rate=19200, inputs=None, outputs=None, snapshot_ttl=0, stream=False,
+                 edge_buffer_len=64, reply_timeout=1.0, reconnect_timeout=10.0, banner_timeout=5.0, *args, **kwargs):
 
         super(ArduinoInterface, self).__init__(*args, **kwargs)
 
         self.device_name = device_name
         self.baud_rate = baud_rate
+        self.snapshot_ttl = snapshot_ttl
+        self.reply_timeout = reply_timeout
+        self.reconnect_timeout = reconnect_timeout
+        self.banner_timeout = banner_timeout
         self.device = None
+        self.transport = None
+        self._snapshot = None
+        self._snapshot_time = 0
+        self.edges = base_.EdgeBuffer(maxlen=edge_buffer_len)
+        self.clock = None
+        self.sync_interval = 60.0
+        self._streaming = False
+        self._sync_request = None
+        self._last_sync = 0
+        self._stream_wanted = False
+        self._connected = threading.Event()
+        self._connect_lock = threading.Lock()
+        self._reconnector = None
+        self._down_since = None
+        self._closing = False
+        self.metrics = dict(reconnects=0,
+                            reconnect_attempts=0,
+                            downtime=0.0,
+                            last_disconnect=None,
+                            connected=False,
+                            )
 
         self.read_params = ('channel', 'pullup')
         self._state = dict()
@@ -49,6 +366,10 @@ class ArduinoInterface(base_.BaseInterface):
         if outputs is not None:
             for output in outputs:
                 self._config_write(output)
+        # the configuration above goes out as one pipelined write
+        self.transport.flush(self.reply_timeout)
+        if stream:
+            self.start_stream()
 
     def __str__(self):
 
@@ -64,24 +385,227 @@ class ArduinoInterface(base_.BaseInterface):
         '''
 
         logger.debug("Opening device %s" % self)
-        self.device = serial.Serial(port=self.device_name,
-                                    baudrate=self.baud_rate,
-                                    timeout=5)
-        if self.device is None:
-            raise InterfaceError('Could not open serial device %s' % self.device_name)
+        try:
+            self.device = serial.Serial(port=self.device_name,
+                                        baudrate=self.baud_rate,
+                                        timeout=0.1)
+        except (serial.SerialException, OSError) as err:
+            raise InterfaceError('Could not open serial device %s: %s' % (self.device_name, err))
 
         logger.debug("Waiting for device to open")
-        self.device.readline()
+        self._wait_for_banner()
         self.device.flushInput()
+        self.device.timeout = 0.05  # so the transport's reader notices close() quickly
+        self.transport = _SerialTransport(self.device, self.device_name,
+                                          on_event=self._handle_event,
+                                          on_idle=self._idle,
+                                          on_failure=self._lost)
+        if threading.current_thread() is not self._reconnector:
+            # a reconnect only counts as connected once the configuration is replayed
+            self._connected.set()
+            self.metrics['connected'] = True
         logger.info("Successfully opened device %s" % self)
 
+    def _wait_for_banner(self):
+        ''' Wait for the line the firmware prints once it has started '''
+
+        deadline = time.time() + self.banner_timeout
+        while time.time() < deadline:
+            if b'Initialized!' in self.device.readline():
+                return
+        logger.warning("No banner from %s within %g s, continuing" % (self.device_name, self.banner_timeout))
+
+    def _lost(self, err):
+        ''' Called by the transport when the port fails: starts reconnecting in the background '''
+
+        with self._connect_lock:
+            if self._closing or not self._connected.is_set():
+                return
+            self._connected.clear()
+            self._down_since = time.time()
+            self.metrics['connected'] = False
+            self.metrics['last_disconnect'] = datetime.datetime.now()
+            # while disconnected, reads go through _send and wait for the device to come back
+            self._streaming = False
+            self._reconnector = threading.Thread(target=self._reconnect,
+                                                 name='ArduinoReconnect-%s' % self.device_name)
+            self._reconnector.daemon = True
+            self._reconnector.start()
+        logger.error("Lost connection to %s: %s. Reconnecting" % (self.device_name, err))
+
+    def _reconnect(self):
+        ''' Reopen the port with exponential backoff and replay the configuration '''
+
+        old_transport, old_device = self.transport, self.device
+        old_transport.close()
+        try:
+            old_device.close()
+        except (serial.SerialException, OSError):
+            pass
+
+        delay, max_delay = self.reconnect_backoff
+        while not self._closing:
+            self.metrics['reconnect_attempts'] += 1
+            try:
+                self.open()
+                self._replay()
+                break
+            except (InterfaceError, serial.SerialException, OSError) as err:
+                logger.warning("Could not reconnect to %s: %s. Retrying in %g s" % (self.device_name, err, delay))
+                if self.transport is not old_transport:
+                    self.transport.close()
+                if self.device is not old_device:
+                    try:
+                        self.device.close()
+                    except (serial.SerialException, OSError):
+                        pass
+                time.sleep(delay)
+                delay = min(delay * 2, max_delay)
+        else:
+            return
+
+        self.metrics['reconnects'] += 1
+        self.metrics['downtime'] += time.time() - self._down_since
+        self.metrics['connected'] = True
+        self._connected.set()
+        logger.info("Reconnected to %s after %.2f s" % (self.device_name, time.time() - self._down_since))
+
+    def _replay(self):
+        ''' Send the stored configuration and output values to a freshly opened device '''
+
+        for channel in self.inputs:
+            self._send(channel, 5 if self._state[channel]["invert"] else 4)
+        for channel in self.outputs:
+            self._send(channel, 3)
+            if "value" in self._state[channel]:
+                self._send(channel, 1 if self._state[channel]["value"] else 2)
+        self.transport.flush(self.reply_timeout)
+        if self._stream_wanted:
+            # the device clock restarted with the board
+            self.clock = None
+            self.start_stream()
+
     def close(self):
         '''Close a serial connection for the device
         :return: None
         '''
 
         logger.debug("Closing %s" % self)
-        self.device.close()
+        self._closing = True
+        if self.transport is not None:
+            if self._streaming:
+                try:
+                    self.stop_stream()
+                except InterfaceError:
+                    pass
+            self.transport.close()
+        if self.device is not None:
+            self.device.close()
+
+    def _send(self, channel, action, reply=REPLY_NONE, wait=False):
+        ''' Queue one command. If the device is reconnecting, wait up to reconnect_timeout for it first.
+        :param reply: kind of reply the command expects
+        :param wait: wait for the command to be written and answered, and return the reply
+        :return: the reply if wait is True, otherwise the queued request
+        '''
+
+        return self._send_data(self._make_arg(channel, action), reply=reply, wait=wait)
+
+    def _send_data(self, data, reply=REPLY_NONE, wait=False):
+        ''' Queue one or more encoded commands as a single request, so they go out in one serial write
+        :return: the reply if wait is True, otherwise the queued request
+        '''
+
+        for attempt in range(2):
+            transport = self._wait_connected()
+            try:
+                req = transport.request(data, reply=reply)
+                if wait:
+                    return transport.wait(req, self.reply_timeout)
+                return req
+            except InterfaceError:
+                # retry once on the new connection if the port failed under us
+                failed = transport.error is not None or transport is not self.transport
+                if not failed or self._closing or attempt > 0:
+                    raise
+
+    def _wait_connected(self):
+        ''' The current transport, once the device is connected '''
+
+        if threading.current_thread() is not self._reconnector:
+            if not self._connected.wait(self.reconnect_timeout):
+                raise InterfaceError('Serial device %s is disconnected' % self.device_name)
+        return self.transport
+
+    def _read_micros(self):
+        ''' Read the device clock with one exchange (action 8)
+        :return: micros() on the device
+        '''
+
+        return self._send(0, 8, reply=REPLY_TIME, wait=True)
+
+    def start_stream(self):
+        ''' Switch the device to stream mode, so input changes are collected as the device reports them
+        :return: None
+        '''
+
+        if self._streaming:
+            return
+        if self.clock is None:
+            self.clock = base_.TickClock(read_tick=self._read_micros, recalibrate=None)
+        else:
+            self.clock.calibrate()
+        self._last_sync = time.time()
+        self._stream_wanted = True
+        self._streaming = True
+        self._wait_connected().request(self._make_arg(1, 7), streaming=True)
+
+        # wait for the device to report the level of every input
+        deadline = time.time() + self.reply_timeout
+        while any(self.edges.level(ch) is None for ch in self.inputs):
+            if time.time() > deadline:
+                raise InterfaceError('No input levels received from serial device %s in stream mode' % self.device_name)
+            time.sleep(0.005)
+        logger.info("Streaming inputs from %s" % self)
+
+    def stop_stream(self):
+        ''' Switch the device back to request/reply mode
+        :return: None
+        '''
+
+        if not self._streaming:
+            return
+        self._stream_wanted = False
+        self._streaming = False
+        transport = self._wait_connected()
+        transport.wait(transport.request(self._make_arg(0, 7), reply=REPLY_ACK, streaming=False),
+                       self.reply_timeout)
+
+    def _idle(self):
+        ''' Called by the transport's reader when no data has arrived for a moment. Re-syncs the device clock
+        every sync_interval seconds while streaming, without blocking the reader.
+        '''
+
+        if not self._streaming or self.clock is None:
+            return
+        if self._sync_request is not None and not self._sync_request.done():
+            return
+        if time.time() - self._last_sync > self.sync_interval:
+            self._last_sync = time.time()
+            self._sync_request = self.transport.request(self._make_arg(0, 8), reply=REPLY_TIME,
+                                                        callback=self._sync_clock)
+
+    def _sync_clock(self, req):
+        self.clock.sync(req.sent, req.result, req.received)
+
+    def _handle_event(self, channel, level, tick):
+        state = self._state.get(channel)
+        if state is None or channel not in self.inputs:
+            return
+        level = (level == 1) != state["invert"]
+        if self.edges.level(channel) == level:
+            return
+        self.edges.push(channel, level, timestamp=self.clock.to_datetime(tick), tick=tick)
 
     def _config_read(self, channel, pullup=False, **kwargs):
         ''' Configure the channel to act as an input
@@ -92,11 +616,6 @@ class ArduinoInterface(base_.BaseInterface):
         '''
 
         logger.debug("Configuring %s, channel %d as input" % (self.device_name, channel))
-        if pullup is False:
-            self.device.write(self._make_arg(channel, 4))
-        else:
-            self.device.write(self._make_arg(channel, 5))
-
         if channel in self.outputs:
             self.outputs.remove(channel)
         if channel not in self.inputs:
@@ -105,6 +624,11 @@ class ArduinoInterface(base_.BaseInterface):
         self._state.setdefault(channel, self._default_state.copy())
         self._state[channel]["invert"] = pullup
 
+        if pullup is False:
+            self._send(channel, 4)
+        else:
+            self._send(channel, 5)
+
     def _config_write(self, channel, **kwargs):
         ''' Configure the channel to act as an output
         :param channel: the channel number to configure
@@ -112,7 +636,7 @@ class ArduinoInterface(base_.BaseInterface):
         '''
 
         logger.debug("Configuring %s, channel %d as output" % (self.device_name, channel))
-        self.device.write(self._make_arg(channel, 3))
+        self._send(channel, 3)
         if channel in self.inputs:
             self.inputs.remove(channel)
         if channel not in self.outputs:
@@ -126,28 +650,22 @@ class ArduinoInterface(base_.BaseInterface):
 
         Raises
         ------
-        ArduinoException
-            Reading from the device failed.
+        InterfaceError
+            The device did not answer within reply_timeout.
         '''
 
         if channel not in self._state:
             raise InterfaceError("Channel %d is not configured on device %s" % (channel, self.device_name))
 
-        if self.device.inWaiting() > 0: # There is currently data in the input buffer
-            self.device.flushInput()
-        self.device.write(self._make_arg(channel, 0))
-        # Also need to make sure self.device.read() returns something that ord can work with. Possibly except TypeError
-        while True:
-            try:
-                v = ord(self.device.read())
-                break
-                # serial.SerialException("Testing")
-            except serial.SerialException:
-            # This is to make it robust in case it accidentally disconnects or you try to access the arduino in
-            # multiple ways
-                pass
-            except TypeError:
-                ArduinoException("Could not read from arduino device")
+        if self._streaming and channel in self.inputs:
+            return self.edges.level(channel)
+
+        if self.snapshot_ttl > 0 and channel in self.inputs:
+            if self._snapshot is None or time.time() - self._snapshot_time > self.snapshot_ttl:
+                self.read_all()
+            return self._snapshot[channel]
+
+        v = self._send(channel, 0, reply=REPLY_BYTE, wait=True)
 
         logger.debug("Read value of %d from channel %d on %s" % (v, channel, self))
         if v in [0, 1]:
@@ -158,6 +676,50 @@ class ArduinoInterface(base_.BaseInterface):
             logger.error("Device %s returned unexpected value of %d on reading channel %d" % (self, v, channel))
             # raise InterfaceError('Could not read from serial device "%s", channel %d' % (self.device, channel))
 
+    def read_all(self):
+        ''' Read every configured input in a single serial exchange, or from the streamed levels in stream mode
+        :return: dict of channel: value for all configured inputs, with pullup inputs already inverted
+
+        Raises
+        ------
+        InterfaceError
+            The device did not reply with a complete bitfield.
+        '''
+
+        if self._streaming:
+            return dict((channel, self.edges.level(channel)) for channel in self.inputs)
+
+        bits = self._send(0, 6, reply=REPLY_BITS, wait=True)
+        n_bytes = len(bits)
+
+        values = dict()
+        for channel in self.inputs:
+            v = channel // 8 < n_bytes and bool(bits[channel // 8] >> (channel % 8) & 1)
+            if self._state[channel]["invert"]:
+                v = not v
+            values[channel] = v
+            # keep the edge buffer current so _wait_any can poll with read_all
+            if self.edges.level(channel) is None:
+                self.edges.set_level(channel, v)
+            elif self.edges.level(channel) != v:
+                self.edges.push(channel, v)
+        self._snapshot = values
+        self._snapshot_time = time.time()
+        logger.debug("Read all inputs on %s: %s" % (self, values))
+        return values
+
+    def _read_bank(self, params_list):
+        ''' Read several inputs with one read_all() exchange
+        :param params_list: list of BooleanInput params dicts
+        :return: list of values in the same order
+        '''
+
+        for params in params_list:
+            if params['channel'] not in self.inputs:
+                raise InterfaceError("Channel %d is not configured as an input on device %s" % (params['channel'], self.device_name))
+        values = self.read_all()
+        return [values[params['channel']] for params in params_list]
+
     def _poll(self, channel, timeout=None, wait=None, suppress_longpress=True, **kwargs):
         """ runs a loop, querying for pecks. returns peck time or None if polling times out
         :param channel: the channel from which to read
@@ -168,6 +730,9 @@ class ArduinoInterface(base_.BaseInterface):
         :return: timestamp of True read
         """
 
+        if self._streaming and channel in self.inputs:
+            return self._poll_stream(channel, timeout=timeout, suppress_longpress=suppress_longpress)
+
         if timeout is not None:
             start = time.time()
 
@@ -197,25 +762,98 @@ class ArduinoInterface(base_.BaseInterface):
         logger.debug("Input detected. Returning")
         return datetime.datetime.now()
 
+    def _poll_stream(self, channel, timeout=None, suppress_longpress=True):
+        ''' _poll served from streamed input changes: returns the device time of the rising edge '''
+
+        since = self.edges.mark()
+        state = self._state[channel]
+        if self.edges.level(channel):
+            if not (state["held"] and suppress_longpress):
+                state["held"] = True
+                return datetime.datetime.now()
+        else:
+            state["held"] = False
+        edge = self.edges.wait({channel: True}, since=since, timeout=timeout)
+        if edge is None:
+            logger.debug("Polling timed out. Returning")
+            return None
+        state["held"] = True
+        return edge.time
+
+    def _wait_any(self, targets, timeout=None, window=0.0, ignore_held=False):
+        ''' Wait until any of several inputs changes to its target level
+        :param targets: list of (params, level) pairs
+        :param timeout: seconds to wait. Defaults to no timeout.
+        :param window: after the first change, also report changes on the other targets within this many seconds of it
+        :param ignore_held: only report new changes, not inputs that are already at their target level
+        :return: list of (index into targets, datetime) pairs, first change first, or an empty list on timeout
+
+        In stream mode this waits on the streamed changes. Otherwise all inputs are read with one read_all() every
+        10 ms while waiting.
+        '''
+
+        channels = dict((params['channel'], level) for params, level in targets)
+        check = None
+        if not self._streaming:
+            check = self.read_all
+            check()
+        since = self.edges.mark()
+        if not ignore_held:
+            now = datetime.datetime.now()
+            held = [(ii, now) for ii, (params, level) in enumerate(targets)
+                    if self.edges.level(params['channel']) == level]
+            if held:
+                return held
+        edges = self.edges.wait_window(channels, since=since, timeout=timeout, window=window,
+                                       check=check, check_interval=0.01)
+        hits = []
+        for edge in edges:
+            for ii, (params, level) in enumerate(targets):
+                if params['channel'] == edge.channel and level == edge.level:
+                    hits.append((ii, edge.time))
+        return hits
+
+    def _last_edge(self, channel, level=True, **kwargs):
+        ''' Time of the most recent change of channel to level, or None '''
+
+        for edge in reversed(self.edges.edges(channel)):
+            if edge.level == level:
+                return edge.time
+        return None
+
     def _write_bool(self, channel, value, **kwargs):
         '''Write a value to the specified channel
         :param channel: the channel to write to
         :param value: the value to write
-        :return: value written if succeeded
+        :return: value written. The write is queued, so a failure to write raises InterfaceError on a later call.
         '''
 
         if channel not in self._state:
             raise InterfaceError("Channel %d is not configured on device %s" % (channel, self))
 
         logger.debug("Writing %s to device %s, channel %d" % (value, self, channel))
-        if value:
-            s = self.device.write(self._make_arg(channel, 1))
-        else:
-            s = self.device.write(self._make_arg(channel, 2))
-        if s:
-            return value
-        else:
-            raise InterfaceError('Could not write to serial device %s, channel %d' % (self.device, channel))
+        self._state[channel]["value"] = value
+        self._send(channel, 1 if value else 2)
+        return value
+
+    def _write_bool_bank(self, params_list, values):
+        '''Write several channels at once, as one request and so one serial write
+        :param params_list: list of params dicts, each with a channel
+        :param values: the value to write to each
+        :return: values written
+        '''
+
+        data = []
+        for params, value in zip(params_list, values):
+            channel = params['channel']
+            if channel not in self._state:
+                raise InterfaceError("Channel %d is not configured on device %s" % (channel, self))
+            data.append(self._make_arg(channel, 1 if value else 2))
+        logger.debug("Writing %s to device %s, channels %s" % (list(values), self, [p['channel'] for p in params_list]))
+        for params, value in zip(params_list, values):
+            self._state[params['channel']]["value"] = value
+        self._send_data(b''.join(data))
+        return values
 
     @staticmethod
     def _make_arg(channel, value):
@@ -223,7 +861,7 @@ class ArduinoInterface(base_.BaseInterface):
         :return: 2-byte hex string for input to arduino
         """
 
-        return "".join([chr(channel), chr(value)])
+        return bytes(bytearray([channel, value]))
 
 
 class ArduinoException(Exception):
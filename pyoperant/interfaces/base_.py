@@ -1,3 +1,9 @@
+import time
+import datetime
+import threading
+import collections
+
+
 class BaseInterface(object):
     """docstring for BaseInterface"""
     def __init__(self, *args, **kwargs):
@@ -13,3 +19,226 @@ class BaseInterface(object):
     def __del__(self):
         self.close()
 
+
+Edge = collections.namedtuple('Edge', ['seq', 'channel', 'level', 'time', 'tick'])
+
+
+class EdgeBuffer(object):
+    """Bounded per-channel ring buffers of timestamped input edges.
+
+    Interfaces that capture input transitions (pigpio callbacks, a serial
+    reader thread, a polling thread) push edges in here from their capture
+    thread, and callers block in wait() until a matching edge arrives. Every
+    edge gets a sequence number, so a caller that takes a mark() before
+    waiting only ever sees edges that arrived after that mark.
+
+    Keyword arguments:
+    maxlen -- number of edges kept per channel (default=64)
+    """
+    def __init__(self, maxlen=64):
+        self.maxlen = maxlen
+        self._buffers = {}
+        self._levels = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def push(self, channel, level, timestamp=None, tick=None):
+        """record an edge on channel and wake any waiters. returns the Edge"""
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        with self._cond:
+            self._seq += 1
+            edge = Edge(self._seq, channel, bool(level), timestamp, tick)
+            if channel not in self._buffers:
+                self._buffers[channel] = collections.deque(maxlen=self.maxlen)
+            self._buffers[channel].append(edge)
+            self._levels[channel] = edge.level
+            self._cond.notify_all()
+        return edge
+
+    def set_level(self, channel, level):
+        """record the current level of channel without creating an edge"""
+        with self._cond:
+            self._levels[channel] = bool(level)
+
+    def level(self, channel):
+        """last known level of channel, or None if it has never been seen"""
+        return self._levels.get(channel)
+
+    def mark(self):
+        """sequence number of the most recent edge"""
+        with self._cond:
+            return self._seq
+
+    def edges(self, channel, since=0):
+        """list of buffered edges on channel newer than the mark since"""
+        with self._cond:
+            return [e for e in self._buffers.get(channel, ()) if e.seq > since]
+
+    def _first_match(self, targets, since):
+        first = None
+        for channel, level in targets.items():
+            for edge in self._buffers.get(channel, ()):
+                if edge.seq > since and edge.level == level:
+                    if first is None or edge.seq < first.seq:
+                        first = edge
+                    break
+        return first
+
+    def matches(self, targets, since):
+        """the earliest edge newer than since on each channel in targets
+        (dict of channel:level), sorted by arrival"""
+        with self._cond:
+            found = [self._first_match({channel: level}, since)
+                     for channel, level in targets.items()]
+        return sorted([e for e in found if e is not None], key=lambda e: e.seq)
+
+    def wait(self, targets, since=None, timeout=None, check=None, check_interval=0.05):
+        """Block until an edge arrives on any channel in targets.
+
+        Keyword arguments:
+        targets -- dict of channel:level pairs to wait for
+        since -- only consider edges newer than this mark (default=now)
+        timeout -- seconds to wait before giving up (default=forever)
+        check -- optional callable run every check_interval seconds while
+            waiting, e.g. to compare the buffered level against a direct read
+            and push any edge the capture thread missed
+
+        Returns the earliest matching Edge, or None if timeout elapsed.
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        next_check = time.time() + check_interval
+        with self._cond:
+            if since is None:
+                since = self._seq
+            while True:
+                edge = self._first_match(targets, since)
+                if edge is not None:
+                    return edge
+                now = time.time()
+                if timeout is not None and now >= deadline:
+                    return None
+                if check is not None and now >= next_check:
+                    self._cond.release()
+                    try:
+                        check()
+                    finally:
+                        self._cond.acquire()
+                    next_check = time.time() + check_interval
+                    continue
+                wait_for = None
+                if check is not None:
+                    wait_for = max(next_check - now, 0.0)
+                if timeout is not None:
+                    remaining = deadline - now
+                    wait_for = remaining if wait_for is None else min(wait_for, remaining)
+                self._cond.wait(wait_for)
+
+    def wait_window(self, targets, since=None, timeout=None, window=0.0, **kwargs):
+        """Like wait(), but once the first edge arrives keep collecting the
+        first matching edge on each other channel in targets that arrives
+        within window seconds of it.
+
+        Returns a list of Edges, first edge first, or an empty list if timeout
+        elapsed. Other keyword arguments are passed to wait().
+        """
+        if since is None:
+            since = self.mark()
+        first = self.wait(targets, since=since, timeout=timeout, **kwargs)
+        if first is None:
+            return []
+        if window:
+            remaining = window - (datetime.datetime.now() - first.time).total_seconds()
+            if remaining > 0:
+                time.sleep(remaining)
+        return [edge for edge in self.matches(targets, since)
+                if (edge.time - first.time).total_seconds() <= window]
+
+
+class TickClock(object):
+    """Maps a free-running, wrapping microsecond counter (pigpio's tick,
+    Arduino micros()) onto a monotonic clock and onto wall-clock time.
+
+    The counter is compared against the host clock at construction and again
+    every `recalibrate` seconds, so drift between the two clocks never grows
+    past what accumulates in one interval. Wraparound is tracked by comparing
+    each counter value against the host time elapsed since the last
+    calibration, so long gaps between edges are handled too.
+
+    Counters that can't be read synchronously (e.g. one only seen in a
+    serial stream) can be calibrated by passing timed samples to sync()
+    instead, with recalibrate set to None.
+
+    Keyword arguments:
+    read_tick -- callable returning the current counter value
+    bits -- width of the counter in bits (default=32)
+    recalibrate -- seconds between calibrations against the host clock, or
+        None to only calibrate when calibrate() or sync() is called
+        (default=60.0)
+    """
+    def __init__(self, read_tick, bits=32, recalibrate=60.0):
+        self.read_tick = read_tick
+        self.recalibrate = recalibrate
+        self._wrap = 1 << bits
+        self._lock = threading.RLock()
+        self._last_tick = None
+        self._last_us = 0
+        self._last_wall = None
+        self._offset = None
+        self.drift = 0.0
+        self.calibrate()
+
+    def _unwrap(self, tick, elapsed=None):
+        if self._last_tick is None:
+            self._last_tick, self._last_us = tick, 0
+            return 0
+        delta = (tick - self._last_tick) % self._wrap
+        if elapsed is not None:
+            # add any whole wraps that passed since the last tick we saw
+            delta += int(round((elapsed * 1e6 - delta) / self._wrap)) * self._wrap
+        elif delta > self._wrap // 2:
+            # slightly older than the last tick we saw (e.g. a queued callback)
+            return self._last_us - ((self._last_tick - tick) % self._wrap)
+        self._last_tick = tick
+        self._last_us += delta
+        return self._last_us
+
+    def calibrate(self):
+        """re-measure the counter against the host clock"""
+        with self._lock:
+            best = None
+            for _ in range(3):
+                t0 = time.time()
+                tick = self.read_tick()
+                t1 = time.time()
+                if best is None or t1 - t0 < best[2] - best[0]:
+                    best = (t0, tick, t1)
+            self.sync(*best)
+
+    def sync(self, t0, tick, t1=None):
+        """calibrate from a counter value read sometime between host times t0
+        and t1 (default=t0)"""
+        if t1 is None:
+            t1 = t0
+        with self._lock:
+            wall = (t0 + t1) / 2.0
+            elapsed = None if self._last_wall is None else wall - self._last_wall
+            us = self._unwrap(tick, elapsed=elapsed)
+            offset = wall - us / 1e6
+            if self._offset is not None:
+                self.drift = offset - self._offset
+            self._offset = offset
+            self._last_wall = wall
+
+    def monotonic(self, tick):
+        """seconds on a monotonic clock that never wraps"""
+        with self._lock:
+            return self._unwrap(tick) / 1e6
+
+    def to_datetime(self, tick):
+        """wall-clock datetime of tick"""
+        with self._lock:
+            if self.recalibrate is not None and time.time() - self._last_wall > self.recalibrate:
+                self.calibrate()
+            return datetime.datetime.fromtimestamp(self._offset + self._unwrap(tick) / 1e6)
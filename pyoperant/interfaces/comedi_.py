@@ -1,14 +1,370 @@
 import comedi
-import subprocess, datetime
+import os, mmap, fcntl, struct, tempfile
+import time, datetime, threading, logging
 from pyoperant.interfaces import base_
 from pyoperant import utils, InterfaceError
 
+logger = logging.getLogger(__name__)
+
+
+class ComediPoller(object):
+    """Reads the watched inputs of one comedi device from a background thread
+    and records their changes as timestamped edges.
+
+    Each tick costs one comedi_dio_bitfield2 call per subdevice and block of
+    32 channels, however many inputs are watched. Edges are keyed by
+    (subdevice, channel) in the `edges` EdgeBuffer, with levels already
+    inverted the way ComediInterface._read_bool reports them. An edge is
+    timestamped when the read that saw it returned, so it is at most one
+    interval late.
+
+    Pollers are shared by every ComediInterface on a device in this process;
+    use get_poller() and release_poller() rather than constructing one.
+
+    Keyword arguments:
+    device_name -- comedi device file, e.g. '/dev/comedi0'
+    interval -- seconds between reads (default=0.001)
+    edge_buffer_len -- number of edges kept per channel (default=64)
+    """
+    def __init__(self,device_name,interval=0.001,edge_buffer_len=64):
+        self.device_name = device_name
+        self.interval = interval
+        self.users = 0
+        self.errors = 0
+        self.edges = base_.EdgeBuffer(maxlen=edge_buffer_len)
+        self._blocks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.device = comedi.comedi_open(device_name)
+        if self.device is None:
+            raise InterfaceError('could not open comedi device %s' % device_name)
+
+    def watch(self,subdevice,channel):
+        """ starts recording edges on channel. returns its edge buffer key """
+        base = channel - channel % 32
+        with self._lock:
+            channels = self._blocks.setdefault((subdevice,base),set())
+            new = channel not in channels
+            channels.add(channel)
+        if new:
+            self._sample({(subdevice,base): set([channel])})
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,name='ComediPoller-%s' % self.device_name)
+            self._thread.daemon = True
+            self._thread.start()
+        return (subdevice,channel)
+
+    def _sample(self,blocks=None):
+        if blocks is None:
+            with self._lock:
+                blocks = dict((block,set(channels)) for block,channels in self._blocks.items())
+        for (subdevice,base),channels in blocks.items():
+            (s,v) = comedi.comedi_dio_bitfield2(self.device,subdevice,0,0,base)
+            if s < 0:
+                raise InterfaceError('could not read from comedi device "%s", subdevice %s, channels %s-%s' % (self.device_name,subdevice,base,base+31))
+            now = datetime.datetime.now()
+            for channel in channels:
+                key = (subdevice,channel)
+                level = not ((v >> (channel - base)) & 1)
+                last = self.edges.level(key)
+                if last is None:
+                    self.edges.set_level(key,level)
+                elif last != level:
+                    self.edges.push(key,level,timestamp=now)
+
+    def _run(self):
+        next_time = time.time()
+        while not self._stop.is_set():
+            try:
+                self._sample()
+            except InterfaceError as err:
+                self.errors += 1
+                logger.error(str(err))
+            next_time += self.interval
+            delay = next_time - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_time = time.time()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        comedi.comedi_close(self.device)
+
+class SharedComediPoller(object):
+    """A ComediPoller shared by every process on the host that uses the
+    device, e.g. the 16 behavior processes of a zog rig.
+
+    One process at a time is the driver. It holds an exclusive flock on
+    <shm_dir>/pyoperant-<device>.lock and, every interval, reads the whole
+    bitfield of each wanted subdevice block with one comedi_dio_bitfield2
+    call. It appends the result as a sample to a ring in
+    <shm_dir>/pyoperant-<device>.shm, which every process maps. The other
+    processes only read new samples from shared memory; they never touch the
+    device. If the driver exits the kernel drops its lock, and the next
+    process to try takes over within about election_interval seconds.
+
+    Writers bump a sequence counter to an odd value while writing a sample
+    and back to even afterwards (a seqlock), so readers retry instead of
+    seeing a half-written sample. A driver that dies mid-sample leaves the
+    counter odd; readers give up after a while, and the next driver evens it
+    out when it takes over. Because the ring keeps the last RING
+    samples, a reader that falls a little behind still sees short pulses.
+
+    Channels are grouped into slots of 32 (subdevice < 8, channel < 128).
+    A process sets a slot's bit in the shared 'wanted' mask when it starts
+    watching a channel in it. Bits are never cleared.
+
+    Keyword arguments:
+    device_name -- comedi device file, e.g. '/dev/comedi0'
+    interval -- seconds between samples (default=0.001)
+    edge_buffer_len -- number of edges kept per channel (default=64)
+    shm_dir -- directory for the shared files (default=/dev/shm)
+    """
+    MAGIC = b'POCD'
+    VERSION = 1
+    SLOTS = 32
+    RING = 256
+    election_interval = 0.5
+    # magic, version, seq, tick, wanted, driver pid, heartbeat, interval
+    _header = struct.Struct('<4sIQQIIdd')
+    # tick, time, valid slots, padding, one bitfield per slot
+    _entry = struct.Struct('<QdII%dI' % SLOTS)
+    _SEQ, _TICK, _WANTED, _PID, _HEARTBEAT = 8, 16, 24, 28, 32
+
+    def __init__(self,device_name,interval=0.001,edge_buffer_len=64,shm_dir=None):
+        self.device_name = device_name
+        self.interval = interval
+        self.users = 0
+        self.errors = 0
+        self.is_driver = False
+        self.device = None
+        self.edges = base_.EdgeBuffer(maxlen=edge_buffer_len)
+        if shm_dir is None:
+            shm_dir = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        base = os.path.join(shm_dir,'pyoperant-%s' % os.path.basename(device_name))
+        self.path = base + '.shm'
+        self._lock_file = open(base + '.lock','a+')
+        self._size = self._header.size + self.RING * self._entry.size
+        self._fd = os.open(self.path,os.O_RDWR | os.O_CREAT,0o666)
+        fcntl.lockf(self._fd,fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size != self._size:
+                os.ftruncate(self._fd,0)
+                os.ftruncate(self._fd,self._size)
+            self._map = mmap.mmap(self._fd,self._size)
+            magic,version = struct.unpack_from('<4sI',self._map,0)
+            if magic != self.MAGIC or version != self.VERSION:
+                self._map[:] = b'\x00' * self._size
+                struct.pack_into('<4sI',self._map,0,self.MAGIC,self.VERSION)
+        finally:
+            fcntl.lockf(self._fd,fcntl.LOCK_UN)
+        self._watched = {}
+        self._last_tick = None
+        self._next_election = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _slot(self,subdevice,channel):
+        if subdevice >= 8 or channel >= 128:
+            raise InterfaceError('comedi subdevice %s, channel %s can not be shared' % (subdevice,channel))
+        return subdevice * 4 + channel // 32
+
+    def watch(self,subdevice,channel):
+        """ starts recording edges on channel. returns its edge buffer key """
+        slot = self._slot(subdevice,channel)
+        key = (subdevice,channel)
+        with self._lock:
+            channels = self._watched.setdefault(slot,set())
+            new = channel not in channels
+            channels.add(channel)
+        if new:
+            fcntl.lockf(self._fd,fcntl.LOCK_EX)
+            try:
+                wanted = struct.unpack_from('<I',self._map,self._WANTED)[0]
+                struct.pack_into('<I',self._map,self._WANTED,wanted | (1 << slot))
+            finally:
+                fcntl.lockf(self._fd,fcntl.LOCK_UN)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,name='SharedComediPoller-%s' % self.device_name)
+            self._thread.daemon = True
+            self._thread.start()
+        # the first sample that includes the slot gives the starting level
+        deadline = time.time() + max(2 * self.election_interval,0.1)
+        while self.edges.level(key) is None:
+            if time.time() > deadline:
+                raise InterfaceError('no process is reading comedi device %s' % self.device_name)
+            time.sleep(self.interval)
+        return key
+
+    def _elect(self):
+        try:
+            fcntl.flock(self._lock_file,fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError,OSError):
+            return False
+        self.device = comedi.comedi_open(self.device_name)
+        if self.device is None:
+            fcntl.flock(self._lock_file,fcntl.LOCK_UN)
+            raise InterfaceError('could not open comedi device %s' % self.device_name)
+        seq = struct.unpack_from('<Q',self._map,self._SEQ)[0]
+        if seq & 1:
+            # the last driver died writing a sample
+            struct.pack_into('<Q',self._map,self._SEQ,seq + 1)
+        self.is_driver = True
+        logger.info('process %d is now reading comedi device %s for all boxes' % (os.getpid(),self.device_name))
+        return True
+
+    def _drive(self):
+        """ reads every wanted slot and appends a sample to the ring """
+        wanted = struct.unpack_from('<I',self._map,self._WANTED)[0]
+        words = [0] * self.SLOTS
+        valid = 0
+        for slot in range(self.SLOTS):
+            if wanted & (1 << slot):
+                (s,v) = comedi.comedi_dio_bitfield2(self.device,slot // 4,0,0,(slot % 4) * 32)
+                if s < 0:
+                    self.errors += 1
+                    continue
+                words[slot] = v
+                valid |= 1 << slot
+        now = time.time()
+        seq,tick = struct.unpack_from('<QQ',self._map,self._SEQ)
+        tick += 1
+        struct.pack_into('<Q',self._map,self._SEQ,seq + 1)
+        self._entry.pack_into(self._map,self._header.size + (tick % self.RING) * self._entry.size,
+                              tick,now,valid,0,*words)
+        struct.pack_into('<Q',self._map,self._TICK,tick)
+        struct.pack_into('<Id',self._map,self._PID,os.getpid(),now)
+        struct.pack_into('<Q',self._map,self._SEQ,seq + 2)
+
+    def _read_ring(self,since):
+        """ samples newer than tick since (only the newest if since is None),
+        read consistently under the seqlock """
+        deadline = time.time() + max(10 * self.interval,0.05)
+        while True:
+            if time.time() > deadline:
+                raise InterfaceError('shared ring of comedi device %s is stuck mid-write' % self.device_name)
+            seq = struct.unpack_from('<Q',self._map,self._SEQ)[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            tick = struct.unpack_from('<Q',self._map,self._TICK)[0]
+            first = tick if since is None else max(since + 1,tick - self.RING + 1,1)
+            entries = [self._entry.unpack_from(self._map,self._header.size + (t % self.RING) * self._entry.size)
+                       for t in range(first,tick + 1)]
+            if struct.unpack_from('<Q',self._map,self._SEQ)[0] == seq:
+                return tick,entries
+
+    def _consume(self):
+        with self._lock:
+            tick,entries = self._read_ring(self._last_tick)
+            watched = dict((slot,set(channels)) for slot,channels in self._watched.items())
+            for entry in entries:
+                sample_time,valid,words = entry[1],entry[2],entry[4:]
+                timestamp = None
+                for slot,channels in watched.items():
+                    if not valid & (1 << slot):
+                        continue
+                    subdevice,base = slot // 4,(slot % 4) * 32
+                    for channel in channels:
+                        key = (subdevice,channel)
+                        level = not ((words[slot] >> (channel - base)) & 1)
+                        last = self.edges.level(key)
+                        if last is None:
+                            self.edges.set_level(key,level)
+                        elif last != level:
+                            if timestamp is None:
+                                timestamp = datetime.datetime.fromtimestamp(sample_time)
+                            self.edges.push(key,level,timestamp=timestamp)
+            self._last_tick = tick
+
+    def _run(self):
+        next_time = time.time()
+        while not self._stop.is_set():
+            try:
+                if not self.is_driver and time.time() >= self._next_election:
+                    self._next_election = time.time() + self.election_interval
+                    self._elect()
+                if self.is_driver:
+                    self._drive()
+                self._consume()
+            except InterfaceError as err:
+                self.errors += 1
+                logger.error(str(err))
+            next_time += self.interval
+            delay = next_time - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_time = time.time()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.is_driver:
+            comedi.comedi_close(self.device)
+            fcntl.flock(self._lock_file,fcntl.LOCK_UN)
+            self.is_driver = False
+        self._map.close()
+        os.close(self._fd)
+        self._lock_file.close()
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+def get_poller(device_name,interval=0.001,shared=False,shm_dir=None):
+    """ the ComediPoller for device_name, started if needed. with shared, a
+    SharedComediPoller that serves every process on the host. it reads at the
+    shortest interval any of its users asked for """
+    with _pollers_lock:
+        poller = _pollers.get((device_name,shared))
+        if poller is None:
+            if shared:
+                poller = SharedComediPoller(device_name,interval=interval,shm_dir=shm_dir)
+            else:
+                poller = ComediPoller(device_name,interval=interval)
+            _pollers[(device_name,shared)] = poller
+        poller.interval = min(poller.interval,interval)
+        poller.users += 1
+        return poller
+
+def release_poller(poller):
+    """ stops the poller once its last user has released it """
+    with _pollers_lock:
+        poller.users -= 1
+        if poller.users <= 0:
+            for key,value in list(_pollers.items()):
+                if value is poller:
+                    del _pollers[key]
+            poller.close()
+
 
 class ComediInterface(base_.BaseInterface):
-    """docstring for ComediInterface"""
-    def __init__(self,device_name,*args,**kwargs):
+    """Interface to a comedi digital I/O device.
+
+    Waiting for inputs (_poll, _wait_any) is served by the device's shared
+    ComediPoller, which reads every watched input at poll_interval.
+
+    Keyword arguments:
+    device_name -- comedi device file, e.g. '/dev/comedi0'
+    poll_interval -- seconds between reads of the watched inputs
+        (default=0.001)
+    shared -- share one polling loop per device among all processes on the
+        host (SharedComediPoller) instead of one per process (default=False)
+    shm_dir -- directory for the shared poller's files (default=/dev/shm)
+    """
+    def __init__(self,device_name,poll_interval=0.001,shared=False,shm_dir=None,*args,**kwargs):
         super(ComediInterface, self).__init__(*args,**kwargs)
         self.device_name = device_name
+        self.poll_interval = poll_interval
+        self.shared = shared
+        self.shm_dir = shm_dir
+        self.poller = None
         self.read_params = ('subdevice',
                             'channel',
                             )
@@ -20,6 +376,9 @@ class ComediInterface(base_.BaseInterface):
             raise InterfaceError('could not open comedi device %s' % self.device_name)
 
     def close(self):
+        if self.poller is not None:
+            release_poller(self.poller)
+            self.poller = None
         s = comedi.comedi_close(self.device)
         if s < 0:
             raise InterfaceError('could not close comedi device %s(%s)' % (self.device_name, self.device))
@@ -47,17 +406,98 @@ class ComediInterface(base_.BaseInterface):
         else:
             raise InterfaceError('could not read from comedi device "%s", subdevice %s, channel %s' % (self.device,subdevice,channel))
 
+    def _read_bank(self,params_list):
+        """ read many channels at once, with one comedi_dio_bitfield2 call per
+        subdevice and block of 32 channels
+        """
+        bits = {}
+        values = []
+        for params in params_list:
+            subdevice, channel = params['subdevice'], params['channel']
+            base = channel - channel % 32
+            if (subdevice,base) not in bits:
+                (s,v) = comedi.comedi_dio_bitfield2(self.device,subdevice,0,0,base)
+                if s < 0:
+                    raise InterfaceError('could not read from comedi device "%s", subdevice %s, channels %s-%s' % (self.device,subdevice,base,base+31))
+                bits[(subdevice,base)] = v
+            v = (bits[(subdevice,base)] >> (channel - base)) & 1
+            values.append(not v)
+        return values
+
+    def _watch(self,subdevice,channel):
+        if self.poller is None:
+            self.poller = get_poller(self.device_name,interval=self.poll_interval,
+                                     shared=self.shared,shm_dir=self.shm_dir)
+        return self.poller.watch(subdevice,channel)
+
     def _poll(self,subdevice,channel,timeout=None):
-        """ runs a loop, querying for pecks. returns peck time or "GoodNite" exception """
-        date_fmt = '%Y-%m-%d %H:%M:%S.%f'
-        cmd = ['comedi_poll', self.device_name, '-s', str(subdevice), '-c', str(channel)]
-        poll_command = utils.Command(cmd)
-        status, output, error = poll_command.run(timeout=timeout)
-        if status < 0:
+        """ waits until the input reads True. returns the time of the change,
+        or None if timeout elapses first """
+        key = self._watch(subdevice,channel)
+        since = self.poller.edges.mark()
+        if self.poller.edges.level(key):
+            return datetime.datetime.now()
+        edge = self.poller.edges.wait({key: True},since=since,timeout=timeout)
+        if edge is None:
             return None
-        else:
-            timestamp = output
-            return datetime.datetime.strptime(timestamp.strip(),date_fmt)
+        return edge.time
+
+    def _wait_any(self,targets,timeout=None,window=0.0,ignore_held=False):
+        """ waits until any of several inputs changes to its target level.
+
+        targets -- list of (params, level) pairs
+        timeout -- seconds to wait (default=forever)
+        window -- after the first edge, also report edges on the other
+            targets that arrive within this many seconds of it
+        ignore_held -- only report new edges, not inputs that are already at
+            their target level
+
+        returns a list of (index into targets, datetime) pairs, first edge
+        first, or an empty list on timeout. """
+        keys = [self._watch(params['subdevice'],params['channel']) for params,level in targets]
+        edges = self.poller.edges
+        since = edges.mark()
+        if not ignore_held:
+            now = datetime.datetime.now()
+            held = [(ii,now) for ii,(key,(params,level)) in enumerate(zip(keys,targets))
+                    if edges.level(key) == level]
+            if held:
+                return held
+        channels = dict((key,level) for key,(params,level) in zip(keys,targets))
+        hits = []
+        for edge in edges.wait_window(channels,since=since,timeout=timeout,window=window):
+            for ii,(key,(params,level)) in enumerate(zip(keys,targets)):
+                if key == edge.channel and level == edge.level:
+                    hits.append((ii,edge.time))
+        return hits
+
+    def _last_edge(self,subdevice,channel,level=True):
+        """ time of the most recent change of the input to level, or None """
+        if self.poller is None:
+            return None
+        for edge in reversed(self.poller.edges.edges((subdevice,channel))):
+            if edge.level == level:
+                return edge.time
+        return None
+
+    def _write_bool_bank(self,params_list,values):
+        """ write many channels at once, with one comedi_dio_bitfield2 call
+        per subdevice and block of 32 channels
+        """
+        blocks = {}
+        for params, value in zip(params_list,values):
+            subdevice, channel = params['subdevice'], params['channel']
+            base = channel - channel % 32
+            mask, bits = blocks.get((subdevice,base),(0,0))
+            mask |= 1 << (channel - base)
+            if not value: #invert the value for comedi
+                bits |= 1 << (channel - base)
+            blocks[(subdevice,base)] = (mask,bits)
+        for (subdevice,base),(mask,bits) in blocks.items():
+            (s,v) = comedi.comedi_dio_bitfield2(self.device,subdevice,mask,bits,base)
+            if s < 0:
+                raise InterfaceError('could not write to comedi device "%s", subdevice %s, channels %s-%s' % (self.device,subdevice,base,base+31))
+        return values
 
     def _write_bool(self,subdevice,channel,value):
         """Write to comedi port
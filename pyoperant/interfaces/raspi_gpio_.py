@@ -2,6 +2,8 @@
 import time
 import datetime
 import logging
+import threading
+import heapq
 #import RPi.GPIO as GPIO
 
 from pyoperant.interfaces import base_
@@ -35,6 +37,14 @@ class PWM:
    convenient when the chip is used to drive servos.
    The chip has 12 bit resolution, i.e. there are 4096 steps
    between off and full on.
+   A shadow copy of the MODE, PRESCALE and channel registers is
+   kept, and writes that wouldn't change the chip are dropped.
+   dump() returns the cached state and sync() re-reads it from the
+   chip, e.g. if something else may have written to it.  The cache
+   is guarded by a lock, so one PWM can be shared by the behavior,
+   fader and blink threads.  Channel writes are checked against the
+   cache and queued under the lock, but waited for without it, so
+   through an I2CScheduler they can still pile up and coalesce.
    """
 
    _MODE1         = 0x00
@@ -67,6 +77,13 @@ class PWM:
       self.pi = pi
       self.bus = bus
       self.address = address
+      self.skipped_writes = 0
+
+      # register:byte as last written to (or read from) the chip
+      self._shadow = {}
+      # register:token of the last write queued to it, still in flight
+      self._writing = {}
+      self._lock = threading.RLock()
 
       self.h = pi.i2c_open(bus, address)
 
@@ -100,41 +117,89 @@ class PWM:
       elif prescale > 255:
          prescale = 255
 
-      mode = self._read_reg(self._MODE1);
-      self._write_reg(self._MODE1, (mode & ~self._SLEEP) | self._SLEEP)
-      self._write_reg(self._PRESCALE, prescale)
-      self._write_reg(self._MODE1, mode)
+      with self._lock:
+         if self._shadow.get(self._PRESCALE) == prescale:
+            # changing the prescaler means sleeping and restarting the
+            # oscillator, so only do it if the frequency really changes
+            self.skipped_writes += 1
+            return
 
-      time.sleep(0.0005)
+         mode = self._read_reg(self._MODE1);
+         self._write_reg(self._MODE1, (mode & ~self._SLEEP) | self._SLEEP)
+         self._write_reg(self._PRESCALE, prescale)
+         self._write_reg(self._MODE1, mode)
 
-      self._write_reg(self._MODE1, mode | self._RESTART)
+         time.sleep(0.0005)
 
-      self._frequency = (25000000.0 / 4096.0) / (prescale + 1)
-      self._pulse_width = (1000000.0 / self._frequency)
+         self._write_reg(self._MODE1, mode | self._RESTART)
+
+         self._frequency = (25000000.0 / 4096.0) / (prescale + 1)
+         self._pulse_width = (1000000.0 / self._frequency)
 
    def set_duty_cycle(self, channel, percent):
 
       "Sets the duty cycle for a channel.  Use -1 for all channels."
 
-      steps = int(round(percent * (4096.0 / 100.0)))
-
-      if steps < 0:
-         on = 0
-         off = 4096
-      elif steps > 4095:
-         on = 4096
-         off = 0
-      else:
-         on = 0
-         off = steps
+      data = self._steps(percent)
 
       if (channel >= 0) and (channel <= 15):
-         self.pi.i2c_write_i2c_block_data(self.h, self._LED0_ON_L+4*channel,
-            [on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+         self._write_block(self._LED0_ON_L+4*channel, data)
 
       else:
-         self.pi.i2c_write_i2c_block_data(self.h, self._ALL_LED_ON_L,
-            [on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+         channels = [self._LED0_ON_L+4*c for c in range(16)]
+         with self._lock:
+            if all(self._cached(reg, data) for reg in channels):
+               self.skipped_writes += 1
+               return
+            finish = self._write(self._ALL_LED_ON_L, data,
+                                 cache=[(reg, data) for reg in channels])
+         finish()
+
+   def set_duty_cycles(self, percents):
+
+      """
+      Sets the duty cycle of several channels at once.  percents is a
+      dict of channel:percent, or a list of percents for channels 0,
+      1, 2...  Channels that change are written in runs of consecutive
+      channels, one auto-increment block write (at most 8 channels, the
+      32 byte SMBus limit) per run, so e.g. a colour change on an RGB
+      light is a single I2C transaction.  If all 16 channels get the
+      same value it's written once to the ALL_LED registers.
+      """
+
+      if not isinstance(percents, dict):
+         percents = dict(enumerate(percents))
+
+      data = dict((channel, self._steps(percent))
+                  for channel, percent in percents.items())
+
+      values = list(data.values())
+      if len(data) == 16 and all(d == values[0] for d in values):
+         self.set_duty_cycle(-1, percents[0])
+         return
+
+      writes = []
+      with self._lock:
+         changed = sorted(c for c in data
+                          if not self._cached(self._LED0_ON_L+4*c, data[c]))
+         self.skipped_writes += len(data) - len(changed)
+
+         run = []
+         for channel in changed:
+            # a gap of unchanged channels whose registers are cached can be
+            # rewritten as part of the run, to save a transaction
+            gap = range(run[-1]+1, channel) if run else []
+            if run and len(run) + len(gap) < 8 and all(
+                  c in data or self._known(c) for c in gap):
+               run.extend(gap)
+               run.append(channel)
+            else:
+               writes.append(self._write_run(run, data))
+               run = [channel]
+         writes.append(self._write_run(run, data))
+      for finish in writes:
+         if finish is not None:
+            finish()
 
    def set_pulse_width(self, channel, width):
 
@@ -149,11 +214,378 @@ class PWM:
       self.set_duty_cycle(-1, 0)
       self.pi.i2c_close(self.h)
 
+   def dump(self):
+
+      """
+      Returns the cached register state: MODE1, MODE2, PRESCALE, the
+      frequency and each channel's on/off steps (None if unknown).
+      """
+
+      with self._lock:
+         shadow = dict(self._shadow)
+      channels = {}
+      for channel in range(16):
+         reg = self._LED0_ON_L+4*channel
+         data = [shadow.get(reg+i) for i in range(4)]
+         if None in data:
+            channels[channel] = None
+         else:
+            channels[channel] = {'on': data[0] | (data[1] << 8),
+                                 'off': data[2] | (data[3] << 8)}
+      return {'mode1': shadow.get(self._MODE1),
+              'mode2': shadow.get(self._MODE2),
+              'prescale': shadow.get(self._PRESCALE),
+              'frequency': getattr(self, '_frequency', None),
+              'channels': channels,
+              'skipped_writes': self.skipped_writes}
+
+   def sync(self):
+
+      """
+      Re-reads MODE1, MODE2, PRESCALE and every channel register from
+      the chip into the cache and returns dump().
+      """
+
+      with self._lock:
+         self._shadow = {}
+         for reg in (self._MODE1, self._MODE2, self._PRESCALE):
+            self._shadow[reg] = self.pi.i2c_read_byte_data(self.h, reg)
+         self._shadow[self._MODE1] &= ~self._RESTART
+         # 64 channel registers, in SMBus sized (32 byte) blocks
+         for start in (self._LED0_ON_L, self._LED0_ON_L+32):
+            count, data = self.pi.i2c_read_i2c_block_data(self.h, start, 32)
+            if count < 0:
+               raise InterfaceError("Could not read PWM registers at 0x%02x" % start)
+            self._remember(start, list(data))
+         self._frequency = (25000000.0 / 4096.0) / (self._shadow[self._PRESCALE] + 1)
+         self._pulse_width = (1000000.0 / self._frequency)
+         return self.dump()
+
+   def _steps(self, percent):
+      steps = int(round(percent * (4096.0 / 100.0)))
+
+      if steps < 0:
+         on = 0
+         off = 4096
+      elif steps > 4095:
+         on = 4096
+         off = 0
+      else:
+         on = 0
+         off = steps
+
+      return [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+
+   def _known(self, channel):
+      reg = self._LED0_ON_L+4*channel
+      return all(reg+i in self._shadow for i in range(4))
+
+   def _write(self, reg, data, cache=None):
+      # Queues a block write.  Called with the lock held, so writes are
+      # queued in the order the cache sees them.  Returns a function to
+      # call without the lock, which waits for the write and then caches
+      # cache (default data at reg), unless a newer write to a register
+      # was queued meanwhile or the I2C scheduler dropped this one for a
+      # newer one to the same registers.
+      if cache is None:
+         cache = [(reg, data)]
+      claims = []
+      for start, values in cache:
+         # until the write is done the chip state is unknown
+         self._forget(start, len(values))
+         for i, byte in enumerate(values):
+            token = object()
+            self._writing[start+i] = token
+            claims.append((start+i, byte, token))
+
+      def settle(written):
+         with self._lock:
+            for r, byte, token in claims:
+               if self._writing.get(r) is token:
+                  del self._writing[r]
+                  if written:
+                     self._shadow[r] = byte
+
+      try:
+         if isinstance(self.pi, _I2CClient):
+            request = self.pi.submit('i2c_write_i2c_block_data', self.h, reg, data)
+         else:
+            self.pi.i2c_write_i2c_block_data(self.h, reg, data)
+            request = None
+      except Exception:
+         settle(False)
+         raise
+
+      def finish():
+         written = False
+         try:
+            if request is not None:
+               written = self.pi.wait(request) is not SUPERSEDED
+            else:
+               written = True
+         finally:
+            settle(written)
+
+      return finish
+
+   def _write_run(self, channels, data):
+      # called with the lock held, returns _write's finish function
+      if not channels:
+         return None
+      block = []
+      for channel in channels:
+         if channel in data:
+            block.extend(data[channel])
+         else:
+            reg = self._LED0_ON_L+4*channel
+            block.extend(self._shadow[reg+i] for i in range(4))
+      return self._write(self._LED0_ON_L+4*channels[0], block)
+
+   def _cached(self, reg, data):
+      return all(self._shadow.get(reg+i) == byte for i, byte in enumerate(data))
+
+   def _remember(self, reg, data):
+      for i, byte in enumerate(data):
+         self._shadow[reg+i] = byte
+
+   def _forget(self, reg, count=1):
+      for i in range(count):
+         self._shadow.pop(reg+i, None)
+
+   def _write_block(self, reg, data):
+      with self._lock:
+         if self._cached(reg, data):
+            self.skipped_writes += 1
+            return
+         finish = self._write(reg, data)
+      finish()
+
    def _write_reg(self, reg, byte):
-      self.pi.i2c_write_byte_data(self.h, reg, byte)
+      with self._lock:
+         # MODE1 writes sequence sleep/restart, so they always go out
+         if reg != self._MODE1 and self._shadow.get(reg) == byte:
+            self.skipped_writes += 1
+            return
+         self._forget(reg)
+         self.pi.i2c_write_byte_data(self.h, reg, byte)
+         # RESTART is cleared by the chip once the restart is done
+         self._shadow[reg] = byte & ~self._RESTART if reg == self._MODE1 else byte
 
    def _read_reg(self, reg):
-      return self.pi.i2c_read_byte_data(self.h, reg)
+      with self._lock:
+         if reg not in self._shadow:
+            self._shadow[reg] = self.pi.i2c_read_byte_data(self.h, reg)
+         return self._shadow[reg]
+
+
+# I2C bus scheduling
+
+# lower runs first
+PRIORITY_SERVO = 0
+PRIORITY_LIGHTS = 10
+
+# returned by I2CScheduler.call for a write that was replaced by a newer
+# one before it reached the bus
+SUPERSEDED = object()
+
+
+class _I2CRequest(object):
+    def __init__(self, priority, seq, method, args, key=None):
+        self.priority = priority
+        self.seq = seq
+        self.method = method
+        self.args = args
+        self.key = key
+        self.queued = time.time()
+        self.result = None
+        self.error = None
+        self.superseded = False
+        self.done = threading.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class I2CScheduler(object):
+    """ Serializes every I2C transaction on a pigpiod connection through one
+    thread, so PCA9685 traffic from the behavior thread, the fader and the
+    blink scheduler never interleaves on the bus.
+
+    Queued transactions run in priority order (lower first, e.g. servo moves
+    for the hopper ahead of LED updates), then in the order they were
+    queued. A low priority block write to the same registers as one still in
+    the queue replaces it, since only the last value would stick, and all
+    low priority transactions queued at once are run back to back.
+
+    Callers block until their own transaction has run and get its result
+    (or its exception), so code written against pigpio's i2c_* calls works
+    unchanged through client(). The caller of a write that was replaced gets
+    SUPERSEDED instead: nothing it sent reached the chip. submit() and wait()
+    split a call in two, for callers that must queue under a lock of their
+    own but not wait under it.
+
+    Keyword arguments:
+    pi -- pigpio.pi() instance
+    coalesce_priority -- block writes at or above this priority may be
+        replaced by later writes to the same registers (default=PRIORITY_LIGHTS)
+
+    Methods:
+    client(priority) -- an object with pigpio's i2c_* methods that queues
+        each call at priority
+    call(priority, method, *args) -- queues pi.<method>(*args) and waits
+    submit(priority, method, *args) -- queues pi.<method>(*args) and
+        returns the request without waiting
+    wait(request) -- waits for a submitted request, as call() does
+    stats() -- queue depth, latency and coalescing counters
+    close() -- stops the thread
+    """
+    def __init__(self, pi, coalesce_priority=PRIORITY_LIGHTS):
+        self.pi = pi
+        self.coalesce_priority = coalesce_priority
+        self._queue = []
+        self._pending = {}    # coalescing key: queued request
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._counts = {}
+        self._latency = {}    # priority: [total, max] seconds queued
+        self._max_depth = 0
+        self._coalesced = 0
+        self._batches = 0
+        self._thread = threading.Thread(target=self._run, name='I2CScheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def client(self, priority):
+        return _I2CClient(self, priority)
+
+    def call(self, priority, method, *args):
+        return self.wait(self.submit(priority, method, *args))
+
+    def submit(self, priority, method, *args):
+        key = None
+        if method == 'i2c_write_i2c_block_data' and priority >= self.coalesce_priority:
+            key = (args[0], args[1], len(args[2]))
+        with self._cond:
+            if self._stopped:
+                raise InterfaceError("I2C scheduler is closed")
+            self._seq += 1
+            request = _I2CRequest(priority, self._seq, method, args, key=key)
+            if key is not None:
+                old = self._pending.get(key)
+                if old is not None:
+                    # its caller can go on: the newer write lands instead
+                    old.superseded = True
+                    old.done.set()
+                    self._coalesced += 1
+                self._pending[key] = request
+            heapq.heappush(self._queue, request)
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._cond.notify()
+        return request
+
+    def wait(self, request):
+        request.done.wait()
+        if request.superseded:
+            return SUPERSEDED
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _next(self):
+        while self._queue:
+            request = heapq.heappop(self._queue)
+            if request.key is not None and self._pending.get(request.key) is request:
+                del self._pending[request.key]
+            if request.superseded:
+                continue
+            return request
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._queue:
+                    return
+                batch = []
+                request = self._next()
+                # run everything already queued at this priority back to back
+                while request is not None:
+                    batch.append(request)
+                    if self._queue and self._queue[0].priority == request.priority:
+                        request = self._next()
+                    else:
+                        request = None
+                self._batches += 1
+            for request in batch:
+                started = time.time()
+                try:
+                    request.result = getattr(self.pi, request.method)(*request.args)
+                except Exception as e:
+                    request.error = e
+                with self._cond:
+                    waited = started - request.queued
+                    self._counts[request.priority] = self._counts.get(request.priority, 0) + 1
+                    total, worst = self._latency.get(request.priority, (0.0, 0.0))
+                    self._latency[request.priority] = (total + waited, max(worst, waited))
+                request.done.set()
+                # let a servo move that arrived meanwhile cut in
+                with self._cond:
+                    if self._queue and self._queue[0].priority < request.priority:
+                        for rest in batch[batch.index(request)+1:]:
+                            if rest.key is not None:
+                                if rest.key in self._pending:
+                                    # a newer write to the same registers
+                                    rest.superseded = True
+                                    self._coalesced += 1
+                                    rest.done.set()
+                                    continue
+                                self._pending[rest.key] = rest
+                            heapq.heappush(self._queue, rest)
+                        break
+
+    def stats(self):
+        """ dict of queue depth, transactions run and mean/max time queued
+        (seconds) per priority, and coalesced writes """
+        with self._cond:
+            latency = dict((priority, {'mean': total / self._counts[priority],
+                                       'max': worst})
+                           for priority, (total, worst) in self._latency.items())
+            return {'depth': len(self._queue),
+                    'max_depth': self._max_depth,
+                    'transactions': dict(self._counts),
+                    'latency': latency,
+                    'coalesced': self._coalesced,
+                    'batches': self._batches}
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+class _I2CClient(object):
+    """ the i2c_* methods of pigpio.pi, queued on an I2CScheduler """
+    def __init__(self, scheduler, priority):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def submit(self, name, *args):
+        return self.scheduler.submit(self.priority, name, *args)
+
+    def wait(self, request):
+        return self.scheduler.wait(request)
+
+    def __getattr__(self, name):
+        if not name.startswith('i2c_'):
+            raise AttributeError(name)
+        def call(*args):
+            return self.scheduler.call(self.priority, name, *args)
+        return call
 
 
 # Raspberry Pi GPIO Interface for Pyoperant
@@ -164,10 +596,16 @@ class RaspberryPiInterface(base_.BaseInterface):
     def __init__(self, device_name, inputs=None, outputs=None,
                  lights_address=None,
                  servo_address=None,
+                 edge_buffer_len=64,
                  *args, **kwargs):
         super(RaspberryPiInterface, self).__init__(*args, **kwargs)
 
         self.device_name = device_name
+        # edges from pigpio callbacks on every configured input
+        self.edges = base_.EdgeBuffer(maxlen=edge_buffer_len)
+        self._edge_callbacks = {}
+        self._steady = {}     # glitch filter steady time per channel
+        self._disagree = {}   # level read disagreeing with callbacks, and since when
 
         if lights_address is None:
             raise InterfaceError("lights_address must be specified explicitly (e.g. LIGHTS_PCA9685_ADDRESS in local_pi_revd.py)")
@@ -179,6 +617,9 @@ class RaspberryPiInterface(base_.BaseInterface):
         if not self.pi.connected:
             logger.debug("PIGPIO Not Connected...")
 
+        # maps pigpio's 32-bit microsecond tick onto wall-clock time
+        self.clock = base_.TickClock(read_tick=self.pi.get_current_tick)
+
         self.open()
         self.inputs = []
         self.outputs = []
@@ -195,12 +636,14 @@ class RaspberryPiInterface(base_.BaseInterface):
 
     def open(self):
         logger.debug("Opening device %s")
+        # both PCA9685s share one bus: servo moves go ahead of LED updates
+        self.i2c = I2CScheduler(self.pi)
         # Setup lights PWM chip (PCB schematic U1) at 1000 Hz
-        self.pwm = PWM(self.pi, address=self.lights_address)
+        self.pwm = PWM(self.i2c.client(PRIORITY_LIGHTS), address=self.lights_address)
         self.pwm.set_frequency(1000)
         # Setup servo PWM chip (PCB schematic U7) at 50 Hz — Rev D only
         if self.servo_address is not None:
-            self.pwm_servo = PWM(self.pi, address=self.servo_address)
+            self.pwm_servo = PWM(self.i2c.client(PRIORITY_SERVO), address=self.servo_address)
             self.pwm_servo.set_frequency(50)
         else:
             self.pwm_servo = None
@@ -208,73 +651,230 @@ class RaspberryPiInterface(base_.BaseInterface):
 
     def close(self):
         logger.debug("Closing %s")
+        for cb in self._edge_callbacks.values():
+            cb.cancel()
+        self._edge_callbacks = {}
+        if getattr(self, 'i2c', None) is not None:
+            self.i2c.close()
         self.pi.stop()
 
     def _config_read(self, channel, **kwargs):
         self.pi.set_mode(channel, pigpio.INPUT)
-        
+        if channel not in self.inputs:
+            self.inputs.append(channel)
+        self._capture(channel)
+
+    def _capture(self, channel):
+        """ registers a pigpio callback on both edges of channel that feeds
+        self.edges. safe to call more than once per channel. """
+        if channel in self._edge_callbacks:
+            return
+        self.edges.set_level(channel, self.pi.read(channel) == 1)
+        self._edge_callbacks[channel] = self.pi.callback(channel, pigpio.EITHER_EDGE,
+                                                         self._edge_clbk)
+
+    def _edge_clbk(self, gpio, level, tick):
+        # level 2 is a pigpio watchdog timeout, not an edge
+        if level in (0, 1):
+            self.edges.push(gpio, level == 1,
+                            timestamp=self.clock.to_datetime(tick),
+                            tick=tick)
+
+    def _reconcile(self, channel):
+        """ compares the level captured from callbacks against a direct
+        read, and pushes an edge if the callback thread missed one. on a
+        glitch-filtered channel the disagreement has to outlast the filter
+        before it counts, since pigpio only filters callbacks, not reads. """
+        level = self._read_raw(channel)
+        if level == self.edges.level(channel):
+            self._disagree.pop(channel, None)
+            return
+        steady = self._steady.get(channel, 0.0)
+        if steady:
+            since = self._disagree.get(channel)
+            if since is None or since[0] != level:
+                self._disagree[channel] = (level, time.time())
+                return
+            if time.time() - since[1] < steady:
+                return
+        self._disagree.pop(channel, None)
+        logger.debug("missed edge on GPIO %s, correcting from level read" % channel)
+        tick = self.pi.get_current_tick()
+        self.edges.push(channel, level,
+                        timestamp=self.clock.to_datetime(tick),
+                        tick=tick)
+
+    def _last_edge(self, channel, level=True, **kwargs):
+        """ time of the most recent captured edge on channel to level, or
+        None if there is none in the buffer """
+        for edge in reversed(self.edges.edges(channel)):
+            if edge.level == level:
+                return edge.time
+        return None
+
     def _config_write(self, channel, **kwargs):
         self.pi.set_mode(channel, pigpio.OUTPUT)
 
-    def _read_bool(self, channel, **kwargs):
-        while True:
-            try: 
-                v = self.pi.read(channel)
-                break
-            except:
-                raise InterfaceError("Could not read GPIO channel %s" % channel)
-
+    def _config_debounce(self, channel, min_high=0.0, min_low=0.0, **kwargs):
+        """ sets pigpio's glitch filter on channel. the glitch filter uses one
+        steady time for both levels (at most 300 ms), so it gets the shorter
+        of min_high and min_low and BooleanInput filters the rest in
+        software. returns the (high, low) seconds filtered here. """
+        steady = min(min_high, min_low, 0.3)
+        self.pi.set_glitch_filter(channel, int(round(steady * 1e6)))
+        self._steady[channel] = steady
+        # the captured level is filtered from here on; start it from a read
+        self.edges.set_level(channel, self._read_raw(channel))
+        return (steady, steady)
+
+    def _read_raw(self, channel):
+        try:
+            v = self.pi.read(channel)
+        except:
+            raise InterfaceError("Could not read GPIO channel %s" % channel)
         return v == 1
 
+    def _read_bool(self, channel, **kwargs):
+        """ reads channel. glitch-filtered channels report the filtered level
+        from the edge callbacks, since a direct read isn't filtered """
+        if self._steady.get(channel):
+            level = self.edges.level(channel)
+            if level is not None:
+                return level
+        return self._read_raw(channel)
+
+    def _read_bank(self, params_list):
+        """ reads every channel in params_list with one read_bank_1 call """
+        try:
+            bits = self.pi.read_bank_1()
+        except:
+            raise InterfaceError("Could not read GPIO bank 1")
+        values = []
+        for params in params_list:
+            channel = params['channel']
+            if self._steady.get(channel) and self.edges.level(channel) is not None:
+                values.append(self.edges.level(channel))
+            else:
+                values.append((bits >> channel) & 1 == 1)
+        return values
+
     def _write_bool(self, channel, value, **kwargs):
         if value:
             self.pi.write(channel, 1)
         else:
             self.pi.write(channel, 0)
 
+    def _write_bool_bank(self, params_list, values):
+        """ writes every channel in params_list with one clear_bank_1 and one
+        set_bank_1 call, so the changes land microseconds apart instead of
+        one pigpiod round trip apart. channels are cleared first, so e.g. a
+        cue light never shows two colors at once """
+        set_bits = 0
+        clear_bits = 0
+        for params, value in zip(params_list, values):
+            if value:
+                set_bits |= 1 << params['channel']
+            else:
+                clear_bits |= 1 << params['channel']
+        try:
+            if clear_bits:
+                self.pi.clear_bank_1(clear_bits)
+            if set_bits:
+                self.pi.set_bank_1(set_bits)
+        except:
+            raise InterfaceError("Could not write GPIO bank 1")
+        return values
+
     def _write_pwm(self, channel, value, servo=False, **kwargs):
         if servo:
             if self.pwm_servo is None:
                 raise InterfaceError("servo PWM requested but no servo_address was provided — is this a Rev C board?")
-            # value is in degrees (0-300) for goBILDA 2000-0025-0002:
-            # 0 deg = 500 us, 300 deg = 2500 us
-            pulse_us = 500.0 + (value / 300.0) * 2000.0
-            self.pwm_servo.set_pulse_width(channel, pulse_us)
+            self.pwm_servo.set_pulse_width(channel, self._servo_pulse(value))
         else:
             self.pwm.set_duty_cycle(channel, value)
         return value
 
-    def _poll2(self, channel, timeout=None, suppress_longpress=True, **kwargs):
-        ''' runs a loop, querying for transitions '''
-        date_fmt = '%Y-%m-%d %H:%M:%S.%f'
-        cb1 = self.pi.callback(channel, pigpio.RISING_EDGE)
-        if timeout is not None:
-            start = time.time()
-        print('Starting poll')
-        while True:
-            if cb1.tally() > 0:
-                print(cb1.tally())
-                cb1.reset_tally()
-                cb1.cancel()
-                return datetime.datetime.now()
-            if timeout is not None:
-                if time.time() - start >= timeout:
-                    cb1.reset_tally()
-                    cb1.cancel()
-                    return None
+    def _servo_pulse(self, value):
+        # value is in degrees (0-300) for goBILDA 2000-0025-0002:
+        # 0 deg = 500 us, 300 deg = 2500 us
+        return 500.0 + (value / 300.0) * 2000.0
+
+    def _write_pwm_bank(self, params_list, values):
+        """ writes every channel in params_list with one set_duty_cycles call
+        per PCA9685 chip, so runs of channels change in one I2C transaction """
+        lights = {}
+        servos = {}
+        for params, value in zip(params_list, values):
+            if params.get('servo'):
+                if self.pwm_servo is None:
+                    raise InterfaceError("servo PWM requested but no servo_address was provided — is this a Rev C board?")
+                pulse_us = self._servo_pulse(value)
+                servos[params['channel']] = (pulse_us / self.pwm_servo._pulse_width) * 100.0
+            else:
+                lights[params['channel']] = value
+        if lights:
+            self.pwm.set_duty_cycles(lights)
+        if servos:
+            self.pwm_servo.set_duty_cycles(servos)
+        return values
 
     def _poll(self, channel, timeout=None, suppress_longpress=True, **kwargs):
-        """ polls the input in a loop until it reads True (beam broken), or
-        times out. wait_for_edge()/pigpio callbacks proved unreliable on
-        this hardware (see Hopper.up(), which hit the same issue and was
-        switched to this same polling approach) -- missed edges rather
-        than a slow response, so we read the level directly instead. """
-        start = time.time()
-        while timeout is None or time.time() - start < timeout:
-            if self._read_bool(channel):
-                return datetime.datetime.now()
-            time.sleep(0.05)
-        return None
+        """ waits until the input reads True (beam broken), or times out.
+        returns the time of the rising edge, taken from the pigpio tick of the
+        edge rather than from when this call woke up, or None on timeout.
+
+        pigpio edge callbacks (see _capture) wake this up within a fraction of
+        a millisecond of the edge. callbacks have dropped edges on this
+        hardware before, so while waiting the level is also read directly
+        every 50 ms and any missed edge is corrected from that read. """
+        self._capture(channel)
+        since = self.edges.mark()
+        if self._read_bool(channel):
+            return datetime.datetime.now()
+        edge = self.edges.wait({channel: True},
+                               since=since,
+                               timeout=timeout,
+                               check=lambda: self._reconcile(channel),
+                               check_interval=0.05)
+        if edge is None:
+            return None
+        return edge.time
+
+    def _wait_any(self, targets, timeout=None, window=0.0, ignore_held=False):
+        """ waits until any of several inputs changes to its target level.
+
+        targets -- list of (params, level) pairs
+        timeout -- seconds to wait (default=forever)
+        window -- after the first edge, also report edges on the other
+            targets that arrive within this many seconds of it
+        ignore_held -- only report new edges, not inputs that are already at
+            their target level
+
+        returns a list of (index into targets, datetime) pairs, first edge
+        first, or an empty list on timeout. """
+        channels = {}
+        for params, level in targets:
+            self._capture(params['channel'])
+            channels[params['channel']] = level
+        since = self.edges.mark()
+        if not ignore_held:
+            now = datetime.datetime.now()
+            held = [(ii, now) for ii, (params, level) in enumerate(targets)
+                    if self._read_bool(params['channel']) == level]
+            if held:
+                return held
+        edges = self.edges.wait_window(channels,
+                                       since=since,
+                                       timeout=timeout,
+                                       window=window,
+                                       check=lambda: [self._reconcile(ch) for ch in channels],
+                                       check_interval=0.05)
+        hits = []
+        for edge in edges:
+            for ii, (params, level) in enumerate(targets):
+                if params['channel'] == edge.channel and level == edge.level:
+                    hits.append((ii, edge.time))
+        return hits
 
     def _callback(self, channel, func=None, **kwargs):
         date_fmt = '%Y-%m-%d %H:%M:%S.%f'
@@ -70,9 +70,9 @@ class PiPanel(panels.BasePanel):
 
         # assemble inputs into components
         # Standard Peckports
-        self.left = components.PeckPort(IR=self.inputs[1],LED=self.pwm_outputs[4],name='l', inverted=False)
-        self.center = components.PeckPort(IR=self.inputs[2],LED=self.pwm_outputs[5],name='c', inverted=False)
-        self.right = components.PeckPort(IR=self.inputs[3],LED=self.pwm_outputs[6],name='r', inverted=False)
+        self.left = components.PeckPort(IR=self.inputs[1],LED=self.pwm_outputs[4],name='l', inverted=False, scheduler=self.blink_scheduler, registry=self.registry)
+        self.center = components.PeckPort(IR=self.inputs[2],LED=self.pwm_outputs[5],name='c', inverted=False, scheduler=self.blink_scheduler, registry=self.registry)
+        self.right = components.PeckPort(IR=self.inputs[3],LED=self.pwm_outputs[6],name='r', inverted=False, scheduler=self.blink_scheduler, registry=self.registry)
         
         # Hopper — up_angle and down_angle must be tuned per panel
         self.hopper = components.Hopper(IR=self.inputs[0], servo=self.hopper_servo,
@@ -83,13 +83,15 @@ class PiPanel(panels.BasePanel):
         self.house_light = components.LEDStripHouseLight(lights=[self.pwm_outputs[0],
                                                                  self.pwm_outputs[1],
                                                                  self.pwm_outputs[2],
-                                                                 self.pwm_outputs[3]])
+                                                                 self.pwm_outputs[3]],
+                                                         registry=self.registry)
         # define reward & punishment methods
         self.reward = self.hopper.reward
         self.punish = self.house_light.punish
 
     def reset(self):
-        self.hopper.down()
+        # both skip the hardware when it's already in place
+        self.hopper.reset()
         self.house_light.on()
         # self.speaker.stop()
 
@@ -87,11 +87,17 @@ class PiPanel(panels.BasePanel):
         #                      7=AUX_LED_1 .. 12=AUX_LED_6,
         #                      13=RGB_CUE_R, 14=RGB_CUE_G, 15=RGB_CUE_B
         self.left   = components.PeckPort(IR=self.inputs[1], LED=self.pwm_outputs[4],
-                                          name='l', inverted=True)
+                                          name='l', inverted=True,
+                                          scheduler=self.blink_scheduler,
+                                          registry=self.registry)
         self.center = components.PeckPort(IR=self.inputs[2], LED=self.pwm_outputs[5],
-                                          name='c', inverted=True)
+                                          name='c', inverted=True,
+                                          scheduler=self.blink_scheduler,
+                                          registry=self.registry)
         self.right  = components.PeckPort(IR=self.inputs[3], LED=self.pwm_outputs[6],
-                                          name='r', inverted=True)
+                                          name='r', inverted=True,
+                                          scheduler=self.blink_scheduler,
+                                          registry=self.registry)
 
         # Solenoid hopper on GPIO 16
         self.hopper = components.Hopper(IR=self.inputs[0],
@@ -103,20 +109,27 @@ class PiPanel(panels.BasePanel):
             lights=[self.pwm_outputs[0],
                     self.pwm_outputs[1],
                     self.pwm_outputs[2],
-                    self.pwm_outputs[3]])
+                    self.pwm_outputs[3]],
+            registry=self.registry)
 
         # RGB cue light (PWM channels 13/14/15 = indices 13/14/15)
         self.cue = components.RGBLight(red=self.pwm_outputs[13],
                                        green=self.pwm_outputs[14],
                                        blue=self.pwm_outputs[15],
-                                       name='cue')
+                                       name='cue',
+                                       scheduler=self.blink_scheduler,
+                                       registry=self.registry)
+
+        # AUX LEDs aren't part of a component; register them for snapshot()/restore()
+        self.register(*self.pwm_outputs[7:13])
 
         # define reward & punishment methods
         self.reward = self.hopper.reward
         self.punish = self.house_light.punish
 
     def reset(self):
-        self.hopper.down()
+        # both skip the hardware when it's already in place
+        self.hopper.reset()
         self.house_light.on()
 
 
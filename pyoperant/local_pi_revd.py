@@ -110,11 +110,17 @@ class PiPanel(panels.BasePanel):
         #                      7=AUX_LED_1, 8=AUX_LED_2, 9=AUX_LED_3, 10=AUX_LED_4,
         #                      11=RGB_CUE_R, 12=RGB_CUE_G, 13=RGB_CUE_B
         self.left = components.PeckPort(IR=self.inputs[1], LED=self.pwm_outputs[4],
-                                          name='l', inverted=False)
+                                          name='l', inverted=False,
+                                          scheduler=self.blink_scheduler,
+                                          registry=self.registry)
         self.center = components.PeckPort(IR=self.inputs[2], LED=self.pwm_outputs[5],
-                                          name='c', inverted=False)
+                                          name='c', inverted=False,
+                                          scheduler=self.blink_scheduler,
+                                          registry=self.registry)
         self.right  = components.PeckPort(IR=self.inputs[3], LED=self.pwm_outputs[6],
-                                          name='r', inverted=False)
+                                          name='r', inverted=False,
+                                          scheduler=self.blink_scheduler,
+                                          registry=self.registry)
 
         # Servo hopper — up_angle and down_angle must be tuned per panel
         self.hopper = components.Hopper(IR=self.inputs[0],
@@ -128,20 +134,27 @@ class PiPanel(panels.BasePanel):
             lights=[self.pwm_outputs[0],
                     self.pwm_outputs[1],
                     self.pwm_outputs[2],
-                    self.pwm_outputs[3]])
+                    self.pwm_outputs[3]],
+            registry=self.registry)
 
         # RGB cue light (pwm_outputs[11]=RGB_CUE_R, [12]=RGB_CUE_G, [13]=RGB_CUE_B — PCA9685 channels 13/14/15)
         self.cue = components.RGBLight(red=self.pwm_outputs[11],
                                        green=self.pwm_outputs[12],
                                        blue=self.pwm_outputs[13],
-                                       name='cue')
+                                       name='cue',
+                                       scheduler=self.blink_scheduler,
+                                       registry=self.registry)
+
+        # AUX LEDs aren't part of a component; register them for snapshot()/restore()
+        self.register(*self.pwm_outputs[7:11])
 
         # define reward & punishment methods
         self.reward = self.hopper.reward
         self.punish = self.house_light.punish
 
     def reset(self):
-        self.hopper.down()
+        # both skip the hardware when it's already in place
+        self.hopper.reset()
         self.house_light.on()
 
 
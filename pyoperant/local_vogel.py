@@ -42,10 +42,10 @@ class VogelPanel(panels.BasePanel):
         self.speaker = hwio.AudioOutput(interface=self.interfaces['pyaudio'])
 
         # assemble inputs into components
-        self.left = components.PeckPort(IR=self.inputs[0],LED=self.outputs[0])
-        self.center = components.PeckPort(IR=self.inputs[1],LED=self.outputs[1])
-        self.right = components.PeckPort(IR=self.inputs[2],LED=self.outputs[2])
-        self.house_light = components.HouseLight(light=self.outputs[3])
+        self.left = components.PeckPort(IR=self.inputs[0],LED=self.outputs[0],scheduler=self.blink_scheduler,registry=self.registry)
+        self.center = components.PeckPort(IR=self.inputs[1],LED=self.outputs[1],scheduler=self.blink_scheduler,registry=self.registry)
+        self.right = components.PeckPort(IR=self.inputs[2],LED=self.outputs[2],scheduler=self.blink_scheduler,registry=self.registry)
+        self.house_light = components.HouseLight(light=self.outputs[3],registry=self.registry)
         self.hopper = components.Hopper(IR=self.inputs[3],solenoid=self.outputs[4])
 
         # define reward & punishment methods
@@ -53,10 +53,10 @@ class VogelPanel(panels.BasePanel):
         self.punish = self.house_light.punish
 
     def reset(self):
-        for output in self.outputs:
-            output.write(False)
-        self.house_light.on()
-        self.hopper.down()
+        # everything off but the house light, in one write of what changed
+        self.write_outputs([output is self.house_light.light for output in self.outputs],
+                           changed_only=True)
+        self.hopper.reset()
 
     def test(self):
         print ('reset')
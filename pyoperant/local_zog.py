@@ -44,7 +44,8 @@ class ZogPanel(panels.BasePanel):
         self.id = id
 
         # define interfaces
-        self.interfaces['comedi'] = comedi_.ComediInterface(device_name=_ZOG_MAP[self.id][0])
+        # one polling loop per comedi device serves all the boxes on it
+        self.interfaces['comedi'] = comedi_.ComediInterface(device_name=_ZOG_MAP[self.id][0],shared=True)
         self.interfaces['pyaudio'] = ZogAudioInterface(device_name= (dev_name_fmt % self.id))
 
 
@@ -66,10 +67,10 @@ class ZogPanel(panels.BasePanel):
         self.speaker = hwio.AudioOutput(interface=self.interfaces['pyaudio'])
 
         # assemble inputs into components
-        self.left = components.PeckPort(IR=self.inputs[0],LED=self.outputs[0])
-        self.center = components.PeckPort(IR=self.inputs[1],LED=self.outputs[1])
-        self.right = components.PeckPort(IR=self.inputs[2],LED=self.outputs[2])
-        self.house_light = components.HouseLight(light=self.outputs[3])
+        self.left = components.PeckPort(IR=self.inputs[0],LED=self.outputs[0],scheduler=self.blink_scheduler,registry=self.registry)
+        self.center = components.PeckPort(IR=self.inputs[1],LED=self.outputs[1],scheduler=self.blink_scheduler,registry=self.registry)
+        self.right = components.PeckPort(IR=self.inputs[2],LED=self.outputs[2],scheduler=self.blink_scheduler,registry=self.registry)
+        self.house_light = components.HouseLight(light=self.outputs[3],registry=self.registry)
         self.hopper = components.Hopper(IR=self.inputs[3],solenoid=self.outputs[4])
 
         # define reward & punishment methods
@@ -77,10 +78,10 @@ class ZogPanel(panels.BasePanel):
         self.punish = self.house_light.punish
 
     def reset(self):
-        for output in self.outputs:
-            output.write(False)
-        self.house_light.on()
-        self.hopper.down()
+        # everything off but the house light, in one write of what changed
+        self.write_outputs([output is self.house_light.light for output in self.outputs],
+                           changed_only=True)
+        self.hopper.reset()
         # self.speaker.stop()
 
     def test(self):
@@ -168,7 +169,9 @@ class ZogCuePanel(ZogPanel):
         self.cue = components.RGBLight(red=self.outputs[7],
                                        green=self.outputs[5],
                                        blue=self.outputs[6],
-                                       name='cue')
+                                       name='cue',
+                                       scheduler=self.blink_scheduler,
+                                       registry=self.registry)
 
 class Zog5(ZogCuePanel):
     """Zog5 panel"""
@@ -1,4 +1,7 @@
 import time
+import datetime
+import functools
+from pyoperant import hwio
 
 ## Panel classes
 
@@ -23,17 +26,25 @@ class BasePanel(object):
                                                  )
     3. add components constructed from your inputs and outputs:
         >>> self.hopper = components.Hopper(IR=self.inputs[3],solenoid=self.outputs[4])
+       components that blink (PeckPort, RGBLight) should share the panel's
+       scheduler, and components that drive lights should register them in
+       the panel's registry (see snapshot()/restore()):
+        >>> self.center = components.PeckPort(IR=self.inputs[1],LED=self.outputs[1],
+                                              scheduler=self.blink_scheduler,
+                                              registry=self.registry)
+       outputs no component drives can be registered with self.register()
 
     4. assign panel methods needed for operant behavior, such as 'reward':
         >>> self.reward = self.hopper.reward
 
     5. finally, define a reset() method that will set the entire panel to a 
-        neutral state:
+        neutral state. reset() is called on every idle poll, so it should only
+        touch what isn't already there:
 
         >>> def reset(self):
-        >>>     for output in self.outputs:
-        >>>         output.set(False)
-        >>>     self.house_light.write(True)
+        >>>     self.write_outputs([output is self.house_light.light
+        >>>                         for output in self.outputs],changed_only=True)
+        >>>     self.hopper.reset()
         >>>     return True
 
     """
@@ -43,10 +54,111 @@ class BasePanel(object):
 
         self.inputs = []
         self.outputs = []
+        self.sampler = None
+        self._output_group = None
+        # the outputs snapshot() covers; components register with it when
+        # they are passed registry=self.registry
+        self.registry = hwio.OutputRegistry()
+        # one thread blinks every LED on the panel (started on first use)
+        self.blink_scheduler = hwio.BlinkScheduler()
 
     def reset(self):
          raise NotImplementedError
 
+    def write_outputs(self,value=False,changed_only=False):
+        """writes value (one for all, or a list in the order of self.outputs)
+        to the outputs at once, with one call per interface where the
+        interface supports it (see hwio.OutputGroup). with changed_only,
+        outputs already at their value are left alone"""
+        if self._output_group is None or self._output_group.outputs != self.outputs:
+            self._output_group = hwio.OutputGroup(self.outputs)
+        return self._output_group.write(value,changed_only=changed_only)
+
+    def register(self,*outputs):
+        """adds outputs that no component drives (e.g. AUX LEDs) to the
+        registry that snapshot() and restore() cover. returns outputs"""
+        return self.registry.register(*outputs)
+
+    def snapshot(self):
+        """the last value written to every output on the panel, for restore().
+        no hardware is read"""
+        return self.registry.snapshot()
+
+    def restore(self,snapshot):
+        """puts the outputs back the way they were at snapshot(), in one
+        batched write of what has changed"""
+        return self.registry.restore(snapshot)
+
+    def apply_state(self,state):
+        """sets several components at once. state is a dict of component
+        attribute name: target, e.g.
+
+        >>> panel.apply_state({'house_light': True, 'center': False,
+        >>>                    'cue': 'red', 'hopper': 'down'})
+
+        port LEDs and house lights take True/False (or a PWM level or an
+        [R, G, B, W] color), cue lights a color name or 'off', and the hopper
+        'up' or 'down'. outputs already at their target are left alone; the
+        rest are written together with as few calls per interface as it
+        supports (see hwio.OutputGroup). the hopper moves after that, and only
+        if it isn't already there. components without state support get
+        on()/off() for True/False, or the method a string target names.
+
+        returns the datetime the state took effect: after the write, or when
+        the IR beam confirmed the hopper if it moved"""
+        writes = {}
+        applied = []
+        deferred = []
+        for name, target in state.items():
+            component = getattr(self,name)
+            if hasattr(component,'_state_writes'):
+                for output, value in component._state_writes(target):
+                    writes[id(output)] = (output,value)
+                if hasattr(component,'_state_applied'):
+                    applied.append(functools.partial(component._state_applied,target))
+            elif hasattr(component,'_apply_state'):
+                deferred.append(functools.partial(component._apply_state,target))
+            elif isinstance(target,str):
+                deferred.append(getattr(component,target))
+            else:
+                deferred.append(component.on if target else component.off)
+        if writes:
+            outputs, values = zip(*writes.values())
+            hwio.OutputGroup(outputs).write(list(values),changed_only=True)
+        effective = datetime.datetime.now()
+        # components only update their own state once the write went out
+        for action in applied:
+            action()
+        for action in deferred:
+            result = action()
+            if isinstance(result,datetime.datetime):
+                effective = max(effective,result)
+            elif result is not None:
+                effective = datetime.datetime.now()
+        return effective
+
+    def blink(self,target,period=1.0,duty=0.5,duration=None,repeat=None):
+        """blinks target (a component with on()/off(), or an output such as
+        an AUX LED) on the panel's scheduler without blocking. returns the
+        hwio.Blink"""
+        return self.blink_scheduler.blink(target,period=period,duty=duty,
+                                          duration=duration,repeat=repeat)
+
+    def start_sampler(self,path,rate=1000.0,length=None,inputs=None):
+        """starts recording the panel inputs (default=all of self.inputs) to a
+        memory-mapped ring buffer at path. returns the InputSampler"""
+        self.stop_sampler()
+        if inputs is None:
+            inputs = self.inputs
+        self.sampler = hwio.InputSampler(inputs,path,rate=rate,length=length)
+        self.sampler.start()
+        return self.sampler
+
+    def stop_sampler(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler = None
+
     def test(self):
         self.reset()
         dur = 2.0
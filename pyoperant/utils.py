@@ -5,6 +5,7 @@ import time
 import subprocess
 import threading
 import traceback
+import concurrent.futures
 import shlex
 import os
 import random
@@ -43,10 +44,16 @@ class NumpyAwareJSONEncoder(json.JSONEncoder):
 
 # consider importing this from python-neo
 class Event(object):
-    """docstring for Event"""
-    def __init__(self, time=None, duration=None, label='', name=None, description=None, file_origin=None, *args, **kwargs):
+    """An event in a trial.
+
+    time is usually seconds relative to the start of the trial. timestamp is
+    the absolute datetime of the event where it is known from hardware (e.g.
+    a captured IR edge), so it does not carry any polling latency.
+    """
+    def __init__(self, time=None, duration=None, label='', name=None, description=None, file_origin=None, timestamp=None, *args, **kwargs):
         super(Event, self).__init__()
         self.time = time
+        self.timestamp = timestamp
         self.duration = duration
         self.label = label
         self.name = name
@@ -255,6 +262,42 @@ def check_time(schedule,fmt="%H:%M"):
                 return True
     return False
 
+def house_light_transition(panel, parameters, on):
+    """ turns the panel's house light on or off for a sleep transition. if
+    parameters has a 'light_ramp' entry (seconds) and the house light can
+    ramp, it fades instead (simulated dawn/dusk) without blocking the
+    state machine
+    """
+    duration = parameters.get('light_ramp')
+    light = panel.house_light
+    if not duration or not hasattr(light,'ramp'):
+        return light.on() if on else light.off()
+    if on:
+        light.ramp(duration=duration)
+    else:
+        light.ramp([0.0,0.0,0.0,0.0],duration=duration)
+    return True
+
+def run_async(func, *args, **kwargs):
+    """Run func(*args, **kwargs) on a background thread.
+
+    Returns a concurrent.futures.Future: done() says whether it has finished,
+    result(timeout) waits for and returns its return value, re-raising any
+    exception it raised.
+    """
+    future = concurrent.futures.Future()
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+    thread = threading.Thread(target=run, name=getattr(func, '__name__', 'run_async'))
+    thread.daemon = True
+    thread.start()
+    return future
+
 def wait(secs=1.0, final_countdown=0.0,waitfunc=None):
     """Smartly wait for a given time period.
 
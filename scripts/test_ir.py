@@ -6,14 +6,25 @@ test_ir.py -- Live IR beam status display for Rev D Magpi panels.
 Shows the current state of all IR sensors, updating continuously.
 Press Ctrl+C to exit.
 
+The sensors are sampled at --rate Hz by a background InputSampler, so short
+beam breaks that fall between screen refreshes still show up in the
+transition counts. The raw samples are left in --path for later inspection.
+
 Usage:
-    python test_ir.py
+    python test_ir.py [--rate 1000] [--path /tmp/test_ir]
 """
 
 import sys
 import time
+import argparse
+import numpy as np
 
 def main():
+    parser = argparse.ArgumentParser(description='Live IR beam status display')
+    parser.add_argument('--rate', type=float, default=1000.0, help='samples per second')
+    parser.add_argument('--path', default='/tmp/test_ir', help='path prefix for the sample files')
+    args = parser.parse_args()
+
     try:
         from pyoperant.interfaces.raspi_gpio_ import RaspberryPiInterface
         from pyoperant import hwio
@@ -50,30 +61,52 @@ def main():
     sensors = []
     for channel in INPUTS:
         sensors.append(hwio.BooleanInput(interface=raspi, params={'channel': channel}))
+    sensor_names = sensor_names[:len(sensors)]
+
+    sampler = hwio.InputSampler(sensors, args.path, rate=args.rate,
+                                length=int(args.rate * 60))
+    reader = sampler.reader()
+    sampler.start()
 
-    print("Connected. Monitoring IR beams -- press Ctrl+C to exit.\n")
+    print("Connected. Sampling IR beams at %g Hz to %s -- press Ctrl+C to exit.\n" % (args.rate, args.path))
 
     # column widths for alignment
-    col = 10
+    col = 14
 
     # header
     header = ''.join(name.ljust(col) for name in sensor_names)
     print(header)
     print('-' * len(header))
 
+    transitions = [0] * len(sensors)
+    last_count = reader.count()
+    last_state = None
     try:
         while True:
+            time.sleep(0.1)
+            count = reader.count()
+            samples = reader.latest(count - last_count)
+            last_count = count
+            if len(samples) == 0:
+                continue
+            state = samples['state']
+            if last_state is not None:
+                state = np.concatenate(([last_state], state)).astype(state.dtype)
+            diff = state[1:] ^ state[:-1]
+            for ii in range(len(sensors)):
+                transitions[ii] += int(np.count_nonzero(diff >> ii & 1))
+            last_state = int(state[-1])
             states = []
-            for sensor in sensors:
-                raw = sensor.read()
-                states.append('BLOCKED' if raw else 'clear  ')
-            line = ''.join(s.ljust(col) for s in states)
-            sys.stdout.write('\r' + line)
+            for ii in range(len(sensors)):
+                label = 'BLOCKED' if last_state >> ii & 1 else 'clear'
+                states.append(('%s %d' % (label, transitions[ii])).ljust(col))
+            sys.stdout.write('\r' + ''.join(states))
             sys.stdout.flush()
-            time.sleep(0.1)
     except KeyboardInterrupt:
         print("\nDone.")
     finally:
+        sampler.stop()
+        print("Overruns: %d" % sampler.overruns)
         raspi.close()
 
 if __name__ == '__main__':
@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 """
-tune_servo.py -- Interactive servo angle tuning for Rev D Magpi hopper.
+tune_servo.py -- Servo angle tuning for Rev D Magpi hopper.
 
 Run this script directly on the Raspberry Pi to find the correct up_angle
 and down_angle values for a panel's hopper servo. Once you have good values
 the script can write them directly back to local_pi_revd.py.
 
+By default the script is interactive. With --sweep it tries every candidate
+angle over repeated raise/lower trials, timing each move from the servo
+command to the IR edge, and picks the fastest angles that confirm every
+time with a margin of reliable angles around them. Per-angle stats go to a
+JSON report.
+
 Usage:
     python tune_servo.py
+    python tune_servo.py --sweep [--up-range 20 80 5] [--down-range 0 30 2.5]
+                         [--trials 5] [--report report.json] [--write [--yes]]
 
 Requirements:
     - pigpiod must be running (sudo pigpiod)
@@ -19,8 +27,12 @@ import os
 import re
 import sys
 import time
+import json
+import socket
+import datetime
+import argparse
 
-def _write_angles_to_config(up_angle, down_angle):
+def _write_angles_to_config(up_angle, down_angle, confirm=True):
     """Offer to write tuned angles back to local_pi_revd.py."""
     # Locate local_pi_revd.py relative to this script
     # scripts/tune_servo.py -> pyoperant/local_pi_revd.py
@@ -66,10 +78,13 @@ def _write_angles_to_config(up_angle, down_angle):
         print("  (no textual difference detected)")
         return
 
-    try:
-        resp = input("\nWrite these values to local_pi_revd.py? [y/N]: ").strip().lower()
-    except (KeyboardInterrupt, EOFError):
-        resp = 'n'
+    if not confirm:
+        resp = 'y'
+    else:
+        try:
+            resp = input("\nWrite these values to local_pi_revd.py? [y/N]: ").strip().lower()
+        except (KeyboardInterrupt, EOFError):
+            resp = 'n'
 
     if resp == 'y':
         with open(config_path, 'w') as f:
@@ -79,7 +94,151 @@ def _write_angles_to_config(up_angle, down_angle):
         print("  -> Not written. Update manually if needed.")
 
 
+def _frange(start, stop, step):
+    """start to stop inclusive, in steps"""
+    values = []
+    value = start
+    while value <= stop + 1e-9:
+        values.append(round(value, 3))
+        value += step
+    return values
+
+
+def _stats(latencies, trials):
+    """reliability and latency stats for one angle. latencies holds one entry
+    per trial: seconds to the IR edge, or None if it never came"""
+    ok = sorted(l for l in latencies if l is not None)
+    stats = {'trials': trials,
+             'confirmed': len(ok),
+             'reliability': float(len(ok)) / trials if trials else 0.0,
+             'latencies': latencies}
+    if ok:
+        stats.update({'mean': sum(ok) / len(ok),
+                      'min': ok[0],
+                      'max': ok[-1]})
+    return stats
+
+
+def _pick(results, margin):
+    """Fastest angle that confirmed every trial, and whose `margin` neighbours
+    on the less-travel side did too, so a little wear or drift still works.
+    results is a list of (angle, stats) ordered from least to most travel."""
+    best = None
+    for ii, (angle, stats) in enumerate(results):
+        if ii < margin:
+            continue
+        window = results[ii - margin:ii + 1]
+        if not all(s['reliability'] == 1.0 for a, s in window):
+            continue
+        if best is None or stats['max'] < best[1]['max']:
+            best = (angle, stats)
+    return best[0] if best is not None else None
+
+
+def _measure(servo, ir, start_angle, angle, beam_broken, timeout):
+    """Move to start_angle, wait for the beam to show it, then time the move to
+    angle until the beam changes. Returns seconds, or None."""
+    servo.write(start_angle)
+    if ir.wait_for(not beam_broken, timeout=timeout) is None:
+        return None
+    time.sleep(0.1)  # let the servo settle before the timed move
+    commanded = datetime.datetime.now()
+    servo.write(angle)
+    edge = ir.wait_for(beam_broken, timeout=timeout)
+    if edge is None:
+        return None
+    return max((edge - commanded).total_seconds(), 0.0)
+
+
+def sweep(servo, ir, up_angles, down_angles, trials=5, timeout=1.5, margin=1, log=print):
+    """Sweep candidate up and down angles. Up angles are timed from the
+    lowest down candidate; down angles from the chosen up angle. Returns a
+    report dict."""
+    # up: least travel (closest to down) first
+    up_angles = sorted(up_angles)
+    down_angles = sorted(down_angles, reverse=True)
+    park = min(down_angles)
+    report = {'host': socket.gethostname(),
+              'time': datetime.datetime.now().isoformat(),
+              'trials': trials,
+              'timeout': timeout,
+              'margin': margin,
+              'up': [],
+              'down': []}
+
+    for angle in up_angles:
+        latencies = [_measure(servo, ir, park, angle, True, timeout) for _ in range(trials)]
+        stats = _stats(latencies, trials)
+        report['up'].append((angle, stats))
+        log("  up   %6.1f  %d/%d  %s" % (angle, stats['confirmed'], trials,
+                                        '%.3f s' % stats['mean'] if 'mean' in stats else '-'))
+    up_angle = _pick(report['up'], margin)
+    report['up_angle'] = up_angle
+
+    if up_angle is not None:
+        for angle in down_angles:
+            latencies = [_measure(servo, ir, up_angle, angle, False, timeout) for _ in range(trials)]
+            stats = _stats(latencies, trials)
+            report['down'].append((angle, stats))
+            log("  down %6.1f  %d/%d  %s" % (angle, stats['confirmed'], trials,
+                                            '%.3f s' % stats['mean'] if 'mean' in stats else '-'))
+    down_angle = _pick(report['down'], margin)
+    report['down_angle'] = down_angle
+
+    servo.write(down_angle if down_angle is not None else park)
+    # json has no tuples
+    report['up'] = [dict(angle=a, **s) for a, s in report['up']]
+    report['down'] = [dict(angle=a, **s) for a, s in report['down']]
+    return report
+
+
+def run_sweep(args, servo, ir):
+    up_angles = _frange(*args.up_range)
+    down_angles = _frange(*args.down_range)
+    print("Sweeping %d up and %d down angles, %d trials each..." %
+          (len(up_angles), len(down_angles), args.trials))
+    report = sweep(servo, ir, up_angles, down_angles, trials=args.trials,
+                   timeout=args.timeout, margin=args.margin)
+
+    report_path = args.report or 'tune_servo_%s_%s.json' % (
+        report['host'], datetime.datetime.now().strftime('%Y%m%d-%H%M%S'))
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("\nReport written to %s" % report_path)
+
+    up_angle, down_angle = report['up_angle'], report['down_angle']
+    if up_angle is None or down_angle is None:
+        print("No angle confirmed reliably in %s. Widen the ranges or use interactive mode." %
+              ('up' if up_angle is None else 'down'))
+        return None
+    best_up = [r for r in report['up'] if r['angle'] == up_angle][0]
+    best_down = [r for r in report['down'] if r['angle'] == down_angle][0]
+    print("  up_angle   = %.1f (max %.3f s)" % (up_angle, best_up['max']))
+    print("  down_angle = %.1f (max %.3f s)" % (down_angle, best_down['max']))
+    if args.write:
+        _write_angles_to_config(up_angle, down_angle, confirm=not args.yes)
+    return report
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Tune the Rev D hopper servo angles.")
+    parser.add_argument('--sweep', action='store_true',
+                        help="measure candidate angles automatically instead of interactively")
+    parser.add_argument('--up-range', nargs=3, type=float, default=[20.0, 80.0, 5.0],
+                        metavar=('START', 'STOP', 'STEP'), help="candidate up angles (default 20 80 5)")
+    parser.add_argument('--down-range', nargs=3, type=float, default=[0.0, 30.0, 2.5],
+                        metavar=('START', 'STOP', 'STEP'), help="candidate down angles (default 0 30 2.5)")
+    parser.add_argument('--trials', type=int, default=5, help="moves per angle (default 5)")
+    parser.add_argument('--timeout', type=float, default=1.5,
+                        help="seconds to wait for the IR beam per move (default 1.5)")
+    parser.add_argument('--margin', type=int, default=1,
+                        help="reliable neighbouring angles required on the less-travel side (default 1)")
+    parser.add_argument('--report', help="report file (default tune_servo_<host>_<time>.json)")
+    parser.add_argument('--write', action='store_true',
+                        help="write the chosen angles back to local_pi_revd.py")
+    parser.add_argument('--yes', action='store_true', help="with --write, don't ask first")
+    args = parser.parse_args()
+
     # --- connect to hardware ---
     try:
         import pigpio
@@ -117,6 +276,14 @@ def main():
     # hopper IR beam is INPUTS[0] = GPIO 5
     ir = hwio.BooleanInput(interface=raspi, params={'channel': INPUTS[0]})
 
+    if args.sweep:
+        try:
+            run_sweep(args, servo, ir)
+        finally:
+            raspi.close()
+        print("Done.\n")
+        return
+
     print("Controls:")
     print("  Enter a number (0.0 - 300.0) to move the servo to that angle in degrees")
     print("  'u'  = move to current up_angle")
@@ -1,10 +1,104 @@
-
 int baudRate = 19200; // 9600 seems common though it can probably be increased significantly if needed.
 char ioBytes[2];
 int ioPort = 0;
 
+// Pins currently configured as inputs, so they can all be read in one request
+boolean isInput[NUM_DIGITAL_PINS];
+int maxInput = -1;
+
+// In stream mode every change on an input is sent as an event frame:
+//   0xA5, pin, level, micros() as 4 bytes little-endian
+// and replies to requests are framed so they can be told apart from events:
+//   0x5A, length, reply bytes
+// The reply to a time request is always 0xA6, micros() as 4 bytes.
+// Stopping the stream is acknowledged with an empty reply, 0x5A, 0.
+const byte EVENT_MARKER = 0xA5;
+const byte TIME_MARKER = 0xA6;
+const byte REPLY_MARKER = 0x5A;
+boolean streaming = false;
+byte lastLevel[NUM_DIGITAL_PINS];
+
+void writeMicros(unsigned long t)
+{
+  for (int i = 0; i < 4; i++) {
+    Serial.write((byte) (t >> (8 * i)));
+  }
+}
+
+void sendEvent(int port, byte level, unsigned long t)
+{
+  Serial.write(EVENT_MARKER);
+  Serial.write((byte) port);
+  Serial.write(level);
+  writeMicros(t);
+}
+
+void snapshotInput(int port)
+{
+  // Send the current level of an input so the host starts from a known state
+  lastLevel[port] = digitalRead(port);
+  sendEvent(port, lastLevel[port], micros());
+}
+
+void scanInputs()
+{
+  for (int i = 0; i <= maxInput; i++) {
+    if (isInput[i]) {
+      byte level = digitalRead(i);
+      if (level != lastLevel[i]) {
+        unsigned long t = micros();
+        lastLevel[i] = level;
+        sendEvent(i, level, t);
+      }
+    }
+  }
+}
+
+void setInput(int port, boolean value)
+{
+  if (port < 0 || port >= NUM_DIGITAL_PINS) {
+    return;
+  }
+  isInput[port] = value;
+  if (value && streaming) {
+    snapshotInput(port);
+  }
+  maxInput = -1;
+  for (int i = 0; i < NUM_DIGITAL_PINS; i++) {
+    if (isInput[i]) {
+      maxInput = i;
+    }
+  }
+}
+
+void readAll()
+{
+  // Reply with a length byte followed by that many bytes of bitfield.
+  // Bit (pin % 8) of byte (pin / 8) is the level of that pin; pins that
+  // are not configured as inputs read as 0.
+  // In stream mode the same bytes follow a REPLY_MARKER.
+  byte nBytes = (maxInput / 8) + 1;
+  byte bits[(NUM_DIGITAL_PINS + 7) / 8];
+  for (int i = 0; i < nBytes; i++) {
+    bits[i] = 0;
+  }
+  for (int i = 0; i <= maxInput; i++) {
+    if (isInput[i] && digitalRead(i) == HIGH) {
+      bits[i / 8] |= 1 << (i % 8);
+    }
+  }
+  if (streaming) {
+    Serial.write(REPLY_MARKER);
+  }
+  Serial.write(nBytes);
+  Serial.write(bits, nBytes);
+}
+
 void setup()
 {
+  for (int i = 0; i < NUM_DIGITAL_PINS; i++) {
+    isInput[i] = false;
+  }
   // start serial port at the specified baud rate
   Serial.begin(baudRate);
   while (!Serial) {
@@ -25,6 +119,9 @@ void loop()
   // 3: Set the specified pin to OUTPUT
   // 4: Set the specified pin to INPUT
   // 5: Set the specified pin to INPUT_PULLUP
+  // 6: Read all inputs (the port byte is ignored)
+  // 7: Stream input changes if the port byte is 1, stop if it is 0
+  // 8: Reply with the current micros() (the port byte is ignored)
   // if we get a valid serial message, read the request:
   if (Serial.available() >= 2) {
     // get incoming two bytes:
@@ -37,6 +134,10 @@ void loop()
     // Switch case on the specified action
     switch ((int) ioBytes[1]) {
       case 0: // Read an input
+        if (streaming) {
+          Serial.write(REPLY_MARKER);
+          Serial.write((byte) 1);
+        }
         Serial.write(digitalRead(ioPort));
         break;
       case 1: // Write an output to HIGH
@@ -48,14 +149,42 @@ void loop()
       case 3: // Set a pin to OUTPUT
         pinMode(ioPort, OUTPUT);
         digitalWrite(ioPort, LOW);
+        setInput(ioPort, false);
         break;
       case 4: // Set a pin to INPUT
         pinMode(ioPort, INPUT);
+        setInput(ioPort, true);
         break;
       case 5: // Set a pin to INPUT_PULLUP
         pinMode(ioPort, INPUT_PULLUP);
+        setInput(ioPort, true);
+        break;
+      case 6: // Read all inputs as a bitfield
+        readAll();
+        break;
+      case 7: // Start or stop streaming input changes
+        if (ioPort == 1) {
+          streaming = true;
+          for (int i = 0; i <= maxInput; i++) {
+            if (isInput[i]) {
+              snapshotInput(i);
+            }
+          }
+        } else if (streaming) {
+          // acknowledge, so the host knows the frames have ended
+          Serial.write(REPLY_MARKER);
+          Serial.write((byte) 0);
+          streaming = false;
+        }
+        break;
+      case 8: // Report the time
+        Serial.write(TIME_MARKER);
+        writeMicros(micros());
         break;
     }
   }
+  if (streaming) {
+    scanInputs();
+  }
   //delay(10); // Should probably move to a non-delay based spacing.
 }
@@ -41,10 +41,31 @@ class FakePort(object):
         self.calls.append("status")
         return True
 
+    def peck_time(self, since=None):
+        return dt.datetime.now()
+
     def flash(self, dur=1.0):
         self.calls.append("flash")
         return dt.datetime.now()
 
+    def blink(self, period=1.0, duty=0.5, duration=None, repeat=None, end=None):
+        self.calls.append("blink")
+        return FakeBlink()
+
+
+class FakeBlink(object):
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def done(self):
+        return self.cancelled
+
+    def wait(self, timeout=None):
+        return self.cancelled
+
 
 class FakeLight(object):
     def __init__(self):
@@ -7,17 +7,24 @@ can be run on a development machine without a Raspberry Pi.
 """
 
 import datetime
+import json
 import sys
 import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 from unittest.mock import patch, Mock, MagicMock
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from pyoperant import hwio
+from pyoperant import hwio, panels
 from pyoperant.components import (
-    Hopper, PeckPort,
+    Hopper, PeckPort, PeckPortBank, PortSelector, RGBLight,
+    LEDStripHouseLight, HouseLight,
     HopperWontComeUpError, HopperWontDropError, HopperAlreadyUpError,
+    LatencyHistogram,
 )
 
 
@@ -212,10 +219,175 @@ class TestHopperDown(unittest.TestCase):
             self.hopper.down()
 
 
+class TestHopperReset(unittest.TestCase):
+
+    def test_reset_skips_a_hopper_already_down(self):
+        iface = FakeInterface()
+        hopper = Hopper(IR=make_bool_input(iface, 5), solenoid=make_bool_output(iface, 1),
+                        max_lag=0.1)
+        self.assertTrue(hopper.reset())  # nothing commanded yet
+        with patch.object(hopper, 'down') as down:
+            self.assertFalse(hopper.reset())
+            down.assert_not_called()
+
+    def test_reset_lowers_when_ir_disagrees(self):
+        iface = FakeInterface()
+        hopper = Hopper(IR=make_bool_input(iface, 5), servo=make_pwm_output(iface, 0),
+                        up_angle=45, down_angle=10, max_lag=0.1)
+        self.assertFalse(hopper.reset())
+        iface.values[5] = True  # stuck up
+        with self.assertRaises(HopperWontDropError):
+            hopper.reset()
+
+
+class EdgeInterface(FakeInterface):
+    """FakeInterface that wakes waiters on input changes, like the pigpio,
+    Arduino stream and comedi poller interfaces do."""
+
+    def __init__(self):
+        super(EdgeInterface, self).__init__()
+        self.cond = threading.Condition()
+        self.edge_times = {}
+        self.waits = 0
+
+    def set(self, channel, value):
+        with self.cond:
+            self.values[channel] = value
+            self.edge_times[(channel, value)] = datetime.datetime.now()
+            self.cond.notify_all()
+
+    def _last_edge(self, channel, level=True, **kwargs):
+        return self.edge_times.get((channel, level))
+
+    def _wait_any(self, targets, timeout=None, window=0.0, ignore_held=False):
+        self.waits += 1
+        (params, level), = targets
+        with self.cond:
+            if self.cond.wait_for(lambda: self.values.get(params['channel'], False) == level,
+                                  timeout):
+                return [(0, datetime.datetime.now())]
+        return []
+
+
+class TestHopperEvents(unittest.TestCase):
+
+    def test_down_returns_when_beam_clears(self):
+        iface = FakeInterface()
+        hopper = Hopper(IR=make_bool_input(iface, 5), solenoid=make_bool_output(iface, 1),
+                        max_lag=1.0)
+        iface.values[5] = True
+        threading.Timer(0.05, iface.values.__setitem__, (5, False)).start()
+        start = time.time()
+        time_down, latency = hopper.down(return_latency=True)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertGreaterEqual(latency, 0.04)
+        self.assertEqual(hopper.down_latency, latency)
+
+    def test_up_wakes_on_edge(self):
+        iface = EdgeInterface()
+        hopper = Hopper(IR=make_bool_input(iface, 5), servo=make_pwm_output(iface, 0),
+                        up_angle=45, down_angle=10, max_lag=1.0)
+        threading.Timer(0.05, iface.set, (5, True)).start()
+        time_up, latency = hopper.up(return_latency=True)
+        self.assertEqual(iface.waits, 1)
+        self.assertEqual(time_up, iface.edge_times[(5, True)])
+        self.assertGreaterEqual(latency, 0.04)
+
+    def test_wait_for_times_out(self):
+        iface = FakeInterface()
+        self.assertIsNone(make_bool_input(iface, 5).wait_for(True, timeout=0.02))
+        iface.values[5] = True
+        self.assertIsInstance(make_bool_input(iface, 5).wait_for(True, timeout=0.02),
+                              datetime.datetime)
+
+
+class TestHopperLatency(unittest.TestCase):
+
+    def _hopper(self, iface, max_lag=1.0):
+        return Hopper(IR=make_bool_input(iface, 5), solenoid=make_bool_output(iface, 1),
+                      max_lag=max_lag)
+
+    def test_histogram_percentile_and_roundtrip(self):
+        hist = LatencyHistogram(bin_width=0.01, max_latency=1.0)
+        for latency in [0.101] * 98 + [0.5, 5.0]:
+            hist.add(latency)
+        self.assertAlmostEqual(hist.percentile(50.0), 0.11)
+        self.assertAlmostEqual(hist.percentile(99.0), 0.51)
+        self.assertAlmostEqual(hist.percentile(100.0), 1.01)
+        copy = LatencyHistogram.from_dict(json.loads(json.dumps(hist.to_dict())))
+        self.assertEqual(copy.counts, hist.counts)
+
+    def test_moves_are_recorded_and_saved(self):
+        iface = FakeInterface()
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'latency.json')
+            hopper = self._hopper(iface)
+            hopper.track_latency(path=path)
+            iface.values[5] = True
+            hopper.up()
+            threading.Timer(0.02, iface.values.__setitem__, (5, False)).start()
+            hopper.down()
+            hopper.down()  # already down: not a move
+            self.assertEqual(hopper.latency['up'].count(), 1)
+            self.assertEqual(hopper.latency['down'].count(), 1)
+            reloaded = self._hopper(iface)
+            reloaded.track_latency(path=path)
+            self.assertEqual(reloaded.latency['up'].count(), 1)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_auto_max_lag(self):
+        iface = FakeInterface()
+        hopper = self._hopper(iface, max_lag=1.0)
+        for direction in ('up', 'down'):
+            for _ in range(20):
+                hopper.latency[direction].add(0.2)
+        hopper.track_latency(auto_max_lag=True, margin=1.5)
+        self.assertAlmostEqual(hopper.max_lag, 0.3075)
+        hopper.latency['up'].add(1.5)
+        hopper.track_latency(auto_max_lag=True, percentile=100.0)
+        self.assertEqual(hopper.max_lag, 1.0)  # never above the configured max_lag
+        hopper.track_latency()
+        self.assertEqual(hopper.max_lag, 1.0)
+
+
 # ---------------------------------------------------------------------------
 # Hopper: feed()
 # ---------------------------------------------------------------------------
 
+class TestAsyncConsequences(unittest.TestCase):
+
+    def test_feed_async_returns_future(self):
+        iface = FakeInterface()
+        hopper = Hopper(IR=make_bool_input(iface, 5), solenoid=make_bool_output(iface, 1),
+                        max_lag=0.05)
+        hopper.up = Mock(return_value=datetime.datetime.now())
+        hopper.down = Mock(return_value=datetime.datetime.now())
+        start = time.time()
+        future = hopper.feed_async(dur=0.1)
+        self.assertLess(time.time() - start, 0.05)
+        self.assertFalse(future.done())
+        feed_time, feed_duration = future.result(timeout=1.0)
+        self.assertIsInstance(feed_time, datetime.datetime)
+
+    def test_feed_async_errors_come_back(self):
+        iface = FakeInterface()
+        hopper = Hopper(IR=make_bool_input(iface, 5), solenoid=make_bool_output(iface, 1),
+                        max_lag=0.02)
+        future = hopper.reward_async(value=0.1)
+        with self.assertRaises(HopperWontComeUpError):
+            future.result(timeout=1.0)
+
+    def test_timeout_async(self):
+        iface = FakeInterface()
+        light = HouseLight(light=make_bool_output(iface, 2))
+        future = light.punish_async(value=0.05)
+        timeout_time, duration = future.result(timeout=1.0)
+        self.assertGreaterEqual(duration.total_seconds(), 0.05)
+        self.assertTrue(iface.values[2])
+
+
 class TestHopperFeed(unittest.TestCase):
 
     def setUp(self):
@@ -276,6 +448,568 @@ class TestPeckPortStatus(unittest.TestCase):
         iface.values[6] = True
         self.assertFalse(port.status())
 
+    def test_peck_time_uses_captured_edge(self):
+        iface = FakeInterface()
+        edge_time = datetime.datetime.now()
+        iface._last_edge = lambda level=True, **kwargs: edge_time
+        port = self._make_port(iface, 6, inverted=False)
+        self.assertEqual(port.peck_time(), edge_time)
+
+    def test_peck_time_not_before_since(self):
+        iface = FakeInterface()
+        iface._last_edge = lambda level=True, **kwargs: datetime.datetime(2000, 1, 1)
+        port = self._make_port(iface, 6, inverted=False)
+        since = datetime.datetime.now()
+        self.assertEqual(port.peck_time(since=since), since)
+
+
+# ---------------------------------------------------------------------------
+# BooleanInput debounce
+# ---------------------------------------------------------------------------
+
+class TestDebouncer(unittest.TestCase):
+
+    def test_short_pulse_is_filtered(self):
+        deb = hwio.Debouncer(min_high=0.01, min_low=0.01)
+        self.assertFalse(deb.update(False, now=0.0))
+        self.assertFalse(deb.update(True, now=0.001))
+        self.assertFalse(deb.update(False, now=0.005))
+        self.assertFalse(deb.update(True, now=0.006))
+        self.assertTrue(deb.update(True, now=0.017))
+
+    def test_asymmetric_durations(self):
+        deb = hwio.Debouncer(min_high=0.0, min_low=0.5)
+        deb.update(False, now=0.0)
+        self.assertTrue(deb.update(True, now=0.1))
+        self.assertTrue(deb.update(False, now=0.2))
+        self.assertFalse(deb.update(False, now=0.8))
+
+    def test_input_without_hardware_filter_uses_software(self):
+        iface = FakeInterface()
+        ir = hwio.BooleanInput(interface=iface, params={'channel': 5}, min_high=10.0)
+        self.assertIsNotNone(ir.debouncer)
+        ir.read()
+        iface.values[5] = True
+        self.assertFalse(ir.read())
+
+    def test_rare_read_sees_a_held_level(self):
+        deb = hwio.Debouncer(min_high=0.05, min_low=0.05)
+        self.assertFalse(deb.update(False, now=0.0))
+        # the input went True some time in the last second
+        self.assertTrue(deb.update(True, now=1.0))
+
+    def test_glitch_between_rare_reads_is_filtered(self):
+        deb = hwio.Debouncer(min_high=0.05, min_low=0.05)
+        deb.update(False, now=0.0)
+        self.assertFalse(deb.update(True, now=1.0, since=0.99))
+        self.assertTrue(deb.update(True, now=1.05, since=0.99))
+
+    def test_input_times_filter_from_captured_edges(self):
+        iface = EdgeInterface()
+        ir = hwio.BooleanInput(interface=iface, params={'channel': 5},
+                               min_high=0.05, min_low=0.05)
+        self.assertFalse(ir.read())
+        iface.set(5, True)
+        self.assertFalse(ir.read())
+        iface.edge_times[(5, True)] -= datetime.timedelta(seconds=1)
+        self.assertTrue(ir.read())
+
+    def test_hardware_filter_replaces_software(self):
+        iface = FakeInterface()
+        iface._config_debounce = lambda min_high, min_low, **kwargs: (min_high, min_low)
+        ir = hwio.BooleanInput(interface=iface, params={'channel': 5},
+                               min_high=0.01, min_low=0.01)
+        self.assertIsNone(ir.debouncer)
+
+
+# ---------------------------------------------------------------------------
+# BooleanInputBank / PeckPortBank
+# ---------------------------------------------------------------------------
+
+class BankInterface(FakeInterface):
+    """FakeInterface that can read many channels in one call."""
+
+    def __init__(self):
+        super(BankInterface, self).__init__()
+        self.bank_reads = 0
+
+    def _read_bank(self, params_list):
+        self.bank_reads += 1
+        return [self.values.get(p['channel'], False) for p in params_list]
+
+
+class TestBooleanInputBank(unittest.TestCase):
+
+    def test_list_read_uses_one_bank_call(self):
+        iface = BankInterface()
+        bank = hwio.BooleanInputBank([make_bool_input(iface, ch) for ch in (5, 6, 13)])
+        iface.values.update({6: True})
+        self.assertEqual(bank.read(), [False, True, False])
+        self.assertEqual(iface.bank_reads, 1)
+
+    def test_dict_read_and_mask(self):
+        iface = BankInterface()
+        bank = hwio.BooleanInputBank({'a': make_bool_input(iface, 5),
+                                      'b': make_bool_input(iface, 6)})
+        iface.values.update({5: True})
+        self.assertEqual(bank.read(), {'a': True, 'b': False})
+        self.assertEqual(bank.read_mask(), 0b01)
+
+    def test_falls_back_to_single_reads(self):
+        iface = FakeInterface()
+        bank = hwio.BooleanInputBank([make_bool_input(iface, 5), make_bool_input(iface, 6)])
+        iface.values.update({5: True})
+        self.assertEqual(bank.read(), [True, False])
+
+
+class BankWriteInterface(FakeInterface):
+    """FakeInterface that can write many channels in one call."""
+
+    def __init__(self):
+        super(BankWriteInterface, self).__init__()
+        self.bank_writes = []
+
+    def _write_bool_bank(self, params_list, values):
+        self.bank_writes.append(list(zip([p['channel'] for p in params_list], values)))
+        for params, value in zip(params_list, values):
+            self.values[params['channel']] = value
+        return values
+
+
+class TestOutputGroup(unittest.TestCase):
+
+    def test_list_write_uses_one_bank_call(self):
+        iface = BankWriteInterface()
+        group = hwio.OutputGroup([make_bool_output(iface, ch) for ch in (16, 20, 21)])
+        group.write([True, False, True])
+        self.assertEqual(iface.bank_writes, [[(16, True), (20, False), (21, True)]])
+        self.assertEqual(group.read(), [True, False, True])
+
+    def test_dict_write_leaves_other_outputs_alone(self):
+        iface = BankWriteInterface()
+        group = hwio.OutputGroup({'a': make_bool_output(iface, 16),
+                                  'b': make_bool_output(iface, 20)})
+        group.write({'b': True})
+        self.assertEqual(iface.bank_writes, [[(20, True)]])
+        self.assertEqual(group.read(), {'a': None, 'b': True})
+
+    def test_scalar_write_and_fallback(self):
+        iface = FakeInterface()
+        pwm = make_pwm_output(iface, 4)
+        group = hwio.OutputGroup([make_bool_output(iface, 16), pwm])
+        group.write(False)
+        self.assertEqual(iface.values, {16: False, 4: False})
+
+    def test_changed_only_skips_outputs_already_there(self):
+        iface = BankWriteInterface()
+        group = hwio.OutputGroup([make_bool_output(iface, ch) for ch in (16, 20, 21)])
+        group.write([True, False, False])
+        group.write([True, True, False], changed_only=True)
+        group.write([True, True, False], changed_only=True)
+        self.assertEqual(iface.bank_writes[1:], [[(20, True)]])
+
+    def test_rgb_light_writes_colors_together(self):
+        iface = BankWriteInterface()
+        light = RGBLight(red=make_bool_output(iface, 1), green=make_bool_output(iface, 2),
+                         blue=make_bool_output(iface, 3))
+        self.assertTrue(light.green())
+        self.assertEqual(iface.bank_writes, [[(1, False), (2, True), (3, False)]])
+
+
+class PWMBankInterface(FakeInterface):
+    """FakeInterface that can write many PWM channels in one call."""
+
+    def __init__(self):
+        super(PWMBankInterface, self).__init__()
+        self.bank_writes = []
+
+    def _write_pwm_bank(self, params_list, values):
+        self.bank_writes.append(dict(zip([p['channel'] for p in params_list], values)))
+        return values
+
+
+class TestLEDStripHouseLight(unittest.TestCase):
+
+    def test_on_and_off_are_one_bank_write_each(self):
+        iface = PWMBankInterface()
+        light = LEDStripHouseLight(lights=[make_pwm_output(iface, ch) for ch in (0, 1, 2, 3)],
+                                   color=[100.0, 50.0, 0.0, 25.0])
+        light.on()
+        light.off()
+        # channel 2 is already at 0.0 and is left alone
+        self.assertEqual(iface.bank_writes, [{0: 100.0, 1: 50.0, 3: 25.0},
+                                             {0: 0.0, 1: 0.0, 3: 0.0}])
+
+    def test_on_when_already_on_writes_nothing(self):
+        iface = PWMBankInterface()
+        light = LEDStripHouseLight(lights=[make_pwm_output(iface, ch) for ch in (0, 1, 2, 3)])
+        light.on()
+        light.on()
+        self.assertEqual(len(iface.bank_writes), 1)
+
+
+class StatePanel(panels.BasePanel):
+
+    def __init__(self):
+        super(StatePanel, self).__init__()
+        self.gpio = BankWriteInterface()
+        self.pwm = PWMBankInterface()
+        self.center = PeckPort(IR=make_bool_input(self.gpio, 2), LED=make_bool_output(self.gpio, 16),
+                               registry=self.registry)
+        self.house_light = LEDStripHouseLight(lights=[make_pwm_output(self.pwm, ch) for ch in (0, 1, 2, 3)],
+                                              color=[100.0, 100.0, 100.0, 0.0], registry=self.registry)
+        self.cue = RGBLight(red=make_pwm_output(self.pwm, 13), green=make_pwm_output(self.pwm, 14),
+                            blue=make_pwm_output(self.pwm, 15), registry=self.registry)
+        self.hopper = Hopper(IR=make_bool_input(self.gpio, 5), solenoid=make_bool_output(self.gpio, 17),
+                             max_lag=0.1)
+
+
+class TestApplyState(unittest.TestCase):
+
+    def test_one_write_per_interface(self):
+        panel = StatePanel()
+        panel.apply_state({'center': True, 'house_light': True, 'cue': 'green'})
+        self.assertEqual(panel.gpio.bank_writes, [[(16, True)]])
+        self.assertEqual(panel.pwm.bank_writes, [{0: 100.0, 1: 100.0, 2: 100.0, 14: True}])
+
+    def test_only_differences_are_written(self):
+        panel = StatePanel()
+        panel.apply_state({'center': True, 'cue': 'green'})
+        panel.apply_state({'center': True, 'cue': 'red'})
+        self.assertEqual(panel.gpio.bank_writes, [[(16, True)]])
+        self.assertEqual(panel.pwm.bank_writes[-1], {13: True, 14: False})
+
+    def test_hopper_moves_after_the_write(self):
+        panel = StatePanel()
+        panel.gpio.values[5] = True  # beam breaks as soon as it's asked
+        before = datetime.datetime.now()
+        effective = panel.apply_state({'hopper': 'up', 'center': False})
+        self.assertGreaterEqual(effective, before)
+        self.assertTrue(panel.gpio.values[17])
+        with patch.object(panel.hopper, 'up') as up:
+            panel.apply_state({'hopper': 'up'})
+            up.assert_not_called()
+
+    def test_abandoned_apply_keeps_ramp_and_color(self):
+        panel = StatePanel()
+        fader = hwio.Fader(tick=0.005)
+        self.addCleanup(fader.stop)
+        panel.house_light._fader = fader
+        fade = panel.house_light.ramp(duration=5.0)
+        with self.assertRaises(ValueError):
+            panel.apply_state({'house_light': [50.0, 0.0, 0.0, 0.0], 'cue': 'purple'})
+        self.assertIs(panel.house_light.ramping(), fade)
+        self.assertEqual(panel.house_light.color, [100.0, 100.0, 100.0, 0.0])
+        panel.apply_state({'house_light': [50.0, 0.0, 0.0, 0.0]})
+        self.assertTrue(fade.done())
+        self.assertEqual(panel.house_light.color, [50.0, 0.0, 0.0, 0.0])
+        self.assertEqual(panel.house_light._group.read(), [50.0, 0.0, 0.0, 0.0])
+
+    def test_components_without_state_use_methods(self):
+        panel = StatePanel()
+        panel.light = Mock(spec=['on', 'off'])
+        panel.apply_state({'light': False, 'cue': 'off'})
+        panel.light.off.assert_called_once_with()
+        with self.assertRaises(ValueError):
+            panel.apply_state({'cue': 'purple'})
+
+
+class TestOutputRegistry(unittest.TestCase):
+
+    def test_panel_snapshot_and_batched_restore(self):
+        panel = StatePanel()
+        panel.apply_state({'center': True, 'house_light': True})
+        snapshot = panel.snapshot()
+        panel.apply_state({'center': False, 'house_light': False, 'cue': 'red'})
+        del panel.gpio.bank_writes[:], panel.pwm.bank_writes[:]
+        panel.restore(snapshot)
+        self.assertEqual(panel.gpio.bank_writes, [[(16, True)]])
+        self.assertEqual(panel.pwm.bank_writes, [{0: 100.0, 1: 100.0, 2: 100.0, 13: 0.0}])
+
+    def test_components_register_their_outputs(self):
+        panel = StatePanel()
+        aux = make_bool_output(panel.gpio, 18)
+        panel.register(aux, panel.center.LED)
+        # port LED, 4 house light and 3 cue channels, then the AUX output
+        self.assertEqual(panel.registry.outputs[0], panel.center.LED)
+        self.assertEqual(len(panel.registry.outputs), 9)
+        self.assertIs(panel.registry.outputs[-1], aux)
+        self.assertNotIn(panel.hopper.solenoid, panel.registry)
+
+    def test_toggle_uses_last_written_value(self):
+        iface = FakeInterface()
+        output = make_bool_output(iface, 16)
+        output.write(True)
+        with patch.object(iface, '_read_bool') as read:
+            output.toggle()
+            read.assert_not_called()
+        self.assertFalse(iface.values[16])
+
+    def test_timeout_restores_what_was_showing(self):
+        iface = PWMBankInterface()
+        light = LEDStripHouseLight(lights=[make_pwm_output(iface, ch) for ch in (0, 1, 2, 3)],
+                                   color=[100.0, 100.0, 100.0, 100.0])
+        light._group.write([10.0, 0.0, 0.0, 0.0])
+        with patch('pyoperant.utils.wait'):
+            light.timeout(dur=1.0)
+        self.assertEqual(light._group.read(), [10.0, 0.0, 0.0, 0.0])
+        self.assertEqual(iface.bank_writes[-1], {0: 10.0})
+
+
+class TestFader(unittest.TestCase):
+
+    def setUp(self):
+        self.iface = PWMBankInterface()
+        self.fader = hwio.Fader(tick=0.005)
+        self.light = LEDStripHouseLight(lights=[make_pwm_output(self.iface, ch) for ch in (0, 1, 2, 3)],
+                                        color=[100.0, 100.0, 100.0, 0.0], fader=self.fader)
+
+    def tearDown(self):
+        self.fader.stop()
+
+    def test_ramp_interpolates_without_blocking(self):
+        start = time.time()
+        fade = self.light.ramp(duration=0.1)
+        self.assertLess(time.time() - start, 0.05)
+        self.assertTrue(fade.wait(1.0))
+        writes = self.iface.bank_writes[1:]
+        self.assertGreater(len(writes), 3)
+        self.assertEqual(writes[-1], {0: 100.0, 1: 100.0, 2: 100.0, 3: 0.0})
+        reds = [w[0] for w in writes]
+        self.assertEqual(reds, sorted(reds))
+        self.assertIsNone(self.light.ramping())
+
+    def test_on_keeps_ramp_heading_on(self):
+        fade = self.light.ramp(duration=0.2)
+        self.light.on()
+        self.assertIs(self.light.ramping(), fade)
+        time.sleep(0.05)
+        self.light.off()
+        self.assertTrue(fade.done())
+        self.assertEqual(self.iface.bank_writes[-1], {0: 0.0, 1: 0.0, 2: 0.0})
+
+    def test_timeout_picks_ramp_back_up(self):
+        fade = self.light.ramp(duration=0.3)
+        time.sleep(0.05)
+        self.light.timeout(dur=0.1)
+        resumed = self.light.ramping()
+        self.assertIsNotNone(resumed)
+        self.assertIsNot(resumed, fade)
+        self.assertEqual(resumed.target, [100.0, 100.0, 100.0, 0.0])
+        # part way along, not back where the timeout began
+        self.assertGreater(self.light._group.read()[0], 40.0)
+        self.assertTrue(resumed.wait(1.0))
+        self.assertEqual(self.light._group.read(), [100.0, 100.0, 100.0, 0.0])
+
+    def test_unchanged_values_are_not_rewritten(self):
+        self.light.on()
+        del self.iface.bank_writes[:]
+        self.light.ramp(duration=0.05).wait(1.0)
+        self.assertEqual(len(self.iface.bank_writes), 2)
+
+
+class TestBlinkScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.iface = FakeInterface()
+        self.scheduler = hwio.BlinkScheduler(tick=0.002)
+        self.writes = []
+        original = self.iface._write_bool
+
+        def record(value, channel, **kwargs):
+            self.writes.append((channel, value))
+            return original(value, channel, **kwargs)
+        self.iface._write_bool = record
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def _port(self, channel):
+        return PeckPort(IR=make_bool_input(self.iface, 20 + channel),
+                        LED=make_bool_output(self.iface, channel),
+                        scheduler=self.scheduler)
+
+    def test_repeat_count(self):
+        led = make_bool_output(self.iface, 7)
+        del self.writes[:]
+        blink = self.scheduler.blink(led, period=0.01, repeat=3)
+        self.assertTrue(blink.wait(1.0))
+        self.assertEqual([v for ch, v in self.writes], [True, False] * 3 + [False])
+
+    def test_one_thread_runs_many_patterns(self):
+        ports = [self._port(ch) for ch in (1, 2, 3)]
+        blinks = [port.blink(period=0.01, duration=0.05) for port in ports]
+        self.assertTrue(all(b.wait(1.0) for b in blinks))
+        for ch in (1, 2, 3):
+            self.assertGreater(len([w for w in self.writes if w[0] == ch]), 4)
+        self.assertEqual(len([t for t in threading.enumerate() if t.name == 'BlinkScheduler']), 1)
+
+    def test_flash_restores_led_without_blocking(self):
+        port = self._port(4)
+        port.on()
+        start = time.time()
+        port.flash(dur=0.05, isi=0.005, block=False)
+        self.assertLess(time.time() - start, 0.02)
+        self.assertTrue(port.scheduler.blinking(port).wait(1.0))
+        self.assertTrue(self.iface.values[4])
+
+    def test_blocking_flash(self):
+        port = self._port(4)
+        flash_time, flash_duration = port.flash(dur=0.03, isi=0.005)
+        self.assertGreaterEqual(flash_duration.total_seconds(), 0.03)
+        self.assertFalse(self.iface.values[4])
+
+    def test_cancel_turns_off(self):
+        port = self._port(5)
+        blink = port.blink(period=0.01)
+        time.sleep(0.02)
+        blink.cancel()
+        self.assertTrue(blink.done())
+        self.assertFalse(self.iface.values[5])
+
+    def test_rgb_blink(self):
+        iface = BankWriteInterface()
+        light = RGBLight(red=make_bool_output(iface, 1), green=make_bool_output(iface, 2),
+                         blue=make_bool_output(iface, 3), scheduler=self.scheduler)
+        light.blink('blue', period=0.01, repeat=2).wait(1.0)
+        self.assertEqual(iface.bank_writes[0], [(1, False), (2, False), (3, True)])
+        self.assertEqual(iface.bank_writes[-1], [(1, False), (2, False), (3, False)])
+
+
+class TestPeckPortBank(unittest.TestCase):
+
+    def test_status_applies_inversion(self):
+        iface = BankInterface()
+        left = PeckPort(IR=make_bool_input(iface, 6), LED=make_pwm_output(iface, 4), name='l')
+        right = PeckPort(IR=make_bool_input(iface, 26), LED=make_pwm_output(iface, 6),
+                         name='r', inverted=True)
+        iface.values.update({6: True, 26: True})
+        bank = PeckPortBank({'L': left, 'R': right})
+        self.assertEqual(bank.status(), {'L': True, 'R': False})
+        self.assertEqual(iface.bank_reads, 1)
+
+
+class TestPortSelector(unittest.TestCase):
+
+    def _make_ports(self, iface):
+        left = PeckPort(IR=make_bool_input(iface, 6), LED=make_pwm_output(iface, 4), name='l')
+        right = PeckPort(IR=make_bool_input(iface, 26), LED=make_pwm_output(iface, 6), name='r')
+        return {'L': left, 'R': right}
+
+    def test_pecks_reports_a_break_between_reads(self):
+        iface = EdgeInterface()
+        port = PeckPort(IR=make_bool_input(iface, 2), LED=make_bool_output(iface, 16))
+        selector = PortSelector({'c': port})
+        deadline = time.time() + 0.3
+
+        def short_peck():
+            # too short for a read of the beam to see it
+            iface.set(2, True)
+            iface.set(2, False)
+        threading.Timer(0.05, short_peck).start()
+        pecks = list(selector.pecks(lambda: time.time() > deadline, timeout=0.02))
+        self.assertEqual([p.name for p in pecks], ['c'])
+
+    def test_polled_select_returns_first_port(self):
+        iface = FakeInterface()
+        selector = PortSelector(self._make_ports(iface), poll_interval=0.001)
+        iface.values[26] = True
+        selection = selector.select(timeout=0.1)
+        self.assertEqual(selection.name, 'R')
+        self.assertIsInstance(selection.time, datetime.datetime)
+
+    def test_polled_select_times_out(self):
+        iface = FakeInterface()
+        selector = PortSelector(self._make_ports(iface), poll_interval=0.001)
+        self.assertIsNone(selector.select(timeout=0.02))
+
+    def test_polled_select_ignores_held_beam(self):
+        iface = FakeInterface()
+        selector = PortSelector(self._make_ports(iface), poll_interval=0.001)
+        iface.values[6] = True
+        self.assertIsNone(selector.select(timeout=0.02, ignore_held=True))
+
+    def test_event_select_uses_interface(self):
+        iface = FakeInterface()
+        calls = []
+
+        def wait_any(targets, timeout=None, window=0.0, ignore_held=False):
+            calls.append(targets)
+            now = datetime.datetime.now()
+            return [(1, now), (0, now)]
+        iface._wait_any = wait_any
+        selector = PortSelector(self._make_ports(iface), window=0.05)
+        selection = selector.select(timeout=1.0)
+        self.assertEqual(selection.name, 'R')
+        self.assertEqual(list(selection.coincident), ['L'])
+        self.assertEqual(len(calls), 1)
+
+
+class TestInputSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'inputs')
+        self.iface = BankInterface()
+        self.inputs = {'left': make_bool_input(self.iface, 6),
+                       'right': make_bool_input(self.iface, 26)}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_records_levels_with_times(self):
+        sampler = hwio.InputSampler(self.inputs, self.path, rate=500.0, length=1000)
+        sampler.start()
+        time.sleep(0.05)
+        self.iface.values[26] = True
+        time.sleep(0.05)
+        sampler.stop()
+        reader = sampler.reader()
+        samples = reader.latest(reader.count())
+        self.assertGreater(len(samples), 10)
+        self.assertTrue((samples['time'][1:] >= samples['time'][:-1]).all())
+        right = reader.level('right', samples)
+        self.assertFalse(right[0])
+        self.assertTrue(right[-1])
+        self.assertFalse(reader.level('left', samples).any())
+
+    def test_records_raw_levels(self):
+        debounced = hwio.BooleanInput(interface=self.iface, params={'channel': 6}, min_high=10.0)
+        self.assertFalse(debounced.read())
+        self.iface.values[6] = True
+        sampler = hwio.InputSampler({'left': debounced}, self.path, rate=500.0, length=1000)
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+        reader = sampler.reader()
+        self.assertTrue(reader.level('left', reader.latest(reader.count())).all())
+        # the behavior side's filter wasn't fed by the sampler
+        self.assertIsNone(debounced.debouncer._pending)
+
+    def test_ring_buffer_wraps(self):
+        sampler = hwio.InputSampler(self.inputs, self.path, rate=1000.0, length=16)
+        sampler.start()
+        time.sleep(0.1)
+        sampler.stop()
+        reader = hwio.InputSampleReader(self.path)
+        self.assertGreater(reader.count(), 16)
+        samples = reader.latest(100)
+        self.assertEqual(len(samples), 16)
+        self.assertTrue((samples['time'][1:] > samples['time'][:-1]).all())
+
+    def test_between_selects_time_range(self):
+        sampler = hwio.InputSampler(self.inputs, self.path, rate=500.0, length=1000)
+        sampler.start()
+        time.sleep(0.05)
+        start = datetime.datetime.now()
+        time.sleep(0.05)
+        end = datetime.datetime.now()
+        time.sleep(0.05)
+        sampler.stop()
+        samples = sampler.reader().between(start, end)
+        self.assertGreater(len(samples), 0)
+        self.assertLess(len(samples), sampler.reader().count())
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -21,10 +21,12 @@ been built. PlacePrefExp (the non-24hr version) has been removed --
 confirmed superseded by PlacePrefExp24hr, not something to migrate.
 """
 
+import datetime as dt
 import json
 import os
 import sys
 import tempfile
+import time
 import unittest
 from unittest.mock import patch, MagicMock
 
@@ -137,5 +139,123 @@ class TestLights(unittest.TestCase):
             self.assertEqual(panel.reset_calls, 1)
 
 
+class TestSleepTransition(unittest.TestCase):
+    """BaseExp and its Shaper switch or fade the house light the same way."""
+
+    def test_shaper_and_exp_share_transition(self):
+        config = _load_config("Lights")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = prepare_experiment_dirs(config, tmp_dir)
+            panel = FakePanel()
+            exp = Lights(panel=panel, **config)
+            exp.shaper.sleep_pre()
+            exp.sleep_pre()
+            self.assertEqual(panel.house_light.calls, ["off", "off"])
+
+            panel.house_light = MagicMock(spec=["on", "off", "ramp"])
+            exp.parameters["light_ramp"] = 60
+            exp.shaper.sleep_post()
+            exp.sleep_post()
+        self.assertEqual(panel.house_light.ramp.call_count, 2)
+        panel.house_light.on.assert_not_called()
+
+
+class TestInputSampler(unittest.TestCase):
+    """BaseExp.run() stops the sampler it started, however it ends."""
+
+    def test_sampler_stopped_when_run_ends(self):
+        config = _load_config("Lights")
+        config["input_sampler"] = {"rate": 100.0, "seconds": 1}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = prepare_experiment_dirs(config, tmp_dir)
+            panel = FakePanel()
+            panel.sampler = MagicMock()
+            exp = Lights(panel=panel, **config)
+            sampler = panel.sampler
+            with patch.object(panel, "start_sampler"), \
+                    patch("pyoperant.utils.run_state_machine", side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    exp.run()
+        sampler.stop.assert_called_once_with()
+        self.assertIsNone(panel.sampler)
+
+
+class ScriptedPort(object):
+    """Peck port whose beam reads True from `broken_at` seconds on."""
+
+    def __init__(self, name, broken_at=None):
+        self.name = name
+        self.start = time.time()
+        self.broken_at = broken_at
+
+    def status(self):
+        return self.broken_at is not None and time.time() - self.start >= self.broken_at
+
+    def peck_time(self, since=None):
+        return dt.datetime.now()
+
+
+class CountedPort(ScriptedPort):
+    """Peck port whose beam reads True from its `broken_from`th read on."""
+
+    def __init__(self, name, broken_from):
+        super(CountedPort, self).__init__(name)
+        self.reads = 0
+        self.broken_from = broken_from
+
+    def status(self):
+        self.reads += 1
+        return self.reads >= self.broken_from
+
+
+class TestRunConsequence(unittest.TestCase):
+    """BaseExp.run_consequence records pecks while a consequence runs."""
+
+    def test_pecks_during_consequence(self):
+        config = _load_config("Lights")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = prepare_experiment_dirs(config, tmp_dir)
+            exp = Lights(panel=FakePanel(), **config)
+            pecks = []
+
+            def consequence(value):
+                time.sleep(value)
+                return 'done'
+            ports = {'left': ScriptedPort('left', broken_at=0.05),
+                     'right': ScriptedPort('right')}
+            result = exp.run_consequence(consequence, 0.2, ports=ports,
+                                         on_peck=pecks.append, poll_interval=0.01)
+        self.assertEqual(result, 'done')
+        self.assertEqual([p.name for p in pecks], ['left'])
+
+    def test_peck_at_window_boundary_is_counted_once(self):
+        config = _load_config("Lights")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = prepare_experiment_dirs(config, tmp_dir)
+            exp = Lights(panel=FakePanel(), **config)
+            pecks = []
+
+            def consequence(value):
+                time.sleep(value)
+            # the beam breaks on the first read of a wait and stays broken
+            # across the waits that follow; the held port was broken before
+            ports = {'left': CountedPort('left', broken_from=3),
+                     'held': CountedPort('held', broken_from=1)}
+            exp.run_consequence(consequence, 0.2, ports=ports,
+                                on_peck=pecks.append, poll_interval=0.01)
+        self.assertEqual([p.name for p in pecks], ['left'])
+
+    def test_errors_are_raised(self):
+        config = _load_config("Lights")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = prepare_experiment_dirs(config, tmp_dir)
+            exp = Lights(panel=FakePanel(), **config)
+
+            def consequence(value):
+                raise ValueError(value)
+            with self.assertRaises(ValueError):
+                exp.run_consequence(consequence, 1.0, ports={'left': ScriptedPort('left')})
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,1174 @@
+# -*- coding: utf-8 -*-
+"""
+Unit tests for interface-level plumbing (edge capture, bank I/O, PCA9685
+driver, Arduino serial protocol) that can run without hardware.
+
+pigpio is replaced by FakePi below, which records every call and lets a
+test inject GPIO edges the way pigpio's callback thread would. The serial
+port is replaced by FakeArduino, which speaks the operant_serial firmware
+protocol.
+"""
+
+import datetime
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeCallback(object):
+    def __init__(self, pi, gpio, edge, func):
+        self.pi = pi
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakePi(object):
+    """Minimal stand-in for pigpio.pi() -- GPIO levels, callbacks and I2C."""
+
+    def __init__(self):
+        self.connected = True
+        self.levels = {}
+        self.modes = {}
+        self.callbacks = []
+        self.i2c_writes = []
+        self.registers = {}
+        self.tick = 0
+        self.bank_reads = 0
+        self.bank_writes = []
+        self.glitch_filters = {}
+
+    # GPIO
+    def set_mode(self, gpio, mode):
+        self.modes[gpio] = mode
+
+    def read(self, gpio):
+        return self.levels.get(gpio, 0)
+
+    def write(self, gpio, level):
+        self.levels[gpio] = level
+
+    def set_glitch_filter(self, gpio, steady):
+        self.glitch_filters[gpio] = steady
+
+    def read_bank_1(self):
+        self.bank_reads += 1
+        bits = 0
+        for gpio, level in self.levels.items():
+            if level:
+                bits |= 1 << gpio
+        return bits
+
+    def set_bank_1(self, bits):
+        self.bank_writes.append(('set', bits))
+        for gpio in range(32):
+            if bits & (1 << gpio):
+                self.levels[gpio] = 1
+
+    def clear_bank_1(self, bits):
+        self.bank_writes.append(('clear', bits))
+        for gpio in range(32):
+            if bits & (1 << gpio):
+                self.levels[gpio] = 0
+
+    def callback(self, gpio, edge=0, func=None):
+        cb = FakeCallback(self, gpio, edge, func)
+        self.callbacks.append(cb)
+        return cb
+
+    def get_current_tick(self):
+        return self.tick
+
+    def stop(self):
+        pass
+
+    def edge(self, gpio, level, tick=None):
+        """set a level and fire callbacks the way pigpio's thread would"""
+        self.levels[gpio] = level
+        self.tick = self.tick + 1 if tick is None else tick
+        for cb in self.callbacks:
+            if cb.gpio == gpio and cb.func is not None and not cb.cancelled:
+                cb.func(gpio, level, self.tick)
+
+    # I2C
+    def i2c_open(self, bus, address):
+        return address
+
+    def i2c_close(self, handle):
+        pass
+
+    def i2c_write_byte_data(self, handle, reg, byte):
+        self.i2c_writes.append((handle, reg, [byte]))
+        self.registers[(handle, reg)] = byte
+
+    def i2c_read_byte_data(self, handle, reg):
+        return self.registers.get((handle, reg), 0)
+
+    def i2c_write_i2c_block_data(self, handle, reg, data):
+        self.i2c_writes.append((handle, reg, list(data)))
+        for offset, byte in enumerate(data):
+            self.registers[(handle, reg + offset)] = byte
+
+    def i2c_read_i2c_block_data(self, handle, reg, count):
+        return count, bytearray(self.registers.get((handle, reg + i), 0)
+                                for i in range(count))
+
+
+class FakeArduino(object):
+    """Stand-in for serial.Serial connected to src/operant_serial firmware."""
+
+    def __init__(self, port=None, baudrate=19200, timeout=None, **kwargs):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.is_open = True
+        self.levels = {}
+        self.modes = {}
+        self.commands = []
+        self.writes = []
+        self.hung = False
+        self.broken = False
+        self.streaming = False
+        self._in = bytearray()
+        self._out = bytearray(b'Initialized!\r\n')
+        self._lock = threading.Lock()
+
+    def _reply(self, data):
+        with self._lock:
+            self._out.extend(bytearray(data))
+
+    @staticmethod
+    def micros():
+        return int(time.time() * 1e6) % 2**32
+
+    def _inputs(self):
+        return sorted(p for p, m in self.modes.items() if m in (4, 5))
+
+    def _event(self, pin, micros=None):
+        micros = self.micros() if micros is None else micros
+        self._reply([0xA5, pin, self.levels.get(pin, 0)] + list(bytearray(struct.pack('<I', micros))))
+
+    def _handle(self, pin, action):
+        self.commands.append((pin, action))
+        framing = [0x5A] if self.streaming else []
+        if action == 0:
+            self._reply(framing + ([1] if self.streaming else []) + [self.levels.get(pin, 0)])
+        elif action in (1, 2):
+            self.levels[pin] = 1 if action == 1 else 0
+        elif action in (3, 4, 5):
+            self.modes[pin] = action
+            if action != 3 and self.streaming:
+                self._event(pin)
+        elif action == 6:
+            inputs = self._inputs()
+            n_bytes = max(inputs) // 8 + 1 if inputs else 1
+            bits = [0] * n_bytes
+            for p in inputs:
+                if self.levels.get(p, 0):
+                    bits[p // 8] |= 1 << (p % 8)
+            self._reply(framing + [n_bytes] + bits)
+        elif action == 7:
+            if pin == 1:
+                self.streaming = True
+                for p in self._inputs():
+                    self._event(p)
+            elif self.streaming:
+                self._reply([0x5A, 0])
+                self.streaming = False
+        elif action == 8:
+            self._reply([0xA6] + list(bytearray(struct.pack('<I', self.micros()))))
+
+    def edge(self, pin, level, micros=None):
+        """change an input the way the board would see it"""
+        self.levels[pin] = level
+        if self.streaming:
+            self._event(pin, micros)
+
+    # serial.Serial API
+    def write(self, data):
+        if self.broken:
+            raise sys.modules['serial'].SerialException('device disconnected')
+        self.writes.append(bytes(data))
+        if self.hung:
+            return len(data)
+        self._in.extend(bytearray(data))
+        while len(self._in) >= 2:
+            pin, action = self._in[0], self._in[1]
+            del self._in[:2]
+            self._handle(pin, action)
+        return len(data)
+
+    def read(self, size=1):
+        if self.broken:
+            raise sys.modules['serial'].SerialException('device disconnected')
+        deadline = time.time() + (self.timeout or 0)
+        while True:
+            with self._lock:
+                if len(self._out) >= size or time.time() >= deadline:
+                    data, self._out = bytes(self._out[:size]), self._out[size:]
+                    return data
+            time.sleep(0.001)
+
+    def readline(self):
+        with self._lock:
+            ii = self._out.find(b'\n')
+            if ii < 0:
+                return b''
+            line, self._out = bytes(self._out[:ii + 1]), self._out[ii + 1:]
+            return line
+
+    def inWaiting(self):
+        return len(self._out)
+
+    in_waiting = property(inWaiting)
+
+    def flushInput(self):
+        with self._lock:
+            self._out = bytearray()
+
+    reset_input_buffer = flushInput
+
+    def close(self):
+        self.is_open = False
+
+
+def _install_fake_pigpio():
+    pigpio = types.ModuleType('pigpio')
+    pigpio.INPUT = 0
+    pigpio.OUTPUT = 1
+    pigpio.RISING_EDGE = 0
+    pigpio.FALLING_EDGE = 1
+    pigpio.EITHER_EDGE = 2
+    pigpio.pi = FakePi
+    sys.modules['pigpio'] = pigpio
+    sys.modules.pop('pyoperant.interfaces.raspi_gpio_', None)
+
+
+class FakeComediDevice(object):
+    """One open handle on a comedi device. raw levels are shared by every
+    handle on the device and are active low, like the real boxes."""
+
+    def __init__(self, name, raw, counts):
+        self.name = name
+        self.raw = raw
+        self.counts = counts
+        self.closed = False
+
+
+class FakeComedi(object):
+    """The parts of the comedi module's API ComediInterface uses."""
+
+    COMEDI_INPUT = 0
+    COMEDI_OUTPUT = 1
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.raw = {}
+        self.counts = {}
+
+    def comedi_open(self, name):
+        return FakeComediDevice(name,
+                                self.raw.setdefault(name, {}),
+                                self.counts.setdefault(name, {'bitfield': 0}))
+
+    def comedi_close(self, device):
+        device.closed = True
+        return 0
+
+    def comedi_dio_config(self, device, subdevice, channel, direction):
+        return 1
+
+    def comedi_dio_read(self, device, subdevice, channel):
+        return (1, device.raw.get((subdevice, channel), 1))
+
+    def comedi_dio_write(self, device, subdevice, channel, value):
+        device.raw[(subdevice, channel)] = int(value)
+        return 1
+
+    def comedi_dio_bitfield2(self, device, subdevice, write_mask, bits, base):
+        device.counts['bitfield'] += 1
+        for ii in range(32):
+            if write_mask & (1 << ii):
+                device.raw[(subdevice, base + ii)] = (bits >> ii) & 1
+        v = 0
+        for ii in range(32):
+            if device.raw.get((subdevice, base + ii), 1):
+                v |= 1 << ii
+        return (1, v)
+
+    def activate(self, name, subdevice, channel, active=True):
+        self.raw.setdefault(name, {})[(subdevice, channel)] = 0 if active else 1
+
+
+def _install_fake_comedi():
+    fake = FakeComedi()
+    comedi = types.ModuleType('comedi')
+    for attr in dir(fake):
+        if not attr.startswith('_'):
+            setattr(comedi, attr, getattr(fake, attr))
+    comedi.fake = fake
+    sys.modules['comedi'] = comedi
+    sys.modules.pop('pyoperant.interfaces.comedi_', None)
+
+
+def _install_fake_serial():
+    try:
+        import serial  # noqa: F401
+    except ImportError:
+        serial = types.ModuleType('serial')
+
+        class SerialException(IOError):
+            pass
+        serial.SerialException = SerialException
+        serial.Serial = FakeArduino
+        sys.modules['serial'] = serial
+
+
+_install_fake_pigpio()
+_install_fake_serial()
+_install_fake_comedi()
+
+from pyoperant.interfaces import base_, raspi_gpio_, arduino_, comedi_  # noqa: E402
+from pyoperant import InterfaceError  # noqa: E402
+
+
+def make_raspi(inputs=None):
+    return raspi_gpio_.RaspberryPiInterface(device_name='test',
+                                            inputs=inputs,
+                                            lights_address=0x55,
+                                            servo_address=0x45)
+
+
+def make_arduino(inputs=None, outputs=None, **kwargs):
+    original = arduino_.serial.Serial
+    arduino_.serial.Serial = FakeArduino
+    try:
+        return arduino_.ArduinoInterface('/dev/fake', inputs=inputs, outputs=outputs, **kwargs)
+    finally:
+        arduino_.serial.Serial = original
+
+
+def fire_later(delay, func, *args):
+    t = threading.Timer(delay, func, args)
+    t.start()
+    return t
+
+
+# ---------------------------------------------------------------------------
+# EdgeBuffer
+# ---------------------------------------------------------------------------
+
+class TestEdgeBuffer(unittest.TestCase):
+
+    def test_wait_returns_edge_pushed_after_mark(self):
+        edges = base_.EdgeBuffer()
+        mark = edges.mark()
+        edges.push(5, True)
+        edge = edges.wait({5: True}, since=mark, timeout=0.1)
+        self.assertEqual(edge.channel, 5)
+        self.assertTrue(edge.level)
+
+    def test_wait_ignores_edges_before_mark(self):
+        edges = base_.EdgeBuffer()
+        edges.push(5, True)
+        self.assertIsNone(edges.wait({5: True}, timeout=0.05))
+
+    def test_wait_ignores_wrong_level(self):
+        edges = base_.EdgeBuffer()
+        mark = edges.mark()
+        edges.push(5, False)
+        self.assertIsNone(edges.wait({5: True}, since=mark, timeout=0.05))
+
+    def test_wait_wakes_on_edge_from_other_thread(self):
+        edges = base_.EdgeBuffer()
+        fire_later(0.02, edges.push, 6, True)
+        start = time.time()
+        edge = edges.wait({5: True, 6: True}, timeout=1.0)
+        self.assertEqual(edge.channel, 6)
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_wait_returns_earliest_of_several_channels(self):
+        edges = base_.EdgeBuffer()
+        mark = edges.mark()
+        edges.push(6, True)
+        edges.push(5, True)
+        self.assertEqual(edges.wait({5: True, 6: True}, since=mark).channel, 6)
+
+    def test_buffer_is_bounded(self):
+        edges = base_.EdgeBuffer(maxlen=4)
+        for ii in range(10):
+            edges.push(5, ii % 2)
+        self.assertEqual(len(edges.edges(5)), 4)
+
+    def test_check_can_inject_missed_edge(self):
+        edges = base_.EdgeBuffer()
+        edge = edges.wait({5: True}, timeout=1.0,
+                          check=lambda: edges.push(5, True), check_interval=0.01)
+        self.assertIsNotNone(edge)
+
+
+# ---------------------------------------------------------------------------
+# TickClock
+# ---------------------------------------------------------------------------
+
+class TestTickClock(unittest.TestCase):
+
+    def test_unwraps_32_bit_counter(self):
+        ticks = [2**32 - 1000]
+        clock = base_.TickClock(read_tick=lambda: ticks[0])
+        before = clock.monotonic(2**32 - 1000)
+        after = clock.monotonic(500)  # counter wrapped 1500 us later
+        self.assertAlmostEqual(after - before, 0.0015, places=6)
+
+    def test_older_tick_maps_before_newer_tick(self):
+        clock = base_.TickClock(read_tick=lambda: 10000)
+        self.assertLess(clock.monotonic(9000), clock.monotonic(10000))
+
+    def test_to_datetime_tracks_host_clock(self):
+        clock = base_.TickClock(read_tick=lambda: int(time.time() * 1e6) % 2**32)
+        tick = int(time.time() * 1e6) % 2**32
+        delta = abs((clock.to_datetime(tick) - datetime.datetime.now()).total_seconds())
+        self.assertLess(delta, 0.05)
+
+
+# ---------------------------------------------------------------------------
+# RaspberryPiInterface edge capture
+# ---------------------------------------------------------------------------
+
+class TestRaspberryPiCapture(unittest.TestCase):
+
+    def setUp(self):
+        self.raspi = make_raspi(inputs=[(5,), (6,)])
+        self.pi = self.raspi.pi
+
+    def test_inputs_get_edge_callbacks(self):
+        gpios = [cb.gpio for cb in self.pi.callbacks if cb.edge == sys.modules['pigpio'].EITHER_EDGE]
+        self.assertEqual(sorted(gpios), [5, 6])
+
+    def test_poll_returns_immediately_if_high(self):
+        self.pi.levels[5] = 1
+        self.assertIsInstance(self.raspi._poll(5, timeout=0.5), datetime.datetime)
+
+    def test_poll_returns_on_edge(self):
+        fire_later(0.02, self.pi.edge, 5, 1)
+        start = time.time()
+        result = self.raspi._poll(5, timeout=2.0)
+        self.assertIsInstance(result, datetime.datetime)
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_poll_times_out(self):
+        self.assertIsNone(self.raspi._poll(5, timeout=0.1))
+
+    def test_poll_corrects_missed_edge(self):
+        # level goes high without a callback firing
+        fire_later(0.02, self.pi.levels.__setitem__, 5, 1)
+        self.assertIsNotNone(self.raspi._poll(5, timeout=1.0))
+
+    def test_edge_time_comes_from_tick(self):
+        tick = self.pi.tick
+        self.pi.edge(5, 1, tick=tick + 250000)
+        edge_time = self.raspi._last_edge(5, level=True)
+        expected = self.raspi.clock.to_datetime(tick + 250000)
+        self.assertEqual(edge_time, expected)
+
+    def test_close_cancels_callbacks(self):
+        self.raspi.close()
+        self.assertTrue(all(cb.cancelled for cb in self.pi.callbacks
+                            if cb.edge == sys.modules['pigpio'].EITHER_EDGE))
+
+
+class TestRaspberryPiWaitAny(unittest.TestCase):
+
+    def setUp(self):
+        self.raspi = make_raspi(inputs=[(6,), (26,)])
+        self.pi = self.raspi.pi
+        self.targets = [({'channel': 6}, True), ({'channel': 26}, True)]
+
+    def test_returns_first_edge(self):
+        fire_later(0.02, self.pi.edge, 26, 1)
+        hits = self.raspi._wait_any(self.targets, timeout=1.0)
+        self.assertEqual([ii for ii, t in hits], [1])
+
+    def test_reports_coincident_edges(self):
+        def both():
+            self.pi.edge(26, 1)
+            self.pi.edge(6, 1)
+        fire_later(0.02, both)
+        hits = self.raspi._wait_any(self.targets, timeout=1.0, window=0.05)
+        self.assertEqual([ii for ii, t in hits], [1, 0])
+
+    def test_held_input_returns_immediately_unless_ignored(self):
+        self.pi.levels[6] = 1
+        self.assertEqual([ii for ii, t in self.raspi._wait_any(self.targets, timeout=0.1)], [0])
+        self.assertEqual(self.raspi._wait_any(self.targets, timeout=0.05, ignore_held=True), [])
+
+
+class TestRaspberryPiDebounce(unittest.TestCase):
+
+    def setUp(self):
+        self.raspi = make_raspi(inputs=[(5,)])
+        self.pi = self.raspi.pi
+
+    def test_glitch_filter_gets_shorter_duration(self):
+        done = self.raspi._config_debounce(5, min_high=0.010, min_low=0.004)
+        self.assertEqual(self.pi.glitch_filters[5], 4000)
+        self.assertEqual(done, (0.004, 0.004))
+
+    def test_filtered_read_reports_callback_level(self):
+        self.raspi._config_debounce(5, min_high=0.01, min_low=0.01)
+        self.pi.levels[5] = 1  # raw glitch, filtered out by pigpio: no callback
+        self.assertFalse(self.raspi._read_bool(5))
+        self.pi.edge(5, 1)
+        self.assertTrue(self.raspi._read_bool(5))
+
+    def test_reconcile_ignores_short_disagreement(self):
+        self.raspi._config_debounce(5, min_high=0.2, min_low=0.2)
+        self.pi.levels[5] = 1
+        self.raspi._reconcile(5)
+        self.assertFalse(self.raspi.edges.level(5))
+
+
+class TestRaspberryPiBank(unittest.TestCase):
+
+    def test_read_bank_is_one_call(self):
+        raspi = make_raspi(inputs=[(5,), (6,), (13,)])
+        raspi.pi.levels.update({5: 0, 6: 1, 13: 1})
+        values = raspi._read_bank([{'channel': 5}, {'channel': 6}, {'channel': 13}])
+        self.assertEqual(values, [False, True, True])
+        self.assertEqual(raspi.pi.bank_reads, 1)
+
+    def test_write_bank_clears_then_sets(self):
+        raspi = make_raspi()
+        raspi.pi.levels.update({16: 1})
+        raspi._write_bool_bank([{'channel': 16}, {'channel': 20}, {'channel': 21}],
+                               [False, True, False])
+        self.assertEqual(raspi.pi.bank_writes,
+                         [('clear', (1 << 16) | (1 << 21)), ('set', 1 << 20)])
+        self.assertEqual([raspi.pi.levels[ch] for ch in (16, 20, 21)], [0, 1, 0])
+
+
+# ---------------------------------------------------------------------------
+# PCA9685 PWM shadow registers
+# ---------------------------------------------------------------------------
+
+class TestPWMShadow(unittest.TestCase):
+
+    def setUp(self):
+        self.raspi = make_raspi()
+        self.pi = self.raspi.pi
+        self.pwm = self.raspi.pwm
+        del self.pi.i2c_writes[:]
+
+    def test_repeated_duty_cycle_is_not_written(self):
+        self.pwm.set_duty_cycle(3, 50)
+        self.pwm.set_duty_cycle(3, 50)
+        self.assertEqual(len(self.pi.i2c_writes), 1)
+        self.pwm.set_duty_cycle(3, 100)
+        self.assertEqual(len(self.pi.i2c_writes), 2)
+
+    def test_all_channels_write_updates_cache(self):
+        self.pwm.set_duty_cycle(-1, 100)
+        self.pwm.set_duty_cycle(7, 100)
+        self.assertEqual(len(self.pi.i2c_writes), 1)
+        self.assertEqual(self.pwm.dump()['channels'][7], {'on': 4096, 'off': 0})
+
+    def test_same_frequency_skips_restart(self):
+        self.pwm.set_frequency(1000)
+        self.assertEqual(self.pi.i2c_writes, [])
+        self.pwm.set_frequency(50)
+        self.assertIn(self.pwm._PRESCALE, [reg for h, reg, data in self.pi.i2c_writes])
+
+    def test_sync_reads_chip_state(self):
+        self.pi.i2c_write_i2c_block_data(self.pwm.h, self.pwm._LED0_ON_L + 8, [0, 0, 0, 8])
+        state = self.pwm.sync()
+        self.assertEqual(state['channels'][2], {'on': 0, 'off': 2048})
+        del self.pi.i2c_writes[:]
+        self.pwm.set_duty_cycle(2, 50)
+        self.assertEqual(self.pi.i2c_writes, [])
+
+    def test_consecutive_channels_are_one_block_write(self):
+        self.pwm.set_duty_cycles({4: 100, 5: 0, 6: 50, 7: 25})
+        self.assertEqual(len(self.pi.i2c_writes), 1)
+        handle, reg, data = self.pi.i2c_writes[0]
+        self.assertEqual((reg, len(data)), (self.pwm._LED0_ON_L + 16, 16))
+        self.assertEqual(self.pwm.dump()['channels'][6], {'on': 0, 'off': 2048})
+
+    def test_runs_are_split_at_unknown_gaps_and_block_limit(self):
+        self.pwm._forget(self.pwm._LED0_ON_L + 4 * 2, 4)
+        self.pwm.set_duty_cycles({1: 10, 3: 10})
+        self.assertEqual(len(self.pi.i2c_writes), 2)
+        del self.pi.i2c_writes[:]
+        self.pwm.set_duty_cycles([20] * 12 + [0] * 4)
+        self.assertEqual([len(data) // 4 for h, reg, data in self.pi.i2c_writes], [8, 4])
+
+    def test_all_channels_use_all_led(self):
+        self.pwm.set_duty_cycles([100] * 16)
+        self.assertEqual([reg for h, reg, data in self.pi.i2c_writes], [self.pwm._ALL_LED_ON_L])
+
+    def test_threads_keep_cache_in_step_with_chip(self):
+        def writer(offset):
+            for i in range(200):
+                self.pwm.set_duty_cycles({ch: (i + offset + ch) % 100 for ch in (4, 5, 6, 8)})
+                self.pwm.set_duty_cycle(5, (i * offset) % 100)
+        threads = [threading.Thread(target=writer, args=(n,)) for n in (1, 2, 3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5.0)
+        cached = self.pwm.dump()['channels']
+        self.assertEqual(self.pwm.sync()['channels'], cached)
+
+    def test_output_group_writes_pwm_bank(self):
+        from pyoperant import hwio
+        outputs = [hwio.PWMOutput(interface=self.raspi, params={'channel': ch}) for ch in (0, 1, 2)]
+        del self.pi.i2c_writes[:]
+        hwio.OutputGroup(outputs).write([100.0, 0.0, 100.0])
+        self.assertEqual(len(self.pi.i2c_writes), 1)
+        self.assertEqual([o.last_value for o in outputs], [100.0, 0.0, 100.0])
+
+
+# ---------------------------------------------------------------------------
+# I2C scheduler
+# ---------------------------------------------------------------------------
+
+class GatedPi(FakePi):
+    """FakePi whose I2C calls wait at a gate, to let work pile up."""
+
+    def __init__(self):
+        super(GatedPi, self).__init__()
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event()
+        self.order = []
+
+    def i2c_write_i2c_block_data(self, handle, reg, data):
+        self.entered.set()
+        self.gate.wait(1.0)
+        self.order.append((handle, reg, list(data)))
+        super(GatedPi, self).i2c_write_i2c_block_data(handle, reg, data)
+
+    def i2c_read_byte_data(self, handle, reg):
+        raise RuntimeError('bus error')
+
+
+class TestI2CScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.pi = GatedPi()
+        self.i2c = raspi_gpio_.I2CScheduler(self.pi)
+        self.lights = self.i2c.client(raspi_gpio_.PRIORITY_LIGHTS)
+        self.servo = self.i2c.client(raspi_gpio_.PRIORITY_SERVO)
+
+    def tearDown(self):
+        self.pi.gate.set()
+        self.i2c.close()
+
+    def _hold_bus(self):
+        self.pi.gate.clear()
+        self.pi.entered.clear()
+        holder = threading.Thread(target=self.lights.i2c_write_i2c_block_data,
+                                  args=(0x55, 0, [0]))
+        holder.start()
+        self.assertTrue(self.pi.entered.wait(1.0))
+        return holder
+
+    def _queue(self, client, *args):
+        t = threading.Thread(target=client.i2c_write_i2c_block_data, args=args)
+        t.start()
+        return t
+
+    def _wait_depth(self, depth):
+        deadline = time.time() + 1.0
+        while self.i2c.stats()['depth'] < depth and time.time() < deadline:
+            time.sleep(0.001)
+
+    def test_servo_goes_ahead_of_lights(self):
+        holder = self._hold_bus()
+        threads = [self._queue(self.lights, 0x55, 6, [1])]
+        self._wait_depth(1)
+        threads.append(self._queue(self.servo, 0x45, 6, [2]))
+        self._wait_depth(2)
+        self.pi.gate.set()
+        for t in [holder] + threads:
+            t.join(1.0)
+        self.assertEqual([(h, data) for h, reg, data in self.pi.order],
+                         [(0x55, [0]), (0x45, [2]), (0x55, [1])])
+
+    def test_queued_light_writes_coalesce(self):
+        holder = self._hold_bus()
+        threads = []
+        for value in (1, 2, 3):
+            threads.append(self._queue(self.lights, 0x55, 6, [value]))
+            time.sleep(0.01)
+        self.pi.gate.set()
+        for t in [holder] + threads:
+            t.join(1.0)
+        self.assertEqual([data for h, reg, data in self.pi.order], [[0], [3]])
+        stats = self.i2c.stats()
+        self.assertEqual(stats['coalesced'], 2)
+        self.assertEqual(stats['transactions'][raspi_gpio_.PRIORITY_LIGHTS], 2)
+        self.assertGreater(stats['latency'][raspi_gpio_.PRIORITY_LIGHTS]['max'], 0.0)
+
+    def test_rewrite_after_superseded_write_goes_out(self):
+        pwm = raspi_gpio_.PWM(self.lights, address=0x55)
+        reg = pwm._LED0_ON_L + 16
+        holder = self._hold_bus()
+        first = threading.Thread(target=pwm.set_duty_cycle, args=(4, 50))
+        first.start()
+        self._wait_depth(1)
+        # a newer write to the same registers replaces the queued one
+        newer = self._queue(self.lights, 0x55, reg, pwm._steps(20))
+        self._wait_depth(2)
+        self.pi.gate.set()
+        for t in (holder, first, newer):
+            t.join(1.0)
+        self.assertEqual(self.i2c.stats()['coalesced'], 1)
+        self.assertEqual(self.pi.order[-1], (0x55, reg, pwm._steps(20)))
+        # the chip never got 50%, so writing it again must not be skipped
+        pwm.set_duty_cycle(4, 50)
+        self.assertEqual(self.pi.order[-1], (0x55, reg, pwm._steps(50)))
+
+    def test_pwm_writes_from_many_threads_coalesce(self):
+        pwm = raspi_gpio_.PWM(self.lights, address=0x55)
+        reg = pwm._LED0_ON_L + 12
+        holder = self._hold_bus()
+        threads = [threading.Thread(target=pwm.set_duty_cycle, args=(3, value))
+                   for value in range(1, 20)]
+        for t in threads:
+            t.start()
+        deadline = time.time() + 1.0
+        while self.i2c.stats()['coalesced'] < 18 and time.time() < deadline:
+            time.sleep(0.001)
+        self.pi.gate.set()
+        for t in [holder] + threads:
+            t.join(1.0)
+        self.assertEqual(self.i2c.stats()['coalesced'], 18)
+        writes = [data for h, r, data in self.pi.order if r == reg]
+        self.assertEqual(len(writes), 1)
+        # the cache holds what reached the chip
+        self.assertEqual([pwm._shadow.get(reg + i) for i in range(4)], writes[0])
+
+    def test_errors_reach_the_caller(self):
+        with self.assertRaises(RuntimeError):
+            self.servo.i2c_read_byte_data(0x45, 0)
+
+    def test_interface_pwm_goes_through_scheduler(self):
+        raspi = make_raspi()
+        raspi._write_pwm(channel=0, value=90.0, servo=True)
+        counts = raspi.i2c.stats()['transactions']
+        self.assertIn(raspi_gpio_.PRIORITY_SERVO, counts)
+        self.assertIn(raspi_gpio_.PRIORITY_LIGHTS, counts)
+
+
+# ---------------------------------------------------------------------------
+# ArduinoInterface
+# ---------------------------------------------------------------------------
+
+class TestArduinoReadAll(unittest.TestCase):
+
+    def setUp(self):
+        self.arduino = make_arduino(inputs=[(2,), (3, True), (12,)], outputs=[13])
+        self.device = self.arduino.device
+
+    def test_read_all_is_one_exchange(self):
+        self.device.levels.update({2: 1, 3: 1, 12: 1})
+        del self.device.commands[:]
+        self.assertEqual(self.arduino.read_all(), {2: True, 3: False, 12: True})
+        self.assertEqual(self.device.commands, [(0, 6)])
+
+    def test_read_bank(self):
+        self.device.levels.update({12: 1})
+        values = self.arduino._read_bank([{'channel': 12}, {'channel': 2}])
+        self.assertEqual(values, [True, False])
+
+    def test_read_bank_rejects_outputs(self):
+        with self.assertRaises(InterfaceError):
+            self.arduino._read_bank([{'channel': 13}])
+
+    def test_short_reply_raises(self):
+        self.device.timeout = 0.01
+        self.device._handle = lambda pin, action: self.device._reply([2, 0])
+        with self.assertRaises(InterfaceError):
+            self.arduino.read_all()
+
+    def test_snapshot_serves_read_bool(self):
+        arduino = make_arduino(inputs=[(2,), (3,)], snapshot_ttl=10.0)
+        arduino.device.levels.update({3: 1})
+        del arduino.device.commands[:]
+        self.assertFalse(arduino._read_bool(2))
+        self.assertTrue(arduino._read_bool(3))
+        self.assertEqual(arduino.device.commands, [(0, 6)])
+
+    def test_single_read_without_snapshot(self):
+        self.device.levels.update({2: 1})
+        self.assertTrue(self.arduino._read_bool(2))
+        self.assertEqual(self.device.commands[-1], (2, 0))
+
+
+class TestArduinoStream(unittest.TestCase):
+
+    def setUp(self):
+        self.arduino = make_arduino(inputs=[(2,), (3, True)], stream=True)
+        self.device = self.arduino.device
+
+    def tearDown(self):
+        self.arduino.close()
+
+    def test_initial_levels_from_snapshot(self):
+        self.assertFalse(self.arduino._read_bool(2))
+        self.assertTrue(self.arduino._read_bool(3))  # pullup, inverted
+
+    def test_reads_are_local(self):
+        del self.device.commands[:]
+        self.arduino._read_bool(2)
+        self.arduino.read_all()
+        self.assertEqual(self.device.commands, [])
+
+    def test_poll_returns_device_time_of_edge(self):
+        micros = self.device.micros() - 20000  # 20 ms before it is sent
+        fire_later(0.02, self.device.edge, 2, 1, micros)
+        edge_time = self.arduino._poll(2, timeout=1.0)
+        self.assertEqual(edge_time, self.arduino.clock.to_datetime(micros))
+        self.assertTrue(self.arduino._read_bool(2))
+
+    def test_poll_suppresses_longpress(self):
+        self.device.edge(2, 1)
+        time.sleep(0.02)
+        self.assertIsNotNone(self.arduino._poll(2, timeout=0.1))
+        self.assertIsNone(self.arduino._poll(2, timeout=0.1))
+
+    def test_wait_any(self):
+        # channel 3 is already True (pullup, not pressed) and is ignored
+        fire_later(0.02, self.device.edge, 2, 1)
+        targets = [({'channel': 2}, True), ({'channel': 3}, True)]
+        hits = self.arduino._wait_any(targets, timeout=1.0, ignore_held=True)
+        self.assertEqual([ii for ii, t in hits], [0])
+
+    def test_stop_stream_returns_to_requests(self):
+        self.arduino.stop_stream()
+        self.device.levels[2] = 1
+        self.assertTrue(self.arduino._read_bool(2))
+        self.assertEqual(self.device.commands[-1], (2, 0))
+
+
+class TestArduinoWaitAnyPolled(unittest.TestCase):
+
+    def test_wait_any_polls_read_all(self):
+        arduino = make_arduino(inputs=[(2,), (4,)])
+        fire_later(0.03, arduino.device.levels.__setitem__, 4, 1)
+        targets = [({'channel': 2}, True), ({'channel': 4}, True)]
+        hits = arduino._wait_any(targets, timeout=1.0)
+        self.assertEqual([ii for ii, t in hits], [1])
+
+
+class TestArduinoTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.arduino = make_arduino(inputs=[(2,), (3,), (4,)], outputs=[13, 12])
+        self.device = self.arduino.device
+
+    def tearDown(self):
+        self.arduino.close()
+
+    def test_startup_config_is_one_write(self):
+        config = [w for w in self.device.writes if w]
+        self.assertEqual(len(config), 1)
+        self.assertEqual(len(config[0]), 10)
+
+    def test_several_requests_in_flight(self):
+        self.device.levels.update({3: 1})
+        transport = self.arduino.transport
+        reqs = [transport.request(self.arduino._make_arg(ch, 0), reply=arduino_.REPLY_BYTE)
+                for ch in (2, 3, 4)]
+        self.assertEqual([transport.wait(r, 1.0) for r in reqs], [0, 1, 0])
+
+    def test_hung_device_raises_in_bounded_time(self):
+        self.arduino.reply_timeout = 0.1
+        self.device.hung = True
+        start = time.time()
+        with self.assertRaises(InterfaceError):
+            self.arduino._read_bool(2)
+        self.assertLess(time.time() - start, 0.5)
+        # once it answers again, replies line up with requests
+        self.device.hung = False
+        self.device.levels[2] = 1
+        self.assertTrue(self.arduino._read_bool(2))
+
+    def test_write_bank_is_one_write(self):
+        self.arduino._write_bool_bank([{'channel': 13}, {'channel': 12}], [True, False])
+        self.arduino.transport.flush()
+        self.assertEqual(self.device.writes[-1], self.arduino._make_arg(13, 1) + self.arduino._make_arg(12, 2))
+        self.assertEqual((self.device.levels[13], self.device.levels[12]), (1, 0))
+
+    def test_write_does_not_wait_for_device(self):
+        self.device.hung = True
+        start = time.time()
+        self.assertTrue(self.arduino._write_bool(13, True))
+        self.assertLess(time.time() - start, 0.05)
+
+    def test_failed_port_raises_after_reconnect_timeout(self):
+        self.arduino.reconnect_timeout = 0.1
+        self.device.broken = True
+        start = time.time()
+        with self.assertRaises(InterfaceError):
+            self.arduino._read_bool(2)
+        self.assertLess(time.time() - start, 1.0)
+
+    def test_failed_write_fails_the_whole_batch(self):
+        device = FakeArduino()
+        device.read = lambda size=1: b''
+
+        def write(data):
+            raise sys.modules['serial'].SerialException('device disconnected')
+        device.write = write
+        transport = arduino_._SerialTransport(device, 'fake')
+        try:
+            start = time.time()
+            with self.assertRaises(InterfaceError) as cm:
+                transport.flush(timeout=1.0)
+            self.assertIn('device disconnected', str(cm.exception))
+            self.assertLess(time.time() - start, 0.5)
+        finally:
+            transport.close()
+
+    def test_close_after_failed_open(self):
+        built = []
+
+        def failing_open(arduino):
+            built.append(arduino)
+            raise InterfaceError('Could not open serial device /dev/missing')
+
+        with mock.patch.object(arduino_.ArduinoInterface, 'open', autospec=True, side_effect=failing_open):
+            with self.assertRaises(InterfaceError):
+                arduino_.ArduinoInterface('/dev/missing')
+        built[0].close()
+
+
+class FakePorts(object):
+    """serial.Serial replacement that hands out a new FakeArduino per open,
+    failing the first `failures` opens after the first"""
+
+    def __init__(self, failures=0):
+        self.opened = []
+        self.failures = failures
+
+    def __call__(self, port=None, **kwargs):
+        if self.opened and self.failures > 0:
+            self.failures -= 1
+            raise sys.modules['serial'].SerialException('could not open port %s' % port)
+        device = FakeArduino(port=port, **kwargs)
+        self.opened.append(device)
+        return device
+
+
+class TestArduinoReconnect(unittest.TestCase):
+
+    def make(self, failures=0, **kwargs):
+        self.ports = FakePorts(failures)
+        patcher = mock.patch.object(arduino_.serial, 'Serial', self.ports)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        arduino = arduino_.ArduinoInterface('/dev/fake', inputs=[(2,), (3, True)], outputs=[13], **kwargs)
+        self.addCleanup(arduino.close)
+        return arduino
+
+    def test_replays_configuration_and_outputs(self):
+        arduino = self.make()
+        arduino._write_bool(13, True)
+        arduino.transport.flush()
+        arduino.device.broken = True
+        arduino.device.levels[2] = 0
+        self.assertFalse(arduino._read_bool(2))  # waits for the reconnect
+        device = self.ports.opened[-1]
+        self.assertEqual(len(self.ports.opened), 2)
+        self.assertEqual(device.modes, {2: 4, 3: 5, 13: 3})
+        self.assertEqual(device.levels[13], 1)
+        self.assertEqual(arduino.metrics['reconnects'], 1)
+        self.assertTrue(arduino.metrics['connected'])
+        self.assertGreater(arduino.metrics['downtime'], 0.0)
+
+    def test_backs_off_while_port_is_missing(self):
+        arduino = self.make(failures=2)
+        arduino.reconnect_backoff = (0.01, 0.05)
+        arduino.device.broken = True
+        arduino._write_bool(13, False)
+        deadline = time.time() + 2.0
+        while arduino.metrics['reconnects'] == 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(arduino.metrics['reconnect_attempts'], 3)
+        self.assertEqual(arduino.metrics['reconnects'], 1)
+        self.assertEqual(self.ports.opened[-1].levels[13], 0)
+
+    def test_resumes_stream(self):
+        arduino = self.make(stream=True)
+        arduino.device.broken = True
+        fire_later(0.3, lambda: self.ports.opened[-1].edge(2, 1))
+        self.assertIsNotNone(arduino._poll(2, timeout=2.0))
+        self.assertTrue(arduino._streaming)
+        self.assertTrue(self.ports.opened[-1].streaming)
+
+
+# ---------------------------------------------------------------------------
+# ComediInterface
+# ---------------------------------------------------------------------------
+
+class TestComediPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.comedi = sys.modules['comedi'].fake
+        self.comedi.reset()
+        self.box1 = comedi_.ComediInterface('/dev/comedi0')
+        self.box2 = comedi_.ComediInterface('/dev/comedi0')
+
+    def tearDown(self):
+        self.box1.close()
+        self.box2.close()
+
+    def test_poll_returns_on_edge(self):
+        fire_later(0.02, self.comedi.activate, '/dev/comedi0', 2, 4)
+        start = time.time()
+        self.assertIsInstance(self.box1._poll(2, 4, timeout=1.0), datetime.datetime)
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_poll_returns_immediately_if_active(self):
+        self.comedi.activate('/dev/comedi0', 2, 0)
+        self.assertIsNotNone(self.box1._poll(2, 0, timeout=0.01))
+
+    def test_poll_times_out(self):
+        self.assertIsNone(self.box1._poll(2, 4, timeout=0.05))
+
+    def test_boxes_share_one_poller(self):
+        self.box1._poll(2, 0, timeout=0.01)
+        self.box2._poll(2, 24, timeout=0.01)
+        self.assertIs(self.box1.poller, self.box2.poller)
+        counts = self.comedi.counts['/dev/comedi0']
+        reads = counts['bitfield']
+        time.sleep(0.05)
+        ticks = counts['bitfield'] - reads
+        # both channels are in block 0-31: one read per tick
+        self.assertGreater(ticks, 5)
+        self.assertEqual(self.box1.poller.users, 2)
+
+    def test_poller_stops_with_last_user(self):
+        self.box1._poll(2, 0, timeout=0.01)
+        self.box2._poll(2, 0, timeout=0.01)
+        poller = self.box1.poller
+        self.box1.close()
+        self.assertFalse(poller.device.closed)
+        self.box2.close()
+        self.assertTrue(poller.device.closed)
+        self.box1 = self.box2 = comedi_.ComediInterface('/dev/comedi0')
+
+    def test_wait_any_reports_which_input(self):
+        targets = [({'subdevice': 2, 'channel': 0}, True), ({'subdevice': 2, 'channel': 4}, True)]
+        fire_later(0.02, self.comedi.activate, '/dev/comedi0', 2, 4)
+        hits = self.box1._wait_any(targets, timeout=1.0)
+        self.assertEqual([ii for ii, t in hits], [1])
+        self.assertEqual(self.box1._last_edge(2, 4, level=True), hits[0][1])
+
+    def test_write_bank_is_one_call_per_block(self):
+        counts = self.comedi.counts['/dev/comedi0']
+        writes = counts['bitfield']
+        self.box1._write_bool_bank([{'subdevice': 2, 'channel': 8},
+                                    {'subdevice': 2, 'channel': 9},
+                                    {'subdevice': 2, 'channel': 40}],
+                                   [True, False, True])
+        self.assertEqual(counts['bitfield'] - writes, 2)
+        raw = self.comedi.raw['/dev/comedi0']
+        # active low
+        self.assertEqual([raw[(2, ch)] for ch in (8, 9, 40)], [0, 1, 0])
+
+
+class TestSharedComediPoller(unittest.TestCase):
+    """Two pollers in one process stand in for two behavior processes: flock
+    locks belong to the open file, so only one of them can drive."""
+
+    def setUp(self):
+        self.comedi = sys.modules['comedi'].fake
+        self.comedi.reset()
+        self.shm_dir = tempfile.mkdtemp()
+        self.pollers = [comedi_.SharedComediPoller('/dev/comedi0', shm_dir=self.shm_dir)
+                        for _ in range(2)]
+        for poller in self.pollers:
+            poller.election_interval = 0.05
+
+    def tearDown(self):
+        for poller in self.pollers:
+            if not poller._stop.is_set():
+                poller.close()
+        shutil.rmtree(self.shm_dir)
+
+    def test_one_driver_serves_both(self):
+        box1, box2 = self.pollers
+        box1.watch(2, 4)
+        key = box2.watch(2, 28)
+        self.assertEqual(sum(p.is_driver for p in self.pollers), 1)
+        since = box2.edges.mark()
+        self.comedi.activate('/dev/comedi0', 2, 28)
+        edge = box2.edges.wait({key: True}, since=since, timeout=1.0)
+        self.assertIsNotNone(edge)
+        self.assertEqual(edge.channel, (2, 28))
+
+    def test_short_pulse_seen_by_subscriber(self):
+        box1, box2 = self.pollers
+        box1.watch(2, 4)
+        key = box2.watch(2, 4)
+        since = box2.edges.mark()
+        self.comedi.activate('/dev/comedi0', 2, 4)
+        time.sleep(0.005)
+        self.comedi.activate('/dev/comedi0', 2, 4, active=False)
+        self.assertIsNotNone(box2.edges.wait({key: False}, since=since, timeout=1.0))
+        self.assertTrue(box2.edges.edges(key, since)[0].level)
+
+    def test_subscriber_takes_over_from_closed_driver(self):
+        for poller in self.pollers:
+            poller.watch(2, 4)
+        driver = [p for p in self.pollers if p.is_driver][0]
+        other = [p for p in self.pollers if not p.is_driver][0]
+        driver.close()
+        key = (2, 4)
+        since = other.edges.mark()
+        self.comedi.activate('/dev/comedi0', 2, 4)
+        self.assertIsNotNone(other.edges.wait({key: True}, since=since, timeout=1.0))
+        self.assertTrue(other.is_driver)
+
+    def test_takeover_after_driver_died_mid_sample(self):
+        box1, box2 = self.pollers
+        box1.watch(2, 4)
+        self.assertTrue(box1.is_driver)
+        box1.close()
+        seq = struct.unpack_from('<Q', box2._map, box2._SEQ)[0]
+        struct.pack_into('<Q', box2._map, box2._SEQ, seq | 1)
+        key = box2.watch(2, 4)
+        self.assertTrue(box2.is_driver)
+        since = box2.edges.mark()
+        self.comedi.activate('/dev/comedi0', 2, 4)
+        self.assertIsNotNone(box2.edges.wait({key: True}, since=since, timeout=1.0))
+
+    def test_interface_uses_shared_poller(self):
+        box = comedi_.ComediInterface('/dev/comedi0', shared=True, shm_dir=self.shm_dir)
+        try:
+            fire_later(0.05, self.comedi.activate, '/dev/comedi0', 2, 52)
+            self.assertIsNotNone(box._poll(2, 52, timeout=1.0))
+            self.assertIsInstance(box.poller, comedi_.SharedComediPoller)
+        finally:
+            box.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)